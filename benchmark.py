@@ -0,0 +1,355 @@
+"""
+Offline benchmark: indexing, retrieval and /query_repo on synthetic repos of growing size, against a local
+stand-in for the OpenAI embedding and chat APIs with configurable latency. No API key or network access needed.
+
+Every repo size runs in a fresh process so its peak RSS is its own. Reports per stage throughput,
+p50/p95/p99 latencies and peak RSS, optionally as json (--output) to compare runs.
+To run the benchmark script repo_qa package must be installed
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from queue import Empty
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+from loguru import logger
+
+
+class FakeOpenAIServer:
+    """
+    Serves /v1/embeddings (and the /v1/engines/{model}/embeddings path openai 0.28 uses) and /v1/chat/completions
+    from a background thread. Embeddings are deterministic hashed n-gram vectors, so retrieval stays meaningful.
+    Every request sleeps 'latency' seconds plus 'per_item_latency' per embedded text.
+    """
+    def __init__(self, port: int = 8765, embedding_latency: float = 0.05, per_item_latency: float = 0.0,
+                 chat_latency: float = 0.5, embedding_dim: int = 1536):
+        self.port = port
+        self.embedding_latency = embedding_latency
+        self.per_item_latency = per_item_latency
+        self.chat_latency = chat_latency
+        self.embedding_dim = embedding_dim
+        self.url = f"http://127.0.0.1:{port}/v1"
+        self._ready = threading.Event()
+        self._error = None  # why the server thread failed to start, re-raised by start()
+        self._loop = None
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        self._ready.wait()
+        if self._error is not None:
+            raise RuntimeError(f"fake OpenAI server failed to start on port {self.port}") from self._error
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _run(self):
+        try:
+            from repo_qa.embeddings import HashingEmbeddingFunction
+            self._embedder = HashingEmbeddingFunction(dim=self.embedding_dim)
+            self._loop = asyncio.new_event_loop()
+            app = web.Application(client_max_size=256 * 2**20)
+            app.router.add_post("/v1/embeddings", self._embeddings)
+            app.router.add_post("/v1/engines/{model}/embeddings", self._embeddings)
+            app.router.add_post("/v1/chat/completions", self._chat)
+            runner = web.AppRunner(app, access_log=None)
+            self._loop.run_until_complete(runner.setup())
+            self._loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", self.port).start())
+        except BaseException as e:
+            # e.g. the port is still taken by an earlier run, start() must not wait forever
+            self._error = e
+            if self._loop is not None:
+                self._loop.close()
+                self._loop = None
+            return
+        finally:
+            self._ready.set()
+        self._loop.run_forever()
+
+    async def _embeddings(self, request):
+        body = await request.json()
+        texts = [body["input"]] if isinstance(body["input"], str) else body["input"]
+        await asyncio.sleep(self.embedding_latency + self.per_item_latency * len(texts))
+        vectors = await asyncio.get_running_loop().run_in_executor(None, self._embedder, texts)
+        return web.json_response({
+            "object": "list",
+            "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+            "model": body.get("model", "fake"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    async def _chat(self, request):
+        body = await request.json()
+        await asyncio.sleep(self.chat_latency)
+        words = ["This", " is", " a", " benchmark", " answer", "."]
+        if body.get("stream"):
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for word in words:
+                chunk = {"object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            return response
+        return web.json_response({
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+
+_WORDS = ("parse build index query cache token graph node edge chunk file repo vector score rank batch "
+          "config job worker queue stream answer question embed store load save merge split filter").split()
+
+
+def make_synthetic_repo(root: Path, n_files: int, functions_per_file: int = 8, seed: int = 0) -> list:
+    """
+    Writes a python package of 'n_files' modules under root: functions and a class per module, with docstrings
+    and calls into earlier modules, so chunking, the call graph and retrieval all have work to do.
+    Returns the defined function names.
+    """
+    rng = random.Random(seed)
+    package = root / "synthetic"
+    package.mkdir(parents=True)
+    (package / "__init__.py").write_text("")
+    names = []
+    for i in range(n_files):
+        lines = []
+        imported = rng.sample(range(i), min(i, 3))
+        lines.extend(f"from .module_{j} import {names[j * functions_per_file]}" for j in imported)
+        lines.append("")
+        module_names = []
+        for k in range(functions_per_file):
+            name = f"{rng.choice(_WORDS)}_{rng.choice(_WORDS)}_{i}_{k}"
+            module_names.append(name)
+            callees = [names[j * functions_per_file] for j in imported] + module_names[:k]
+            body = [f"    \"\"\"{' '.join(rng.choices(_WORDS, k=12))}.\"\"\"", "    total = 0"]
+            for n in range(rng.randint(3, 12)):
+                call = f"{rng.choice(callees)}(value)" if callees and rng.random() < 0.3 else f"value * {n}"
+                body.append(f"    total += {call}")
+            body.append("    return total")
+            lines.extend([f"def {name}(value):", *body, "", ""])
+        lines.extend([
+            f"class {rng.choice(_WORDS).title()}{rng.choice(_WORDS).title()}{i}:",
+            f"    \"\"\"{' '.join(rng.choices(_WORDS, k=16))}.\"\"\"",
+            "    def run(self, value):",
+            f"        return {module_names[0]}(value)",
+            "",
+        ])
+        (package / f"module_{i}.py").write_text("\n".join(lines))
+        names.extend(module_names)
+    return names
+
+
+def percentiles(latencies: list) -> dict:
+    if not latencies:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return {"p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2)}
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on linux, parse workers are children
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / 1024, 1)
+
+
+def questions_for(names: list, n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    questions = []
+    for i in range(n):
+        if i % 2:
+            questions.append(f"What does `{rng.choice(names)}` return?")
+        else:
+            questions.append(f"How does the code {rng.choice(_WORDS)} the {rng.choice(_WORDS)} {rng.choice(_WORDS)}?")
+    return questions
+
+
+def bench_size(n_files: int, args, fake_url: str) -> dict:
+    """
+    One repo size, runs in its own process.
+    """
+    import openai
+    from repo_qa.config import SystemConfig
+
+    openai.api_base = fake_url
+    SystemConfig.embedding_function = args.embedding_function
+    SystemConfig.vector_store = args.vector_store
+    SystemConfig.vector_dtype = args.vector_dtype
+    SystemConfig.answer_cache_enabled = False  # every query goes through retrieval and generation
+
+    from repo_qa.indexing import build_index
+    from repo_qa.retrieval import retrieve_with_callgraph
+
+    workdir = Path(tempfile.mkdtemp(prefix="repo_qa_bench_"))
+    try:
+        names = make_synthetic_repo(workdir / "repo", n_files)
+        cache_path = str(workdir / "embedding_cache.sqlite") if args.embedding_cache else None
+        result = {"files": n_files}
+
+        # 1. cold build, stage boundaries come from the progress callback
+        marks = {}
+        progress = lambda stage, done=0, total=0: marks.setdefault(stage, time.perf_counter())
+        started = time.perf_counter()
+        repo_data = build_index(str(workdir / "repo"), db_dir=str(workdir / "db"), openai_api_key="fake",
+                                embedding_model_name="text-embedding-ada-002", embedding_cache_path=cache_path,
+                                progress_callback=progress)
+        finished = time.perf_counter()
+        chunks = repo_data.collection.count()
+        result["chunks"] = chunks
+        result["build"] = {
+            "total_s": round(finished - started, 3),
+            # parsing, embedding and db writes overlap
+            "ingest_s": round(marks["finalizing"] - marks["parsing"], 3),
+            "finalize_s": round(finished - marks["finalizing"], 3),
+            "chunks_per_s": round(chunks / (marks["finalizing"] - marks["parsing"]), 1),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+        # 2. rebuild with nothing changed
+        repo_data.retire()
+        started = time.perf_counter()
+        repo_data = build_index(str(workdir / "repo"), db_dir=str(workdir / "db"), openai_api_key="fake",
+                                embedding_model_name="text-embedding-ada-002", embedding_cache_path=cache_path)
+        result["incremental_build_s"] = round(time.perf_counter() - started, 3)
+
+        # 3. retrieval, sequential
+        latencies = []
+        for question in questions_for(names, args.retrieval_queries):
+            started = time.perf_counter()
+            retrieve_with_callgraph(question, repo_data)
+            latencies.append(time.perf_counter() - started)
+        result["retrieval"] = {**percentiles(latencies), "qps": round(len(latencies) / sum(latencies), 1),
+                               "peak_rss_mb": peak_rss_mb()}
+
+        # 4. /query_repo through the api server, concurrently
+        result["query_repo"] = bench_query_repo(repo_data, workdir, names, args)
+        result["peak_rss_mb"] = peak_rss_mb()
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_query_repo(repo_data, workdir: Path, names: list, args) -> dict:
+    import uvicorn
+    from repo_qa import api
+
+    api.repos.db_root = workdir / "db_root"
+    api.repos.swap("bench", str(workdir / "repo"), repo_data)
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=args.api_port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    async def run():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def one(session, question):
+            async with semaphore:
+                started = time.perf_counter()
+                async with session.post(f"http://127.0.0.1:{args.api_port}/query_repo",
+                                        json={"question": question, "repo": "bench"}) as response:
+                    response.raise_for_status()
+                    await response.read()
+                latencies.append(time.perf_counter() - started)
+
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600)) as session:
+            started = time.perf_counter()
+            await asyncio.gather(*(one(session, q) for q in questions_for(names, args.api_queries, seed=1)))
+            return latencies, time.perf_counter() - started
+
+    try:
+        latencies, elapsed = asyncio.run(run())
+    finally:
+        server.should_exit = True
+        thread.join()
+    return {**percentiles(latencies), "qps": round(len(latencies) / elapsed, 1), "concurrency": args.concurrency}
+
+
+def _bench_size_process(n_files, args, fake_url, results):
+    results.put(bench_size(n_files, args, fake_url))
+
+
+def print_report(results: list):
+    header = (f"{'files':>6} {'chunks':>7} {'build s':>8} {'ingest s':>8} {'chunks/s':>9} {'rebuild s':>9} "
+              f"{'retr p50/p95/p99 ms':>22} {'query p50/p95/p99 ms':>24} {'query qps':>9} {'peak MB':>8}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        retrieval, query = r["retrieval"], r["query_repo"]
+        print(f"{r['files']:>6} {r['chunks']:>7} {r['build']['total_s']:>8} {r['build']['ingest_s']:>8} "
+              f"{r['build']['chunks_per_s']:>9} {r['incremental_build_s']:>9} "
+              f"{retrieval['p50_ms']:>7}/{retrieval['p95_ms']}/{retrieval['p99_ms']:<6} "
+              f"{query['p50_ms']:>8}/{query['p95_ms']}/{query['p99_ms']:<6} {query['qps']:>9} {r['peak_rss_mb']:>8}")
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--sizes", type=str, default="100,400,1600", help="Comma separated numbers of modules per synthetic repo")
+    parser.add_argument("--embedding_latency", type=float, default=0.05, help="Seconds per fake embedding request")
+    parser.add_argument("--per_item_latency", type=float, default=0.0, help="Extra seconds per embedded text")
+    parser.add_argument("--chat_latency", type=float, default=0.5, help="Seconds per fake chat completion")
+    parser.add_argument("--embedding_dim", type=int, default=1536, help="Dimension of the fake embeddings")
+    parser.add_argument("--retrieval_queries", type=int, default=200, help="Sequential retrieve_with_callgraph calls")
+    parser.add_argument("--api_queries", type=int, default=200, help="/query_repo requests")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent /query_repo requests")
+    parser.add_argument("--embedding_function", type=str, default="OpenAIEmbeddingFunction", help="SystemConfig.embedding_function")
+    parser.add_argument("--vector_store", type=str, default="chroma", help="SystemConfig.vector_store")
+    parser.add_argument("--vector_dtype", type=str, default="float32", help="SystemConfig.vector_dtype")
+    parser.add_argument("--embedding_cache", action="store_true", help="Use an (initially empty) embedding cache")
+    parser.add_argument("--fake_port", type=int, default=8765, help="Port of the fake OpenAI server")
+    parser.add_argument("--api_port", type=int, default=8766, help="Port of the benchmarked api server")
+    parser.add_argument("--output", type=str, default=None, help="Write the results as json to this path")
+
+    return parser.parse_args()
+
+def main():
+    args = arg_parse()
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    os.environ.setdefault("CHAT_MODEL_NAME", "gpt-4o")
+    os.environ.setdefault("EMBEDDING_MODEL_NAME", "text-embedding-ada-002")
+    fake = FakeOpenAIServer(port=args.fake_port, embedding_latency=args.embedding_latency,
+                            per_item_latency=args.per_item_latency, chat_latency=args.chat_latency,
+                            embedding_dim=args.embedding_dim).start()
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for n_files in map(int, args.sizes.split(",")):
+        logger.info(f"benchmarking a synthetic repo of {n_files} modules")
+        queue = context.Queue()
+        proc = context.Process(target=_bench_size_process, args=(n_files, args, fake.url, queue))
+        proc.start()
+        while True:
+            try:
+                results.append(queue.get(timeout=1))
+                break
+            except Empty:
+                if not proc.is_alive():
+                    raise RuntimeError(f"benchmark of {n_files} modules failed, exit code {proc.exitcode}")
+        proc.join()
+    fake.stop()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ This script is an example of how repo_qa tool may be used for code review purpos
 """
 
 import os
+import json
 import argparse
 import multiprocessing
 
@@ -14,46 +15,74 @@ import requests
 from loguru import logger
 from dotenv import load_dotenv
 
-from repo_qa.utils import run_api_server, wait_for_server, get_git_diff
+from repo_qa.config import SystemConfig
+from repo_qa.generation import pack_context
+from repo_qa.utils import run_api_server, wait_for_server, get_git_diff, index_repo, query_repo_batch
 
-# Define a "function" that the LLM can call to query your QA server
+# Define a "tool" that the LLM can call to query your QA server
 # We'll provide a schema with a name, description, and JSON parameters.
-functions = [
+# The model may call it several times in one turn, those questions are answered in a single batch request.
+tools = [
     {
-        "name": "ask_code_qa_server",
-        "description": "Send a question to the RAG-based code QA server and get the answer back.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "question": {
-                    "type": "string",
-                    "description": "A question about the codebase"
-                }
-            },
-            "required": ["question"]
+        "type": "function",
+        "function": {
+            "name": "ask_code_qa_server",
+            "description": "Send a question to the RAG-based code QA server and get the answer back.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "question": {
+                        "type": "string",
+                        "description": "A question about the codebase"
+                    }
+                },
+                "required": ["question"]
+            }
         }
     }
 ]
 
 
-def ask_code_qa_server(question: str, qa_url="http://0.0.0.0:8000/query_repo") -> str:
+def ask_code_qa_server_batch(questions: list, url="http://0.0.0.0:8000") -> list:
     """
-    Calls your existing QA server's /answer endpoint with the given question,
-    returns the answer text.
+    Answers of several questions, from /query_repo_batch requests of at most SystemConfig.max_batch_questions each
+    (the server rejects larger ones).
+    """
+    answers = []
+    for start in range(0, len(questions), SystemConfig.max_batch_questions):
+        batch = questions[start:start + SystemConfig.max_batch_questions]
+        try:
+            answers.extend(answer if answer is not None else "[ERROR: no answer]"
+                           for answer in query_repo_batch(url, batch))
+        except Exception as e:
+            answers.extend([f"[ERROR calling QA server: {e}]"] * len(batch))
+    return answers
+
+
+def fetch_diff_context(diff_text: str, url="http://0.0.0.0:8000") -> str:
+    """
+    The code the diff touches and its call graph neighbors, from the server's line range index
+    (no LLM round trip), packed under SystemConfig.max_context_tokens.
     """
     try:
-        resp = requests.post(qa_url, json={"question": question})
+        resp = requests.post(f"{url}/diff_context", json={"diff": diff_text})
         resp.raise_for_status()
-        return resp.json().get("answer", "")
     except Exception as e:
-        return f"[ERROR calling QA server: {e}]"
+        logger.warning(f"no diff context prefetched: {e}")
+        return ""
+    chunks = resp.json()["chunks"]
+    logger.info(f"prefetched {len(chunks)} chunks of context for the diff")
+    return "".join(pack_context([
+        (chunk["id"], chunk["text"], {**chunk, "name": f"{chunk['name']}, {'changed' if chunk['touched'] else 'related'}"})
+        for chunk in chunks
+    ]))
 
 
-def generate_code_review(max_iterations: int, diff_text: str) -> str:
+def generate_code_review(max_iterations: int, diff_text: str, url="http://0.0.0.0:8000") -> str:
     """
     This is the main function the user calls. We'll do a conversation with an LLM that can:
-    - See the diff
-    - Potentially call 'ask_code_qa_server' function multiple times for context
+    - See the diff, along with the code it touches and the code calling / called by it (prefetched)
+    - Potentially call 'ask_code_qa_server' multiple times for more context, possibly several calls per turn
     - Return a final "code review" style commentary
     # TODO: a nice feature will be adding a tool to post comments on github so the human developer
             may start working on remarks.
@@ -63,7 +92,9 @@ def generate_code_review(max_iterations: int, diff_text: str) -> str:
     system_prompt = (
         "You are a senior software engineer doing a code review (pull request before merge) for other engineers on the team. You can call a function "
         "to ask the RAG-based code QA server for context about the code base. "
-        "Use any discovered info (calling the function as many times as needed) to produce "
+        "The code touched by the diff and the code related to it through calls is already provided, "
+        "only ask for context beyond it (you may ask several questions at once). "
+        "Use any discovered info to produce "
         "a thorough code review of the changes in the user's diff."
         "The review should be constructive, and should include fix suggestions if possible (as code snippets or natural language comments, preferably both)"
     )
@@ -72,61 +103,60 @@ def generate_code_review(max_iterations: int, diff_text: str) -> str:
         f"The user provides the following diff. Please review it for correctness, style, "
         f"and any potential issues:\n\n{diff_text}"
     )
+    context = fetch_diff_context(diff_text, url)
+    if context:
+        user_prompt += f"\n\nCODE CONTEXT (the changed code and its callers / callees):\n{context}"
 
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
 
-    # We'll do a loop to let the model function-call the QA server as needed
+    # We'll do a loop to let the model call the QA server as needed
     # and eventually produce a final answer.
     #
     # We'll break out of the loop if the model doesn't request the function again.
-    #
-    # This is a simple approach. You can implement more advanced "agent" loops if needed.
     for _ in range(max_iterations):
         response = openai.ChatCompletion.create(
             model="gpt-4o",
             messages=messages,
-            functions=functions,
-            function_call="auto",  # Let the LLM decide when/if to call
+            tools=tools,
+            tool_choice="auto",  # Let the LLM decide when/if to call
             temperature=0.2
         )
 
         # If the LLM didn't call the function, we should have our final answer
         if "choices" in response and len(response["choices"]) > 0:
-            finish_reason = response["choices"][0]["finish_reason"]
             msg = response["choices"][0]["message"]
-
-            if finish_reason == "stop" or finish_reason is None:
+            tool_calls = msg.get("tool_calls") or []
+            if not tool_calls:
                 # The LLM is providing a final answer
-                return msg["content"]
-
-            if msg.get("function_call"):
-                # The LLM wants to call a function
-                fn_name = msg["function_call"]["name"]
-                if fn_name == "ask_code_qa_server":
-                    # The LLM is requesting context from the QA server
-                    fn_args = eval(msg["function_call"]["arguments"])
-                    question = fn_args.get("question", "")
-                    # call the actual function
-                    answer = ask_code_qa_server(question)
-                    # feed the result back into the conversation
-                    messages.append(msg)  # the function call request
-                    messages.append({
-                        "role": "function",
-                        "name": fn_name,
-                        "content": answer
-                    })
-                else:
-                    # Unexpected function name
-                    messages.append({
-                        "role": "assistant",
-                        "content": f"Error: function '{fn_name}' not recognized."
-                    })
-            else:
-                # No function call, so let's assume final
                 return msg.get("content", "")
+
+            # The LLM wants context from the QA server, all of this turn's questions go in one batch
+            messages.append(msg)  # the tool call requests
+            questions, results = [], {}
+            for call in tool_calls:
+                fn_name = call["function"]["name"]
+                if fn_name != "ask_code_qa_server":
+                    results[call["id"]] = f"Error: function '{fn_name}' not recognized."
+                    continue
+                try:
+                    fn_args = json.loads(call["function"]["arguments"] or "{}")
+                except json.JSONDecodeError as e:
+                    results[call["id"]] = f"Error: invalid JSON arguments: {e}"
+                    continue
+                questions.append((call["id"], str(fn_args.get("question", ""))))
+            if questions:
+                answers = ask_code_qa_server_batch([question for _, question in questions], url)
+                results.update((call_id, answer) for (call_id, _), answer in zip(questions, answers))
+            # feed the results back into the conversation, one message per call
+            for call in tool_calls:
+                messages.append({
+                    "role": "tool",
+                    "tool_call_id": call["id"],
+                    "content": results[call["id"]]
+                })
         else:
             # fallback
             return "Error: No response from LLM."
@@ -156,12 +186,12 @@ def main():
     wait_for_server(f"{url}/health")
 
     # index given repo
-    requests.post(url=f"{url}/index_repo", json={"repo_path": args.repo_path})
+    index_repo(url, args.repo_path)
 
     # query the system with reference Q&A
     ## RUN AGENT
     git_diff = get_git_diff(args.repo_path)
-    results = generate_code_review(max_iterations=args.max_iterations, diff_text=git_diff)
+    results = generate_code_review(max_iterations=args.max_iterations, diff_text=git_diff, url=url)
     logger.info(results)
 
     # stop API server
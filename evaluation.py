@@ -4,18 +4,20 @@ To run the evaluation script repo_qa package must be installed
 import multiprocessing
 import argparse
 import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 import requests
 from loguru import logger
 from dotenv import load_dotenv
 from rouge_score import rouge_scorer
 
-from repo_qa.utils import wait_for_server, run_api_server
+from repo_qa.utils import wait_for_server, run_api_server, index_repo
 
-def evaluate(endpoint="http://0.0.0.0:8000/query_repo", reference_file="reference_qa.json"):
+def evaluate(endpoint="http://0.0.0.0:8000/query_repo", reference_file="reference_qa.json", workers=8):
     """
     1. Reads question/answer pairs from reference_file.
-    2. For each question, calls our service at api_url.
+    2. Calls our service at api_url for all questions, at most 'workers' at a time.
     3. Compares system answer to reference answer using ROUGE-L.
     4. Prints average ROUGE-L F1 over all pairs.
     """
@@ -32,15 +34,20 @@ def evaluate(endpoint="http://0.0.0.0:8000/query_repo", reference_file="referenc
     rouge_l_f_score_total = 0.0
     count = 0
 
-    for idx, item in enumerate(references):
+    def ask(item):
+        response = requests.post(endpoint, json={"question": item["question"]})
+        response.raise_for_status()
+        return response.json().get("answer", "")
+
+    # 1. Call your QA service, concurrently (answers come back in reference order)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(ask, item) for item in references]
+
+    for idx, (item, future) in enumerate(zip(references, futures)):
         question = item["question"]
         reference_answer = item["reference_answer"]
-
-        # 1. Call your QA service
         try:
-            response = requests.post(endpoint, json={"question": question})
-            response.raise_for_status()
-            system_answer = response.json().get("answer", "")
+            system_answer = future.result()
         except Exception as e:
             logger.error(f"[Error] Could not get answer for Q{idx} -> {e}")
             continue
@@ -75,6 +82,71 @@ def evaluate(endpoint="http://0.0.0.0:8000/query_repo", reference_file="referenc
         logger.info("No valid reference questions evaluated.")
 
 
+def covered_references(source: dict, reference_files: list, reference_symbols: list) -> set:
+    """
+    The reference files / symbols a retrieved chunk covers. Files match by path suffix ("grip/app.py"),
+    symbols by qualified name suffix ("DirectoryReader.readme_for", "wait_for_server").
+    """
+    path = Path(source["file_path"]).as_posix()
+    qualname = source.get("qualname") or source.get("name") or ""
+    hits = {("file", f) for f in reference_files if path == f or path.endswith("/" + f)}
+    hits.update(("symbol", s) for s in reference_symbols if qualname == s or qualname.endswith("." + s))
+    return hits
+
+def score_retrieval(sources: list, reference_files: list, reference_symbols: list, ks: list) -> dict:
+    """
+    recall@k: share of the reference files and symbols covered by the first k retrieved chunks.
+    reciprocal rank: 1 / rank of the first retrieved chunk covering any of them, 0 if none does.
+    """
+    n_references = len(reference_files) + len(reference_symbols)
+    covered_by_rank = [covered_references(source, reference_files, reference_symbols) for source in sources]
+    scores = {}
+    for k in ks:
+        covered = set().union(*covered_by_rank[:k])
+        scores[f"recall@{k}"] = len(covered) / n_references
+    first = next((rank for rank, covered in enumerate(covered_by_rank, start=1) if covered), None)
+    scores["mrr"] = 1 / first if first else 0.0
+    return scores
+
+def evaluate_retrieval(endpoint="http://0.0.0.0:8000/retrieve", reference_file="reference_qa.json", workers=8,
+                       top_ks=(10,), depths=(2,), ks=(1, 5, 10)):
+    """
+    Retrieval only, no answers are generated: scores the retrieved chunks of every annotated question
+    ("reference_files" / "reference_symbols" in reference_file) with recall@k and MRR,
+    for every combination of top_k and call graph depth.
+    Returns {(top_k, depth): {metric: mean}}.
+    """
+    with open(reference_file, "r") as f:
+        references = [
+            item for item in json.load(f) if item.get("reference_files") or item.get("reference_symbols")
+        ]
+    logger.info(f"{len(references)} annotated questions in {reference_file}")
+
+    def retrieve(request):
+        response = requests.post(endpoint, json=request)
+        response.raise_for_status()
+        return response.json()["sources"]
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for top_k in top_ks:
+            for depth in depths:
+                payloads = [{"question": item["question"], "top_k": top_k, "depth": depth} for item in references]
+                totals, count = {}, 0
+                for idx, (item, sources) in enumerate(zip(references, pool.map(retrieve, payloads))):
+                    scores = score_retrieval(
+                        sources, item.get("reference_files", []), item.get("reference_symbols", []), ks
+                    )
+                    logger.debug(f"Q{idx} top_k={top_k} depth={depth} -> {scores}")
+                    for metric, value in scores.items():
+                        totals[metric] = totals.get(metric, 0.0) + value
+                    count += 1
+                results[(top_k, depth)] = {metric: total / count for metric, total in totals.items()} if count else {}
+                metrics = ", ".join(f"{metric}: {value:.3f}" for metric, value in results[(top_k, depth)].items())
+                logger.info(f"top_k={top_k} depth={depth} -> {metrics}")
+    return results
+
+
 def arg_parse():
     parser = argparse.ArgumentParser()
 
@@ -83,6 +155,12 @@ def arg_parse():
     parser.add_argument("--reference_file_path", type=str, default="reference_qa.json", help="Path to reference qa json file")
     parser.add_argument("--host", type=str, default="0.0.0.0", help="API server address")
     parser.add_argument("--port", type=int, default=8000, help="API server port")
+    parser.add_argument("--workers", type=int, default=8, help="Max concurrent requests to the API server")
+    parser.add_argument("--mode", type=str, default="answers", choices=["answers", "retrieval"],
+                        help="'answers' scores generated answers with ROUGE, 'retrieval' scores retrieved chunks with recall@k / MRR")
+    parser.add_argument("--top_k", type=str, default="10", help="retrieval mode: comma separated top_k_entities values to try")
+    parser.add_argument("--depth", type=str, default="2", help="retrieval mode: comma separated max_callgraph_depth values to try")
+    parser.add_argument("--ks", type=str, default="1,5,10", help="retrieval mode: comma separated k of recall@k")
 
     return parser.parse_args()
 
@@ -97,10 +175,21 @@ def main():
     wait_for_server(f"{url}/health")
 
     # index given repo
-    requests.post(url=f"{url}/index_repo", json={"repo_path": args.repo_path})
-
-    # query the system with reference Q&A
-    evaluate(endpoint=f"{url}/query_repo", reference_file=args.reference_file_path)
+    index_repo(url, args.repo_path)
+
+    if args.mode == "retrieval":
+        # score the retrieved chunks only, no generation
+        evaluate_retrieval(
+            endpoint=f"{url}/retrieve",
+            reference_file=args.reference_file_path,
+            workers=args.workers,
+            top_ks=[int(k) for k in args.top_k.split(",")],
+            depths=[int(d) for d in args.depth.split(",")],
+            ks=[int(k) for k in args.ks.split(",")]
+        )
+    else:
+        # query the system with reference Q&A
+        evaluate(endpoint=f"{url}/query_repo", reference_file=args.reference_file_path, workers=args.workers)
 
     # stop API server
     proc.terminate()
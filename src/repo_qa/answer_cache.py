@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from .config import SystemConfig
+
+
+class CachedAnswer:
+    def __init__(self, question: str, answer: str, sources: list, embedding: np.ndarray, owner: int):
+        self.question = question
+        self.answer = answer
+        self.sources = sources
+        self.embedding = embedding
+        self.owner = owner
+        self.created = time.monotonic()
+
+
+class SemanticAnswerCache:
+    """
+    Answers keyed by question similarity: a question whose embedding has cosine similarity >= 'threshold'
+    with a cached one reuses its answer, skipping retrieval and generation.
+    Byte-identical questions (after whitespace/case normalization) are served without even embedding them,
+    answers stored without an embedding (questions that were never embedded) only match that way.
+    Bounded by 'max_entries' (LRU) and 'ttl' seconds. Entries belong to the index ('owner') they were computed
+    from and never match another one, drop_owner() forgets them once that index is replaced or unloaded.
+    Unit embeddings are kept as rows of one matrix updated in place: a row is written on store and freed on
+    eviction, so a lookup is a single matrix-vector product whatever was stored since the last one.
+    """
+    def __init__(self,
+                 threshold: float = SystemConfig.answer_cache_threshold,
+                 max_entries: int = SystemConfig.answer_cache_max_entries,
+                 ttl: float = SystemConfig.answer_cache_ttl):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()  # (owner, normalized question) -> CachedAnswer, in LRU order
+        self._lock = threading.Lock()
+        self._vectors = None  # unit embeddings, rows [0, _n_rows) are in use or free, capacity grows by doubling
+        self._owners = np.zeros(0, dtype=np.int64)  # owner of each row, -1 for a free row
+        self._row_keys = []  # _entries key of each row, None for a free row
+        self._rows = {}  # _entries key -> row
+        self._free_rows = []
+        self._n_rows = 0
+
+    @staticmethod
+    def _normalize(question: str) -> str:
+        return " ".join(question.lower().split())
+
+    def get_exact(self, question: str, owner: int) -> Optional[CachedAnswer]:
+        key = (owner, self._normalize(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._expired(entry):
+                    self._remove(key)
+                    return None
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        return None
+
+    def lookup(self, embedding, owner: int) -> Optional[CachedAnswer]:
+        """
+        Most similar cached answer above the threshold, None (counted as a miss) otherwise.
+        """
+        query = self._unit(embedding)
+        with self._lock:
+            if self._n_rows and self._vectors.shape[1] == len(query):
+                scores = self._vectors[:self._n_rows] @ query
+                scores[self._owners[:self._n_rows] != owner] = -np.inf
+                for i in np.argsort(-scores):
+                    if scores[i] < self.threshold:
+                        break
+                    key = self._row_keys[i]
+                    entry = self._entries[key]
+                    if self._expired(entry):
+                        self._remove(key)
+                        continue
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+            self.misses += 1
+        return None
+
+    def store(self, question: str, embedding, answer: str, sources: list, owner: int):
+        key = (owner, self._normalize(question))
+        with self._lock:
+            embedding = self._unit(embedding) if embedding is not None else None
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CachedAnswer(question, answer, sources, embedding, owner)
+            if embedding is not None:
+                self._add_row(key, embedding, owner)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def drop_owner(self, owner: int):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == owner]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vectors = None
+            self._owners = np.zeros(0, dtype=np.int64)
+            self._row_keys, self._rows, self._free_rows, self._n_rows = [], {}, [], 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+    def _expired(self, entry: CachedAnswer) -> bool:
+        return self.ttl is not None and time.monotonic() - entry.created > self.ttl
+
+    def _add_row(self, key: tuple, embedding: np.ndarray, owner: int):
+        if self._vectors is not None and self._vectors.shape[1] != len(embedding):
+            # another embedding model, rows of the previous one can never match again
+            for stale in self._rows:
+                self._entries[stale].embedding = None
+            self._vectors = None
+            self._row_keys, self._rows, self._free_rows, self._n_rows = [], {}, [], 0
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = self._n_rows
+            if self._vectors is None or row == len(self._vectors):
+                capacity = max(16, 2 * row)
+                vectors = np.zeros((capacity, len(embedding)), dtype=np.float32)
+                owners = np.full(capacity, -1, dtype=np.int64)
+                if self._vectors is not None:
+                    vectors[:row] = self._vectors[:row]
+                    owners[:row] = self._owners[:row]
+                self._vectors, self._owners = vectors, owners
+            self._row_keys.append(None)
+            self._n_rows += 1
+        self._vectors[row] = embedding
+        self._owners[row] = owner
+        self._row_keys[row] = key
+        self._rows[key] = row
+
+    def _remove(self, key: tuple):
+        del self._entries[key]
+        row = self._rows.pop(key, None)
+        if row is not None:
+            self._owners[row] = -1
+            self._row_keys[row] = None
+            self._free_rows.append(row)
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
@@ -1,65 +1,407 @@
 import argparse
+import asyncio
+import contextvars
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import aiohttp
 import uvicorn
-from fastapi import FastAPI, Body, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Body, HTTPException, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from loguru import logger
 
-from .indexing import build_index
-from .retrieval import retrieve_with_callgraph
-from .generation import generate_answer
+from .answer_cache import SemanticAnswerCache
+from .indexing import build_index, load_index, RepoData
+from .jobs import IndexJobManager
+from .metrics import REGISTRY, REQUEST_SECONDS, server_timing_header, start_request_timings, timed
+from .registry import RepoRegistry, repo_name, is_valid_repo_name
+from .config import SystemConfig
+from .retrieval import retrieve_batch, retrieve_for_diff, retrieve_with_callgraph, needs_query_embedding
+from .generation import agenerate_answer, astream_answer
+from .walker import resolve_revision
 
-class RepoData:
-    def __init__(self, collections=None, call_graph=None):
-        self.collection = collections
-        self.call_graph = call_graph
 app = FastAPI()
-repo_data = RepoData()
+answer_cache = SemanticAnswerCache()
+index_jobs = IndexJobManager()
+
+def _load_repo_data(db_dir: str) -> RepoData:
+    return load_index(
+        db_dir,
+        openai_api_key=os.getenv("OPENAI_API_KEY", None),
+        embedding_model_name=os.getenv("EMBEDDING_MODEL_NAME", None)
+    )
+
+# answers computed against a replaced or unloaded index are never served again
+repos = RepoRegistry(loader=_load_repo_data, on_unload=lambda data: answer_cache.drop_owner(data.uid))
+
+@app.on_event("startup")
+async def startup():
+    # one pooled HTTP client for all LLM calls and a dedicated pool for blocking retrieval work
+    app.state.llm_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=SystemConfig.llm_max_connections),
+        timeout=aiohttp.ClientTimeout(total=SystemConfig.llm_request_timeout)
+    )
+    app.state.retrieval_executor = ThreadPoolExecutor(
+        max_workers=SystemConfig.retrieval_workers, thread_name_prefix="retrieval"
+    )
+    preload = getattr(app.state, "preload", None)
+    if preload is not None:
+        await _preload(preload)
+
+async def _preload(names: list):
+    """
+    Load the indexes of 'names' (every known repo when empty) before the server starts accepting requests.
+    The default repo is loaded last, so it is the last one evicted if they do not all fit in memory.
+    """
+    names = names or repos.names()
+    names = sorted(names, key=lambda name: name == repos.default)
+    loaded = []
+    for name in names:
+        try:
+            await _run_blocking(repos.get, name)
+            loaded.append(name)
+        except (KeyError, FileNotFoundError, ValueError) as e:
+            logger.warning(f"not preloading repo {name}: {e!r}")
+    logger.info(f"preloaded {len(loaded)} repo indexes: {loaded}")
+
+@app.middleware("http")
+async def request_timings(request: Request, call_next):
+    """
+    Times every request and reports its stages (embedding, vector_query, generation, ...) in a Server-Timing header.
+    A streamed response is timed until its headers are sent.
+    """
+    started = time.perf_counter()
+    timings = start_request_timings()
+    response = await call_next(request)
+    # label by route handler, not by path, so the number of series stays bounded
+    endpoint = request.scope.get("endpoint")
+    REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=getattr(endpoint, "__name__", "unmatched"))
+    header = server_timing_header(timings)
+    if header is not None:
+        response.headers["Server-Timing"] = header
+    return response
+
+@app.on_event("shutdown")
+async def shutdown():
+    await app.state.llm_session.close()
+    app.state.retrieval_executor.shutdown(wait=False)
+    index_jobs.shutdown()
+    repos.unload_all()
 
 @app.post("/index_repo")
 def index_repo(payload: dict = Body(...)):
     """
-    Build the index and call graph when the app starts.
+    Expects {"repo_path": "...", "repo": "...", "revision": "..."}, "repo" is the name queries refer to (defaults to
+    the directory name). An optional "revision" (branch, tag or commit) is indexed from the git object store without
+    a checkout, the default name is then "{directory name}-{revision}".
+    Submits a background job that builds the index and call graph, returns 202 with its id.
+    Queries keep being served from the previous index of the repo until the new one is swapped in.
+    Poll GET /index_jobs/{job_id} for progress.
     """
 
     repo_path = payload["repo_path"]
     if not os.path.exists(repo_path):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"repo path does not exist: {repo_path}")
-    logger.info(f"starting indexing repo: {repo_path}")
-    col, cg = build_index(
-        repo_path=repo_path,
-        openai_api_key=os.getenv("OPENAI_API_KEY", None),
-        embedding_model_name=os.getenv("EMBEDDING_MODEL_NAME", None)
+    revision = payload.get("revision")
+    commit = None
+    if revision is not None:
+        try:
+            # a branch may move before the job runs, build and register the commit it names now
+            commit = resolve_revision(repo_path, revision)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    name = payload.get("repo") or repo_name(repo_path, revision)
+    if not is_valid_repo_name(name):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"invalid repo name: {name}")
+    logger.info(f"submitting indexing job for repo {name}: {repo_path}")
+
+    def build(job):
+        return build_index(
+            repo_path=repo_path,
+            db_dir=repos.repo_dir(name),
+            openai_api_key=os.getenv("OPENAI_API_KEY", None),
+            embedding_model_name=os.getenv("EMBEDDING_MODEL_NAME", None),
+            progress_callback=job.update_progress,
+            revision=commit
+        )
+
+    job = index_jobs.submit(f"{repo_path}@{revision}" if revision else repo_path, build,
+                            on_success=lambda new_repo_data: repos.swap(name, repo_path, new_repo_data, commit))
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"job_id": job.id, "repo": name, "status_url": f"/index_jobs/{job.id}"}
     )
-    repo_data.collection = col
-    repo_data.call_graph = cg
 
-    logger.info(f"finished indexing repo: {repo_path}")
-    return JSONResponse(content={"message": f"Successfully indexed {repo_path}"})
+@app.get("/repos")
+def list_repos():
+    return JSONResponse(content=repos.describe())
+
+@app.get("/index_jobs/{job_id}")
+def index_job_status(job_id: str):
+    job = index_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"unknown index job: {job_id}")
+    return JSONResponse(content=job.as_dict())
+
+@app.get("/index_jobs")
+def list_index_jobs():
+    return JSONResponse(content=[job.as_dict() for job in index_jobs.list()])
 
 @app.post("/query_repo")
-def query_repo(payload: dict = Body(...)):
+async def query_repo(payload: dict = Body(...)):
     """
-    Expects {"question": "..."}
+    Expects {"question": "...", "repo": "..."}, without "repo" the most recently indexed repo is queried.
     Returns: {"answer": "..."}
     """
     question = payload["question"]
     logger.info(f"building answer for user question: {question}")
+    data = await _get_repo_data(payload.get("repo"))
+
+    # 0. Answer cache
+    cached, embedding = await _lookup_answer_cache(question, data)
+    if cached is not None:
+        logger.info(f"answer cache hit, matched question: {cached.question}")
+        return JSONResponse(content={"answer": cached.answer})
 
-    # 1. Retrieve with callgraph
-    retrieved = retrieve_with_callgraph(question, repo_data.collection, repo_data.call_graph)
+    # 1. Retrieve with callgraph (blocking embedding + vector query, kept off the event loop)
+    retrieved = await _run_blocking(retrieve_with_callgraph, question, data, embedding)
     # 2. Generate answer
     logger.info(f"generating final answer")
-    final_answer = generate_answer(
+    final_answer = await agenerate_answer(
         question,
         retrieved,
         openai_api_key=os.getenv("OPENAI_API_KEY"),
-        chat_model_name=os.getenv("CHAT_MODEL_NAME")
+        chat_model_name=os.getenv("CHAT_MODEL_NAME"),
+        session=app.state.llm_session
     )
+    if SystemConfig.answer_cache_enabled:
+        answer_cache.store(question, embedding, final_answer, _sources(retrieved), owner=data.uid)
     return JSONResponse(content={"answer": final_answer})
 
+@app.post("/query_repo_batch")
+async def query_repo_batch(payload: dict = Body(...)):
+    """
+    Expects {"questions": ["...", ...], "repo": "..."}, see /query_repo
+    The questions share one embedding request, one vector query and one fetch of the chunks they expand to,
+    their answers are generated concurrently.
+    Returns answers in input order: {"answers": [{"question": "...", "answer": "..."}, ...]},
+    a question whose generation failed has "answer": null and an "error".
+    """
+    questions = payload["questions"]
+    if not isinstance(questions, list) or not all(isinstance(question, str) for question in questions):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="questions must be a list of strings")
+    if len(questions) > SystemConfig.max_batch_questions:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"at most {SystemConfig.max_batch_questions} questions per batch"
+        )
+    # a question asked twice in the batch is answered once
+    unique = list(dict.fromkeys(questions))
+    logger.info(f"building answers for a batch of {len(unique)} questions")
+    data = await _get_repo_data(payload.get("repo"))
+    answers = [None] * len(unique)
+
+    # 0. Answer cache, the embeddings computed for the lookup are handed on to retrieval
+    embeddings = [None] * len(unique)
+    if SystemConfig.answer_cache_enabled:
+        for i, question in enumerate(unique):
+            cached = answer_cache.get_exact(question, owner=data.uid)
+            if cached is not None:
+                answers[i] = cached.answer
+        to_embed = [
+            i for i, question in enumerate(unique) if answers[i] is None and needs_query_embedding(question, data)
+        ]
+        if to_embed:
+            with timed("embedding"):
+                computed = await _run_blocking(data.embedder, [unique[i] for i in to_embed])
+            for i, embedding in zip(to_embed, computed):
+                embeddings[i] = embedding
+                cached = answer_cache.lookup(embedding, owner=data.uid)
+                if cached is not None:
+                    answers[i] = cached.answer
+    pending = [i for i in range(len(unique)) if answers[i] is None]
+    logger.info(f"{len(unique) - len(pending)} answers served from the answer cache")
+
+    errors = {}
+    if pending:
+        # 1. Retrieve for all pending questions at once
+        retrieved = await _run_blocking(
+            retrieve_batch, [unique[i] for i in pending], data, [embeddings[i] for i in pending]
+        )
+        # 2. Generate concurrently, a failed generation does not fail the others
+        generated = await asyncio.gather(*(
+            agenerate_answer(
+                unique[i],
+                chunks,
+                openai_api_key=os.getenv("OPENAI_API_KEY"),
+                chat_model_name=os.getenv("CHAT_MODEL_NAME"),
+                session=app.state.llm_session
+            )
+            for i, chunks in zip(pending, retrieved)
+        ), return_exceptions=True)
+        for i, chunks, answer in zip(pending, retrieved, generated):
+            if isinstance(answer, Exception):
+                logger.error(f"generation failed for question {unique[i]!r}: {answer}")
+                errors[unique[i]] = str(answer)
+                continue
+            answers[i] = answer
+            if SystemConfig.answer_cache_enabled:
+                answer_cache.store(unique[i], embeddings[i], answer, _sources(chunks), owner=data.uid)
+
+    by_question = dict(zip(unique, answers))
+    results = []
+    for question in questions:
+        result = {"question": question, "answer": by_question[question]}
+        if question in errors:
+            result["error"] = errors[question]
+        results.append(result)
+    return JSONResponse(content={"answers": results})
+
+@app.post("/retrieve")
+async def retrieve(payload: dict = Body(...)):
+    """
+    Expects {"question": "...", "repo": "...", "top_k": int, "depth": int}, "top_k" and "depth" are optional
+    overrides of SystemConfig.top_k_entities and SystemConfig.max_callgraph_depth.
+    Returns the retrieved chunks in rank order, without generating an answer: {"sources": [...]}
+    """
+    question = payload["question"]
+    data = await _get_repo_data(payload.get("repo"))
+    retrieved = await _run_blocking(
+        lambda: retrieve_with_callgraph(question, data, top_k=payload.get("top_k"), depth=payload.get("depth"))
+    )
+    return JSONResponse(content={"sources": _sources(retrieved)})
+
+@app.post("/diff_context")
+async def diff_context(payload: dict = Body(...)):
+    """
+    Expects {"diff": "unified diff", "repo": "...", "depth": int}, "depth" overrides SystemConfig.max_callgraph_depth.
+    Returns the chunks the diff touches and their call graph neighbors, touched ones first:
+    {"chunks": [{"id", "text", "touched", "file_path", "name", "qualname", "start_line", "end_line"}, ...]}
+    """
+    data = await _get_repo_data(payload.get("repo"))
+    touched, neighbors = await _run_blocking(lambda: retrieve_for_diff(payload["diff"], data, depth=payload.get("depth")))
+    chunks = []
+    for is_touched, retrieved in ((True, touched), (False, neighbors)):
+        for source, (doc_id, doc_text, _) in zip(_sources(retrieved), retrieved):
+            chunks.append({"id": doc_id, "text": doc_text, "touched": is_touched, **source})
+    return JSONResponse(content={"chunks": chunks})
+
+@app.post("/query_repo_stream")
+async def query_repo_stream(payload: dict = Body(...)):
+    """
+    Expects {"question": "...", "repo": "..."}, see /query_repo
+    Returns a Server-Sent Events stream:
+      event: sources -> [{"file_path", "name", "qualname", "start_line", "end_line"}, ...] of the retrieved chunks
+      event: delta   -> {"delta": "..."} answer text, as generated
+      event: done    -> {}
+    """
+    question = payload["question"]
+    logger.info(f"streaming answer for user question: {question}")
+    data = await _get_repo_data(payload.get("repo"))
+
+    cached, embedding = await _lookup_answer_cache(question, data)
+    if cached is not None:
+        logger.info(f"answer cache hit, matched question: {cached.question}")
+
+        async def cached_events():
+            yield _sse("sources", cached.sources)
+            yield _sse("delta", {"delta": cached.answer})
+            yield _sse("done", {})
+
+        return StreamingResponse(cached_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    retrieved = await _run_blocking(retrieve_with_callgraph, question, data, embedding)
+
+    async def events():
+        sources = _sources(retrieved)
+        yield _sse("sources", sources)
+        answer_parts = []
+        try:
+            async for delta in astream_answer(
+                question,
+                retrieved,
+                openai_api_key=os.getenv("OPENAI_API_KEY"),
+                chat_model_name=os.getenv("CHAT_MODEL_NAME"),
+                session=app.state.llm_session
+            ):
+                answer_parts.append(delta)
+                yield _sse("delta", {"delta": delta})
+        except Exception as e:
+            # headers are already sent, report the failure in-band
+            logger.error(f"streaming generation failed: {e}")
+            yield _sse("error", {"detail": str(e)})
+            return
+        if SystemConfig.answer_cache_enabled:
+            answer_cache.store(question, embedding, "".join(answer_parts), sources, owner=data.uid)
+        yield _sse("done", {})
+
+    # no-cache / no proxy buffering, so every delta reaches the client as soon as it is produced
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _get_repo_data(name) -> RepoData:
+    """
+    Resolve the queried repo, loading its index off the event loop if it is not in memory.
+    """
+    try:
+        repos.resolve(name)
+    except KeyError:
+        detail = f"unknown repo: {name}" if name else "no repo has been indexed"
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+    try:
+        return await _run_blocking(repos.get, name)
+    except (FileNotFoundError, ValueError) as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+async def _run_blocking(func, *args):
+    """
+    Runs 'func' on the retrieval executor, in a copy of the current context so its stages are timed for the request.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(app.state.retrieval_executor, lambda: context.run(func, *args))
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _sources(retrieved: list) -> list:
+    return [
+        {key: meta.get(key) for key in ("file_path", "name", "qualname", "start_line", "end_line")}
+        for _, _, meta in retrieved
+    ]
+
+async def _lookup_answer_cache(question: str, data: RepoData):
+    """
+    Returns (cached answer or None, question embedding or None).
+    The embedding is computed at most once and handed on to retrieval on a miss.
+    Questions retrieval answers without an embedding (see needs_query_embedding) are only matched exactly.
+    """
+    if not SystemConfig.answer_cache_enabled:
+        return None, None
+    cached = answer_cache.get_exact(question, owner=data.uid)
+    if cached is not None or not needs_query_embedding(question, data):
+        return cached, None
+    with timed("embedding"):
+        embeddings = await _run_blocking(data.embedder, [question])
+    return answer_cache.lookup(embeddings[0], owner=data.uid), embeddings[0]
+
+@app.get("/answer_cache/stats")
+def answer_cache_stats():
+    return JSONResponse(content=answer_cache.stats())
+
+@app.get("/metrics")
+def metrics():
+    """
+    Stage latency histograms, context size and LLM token counters, in the Prometheus text format.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 def health():
     return JSONResponse(content={})
@@ -70,6 +412,8 @@ def parse_args():
     parser.add_argument("--env_file", type=str, default=".env", help="path to .env file")
     parser.add_argument("--host", type=str, default="0.0.0.0", help="api host")
     parser.add_argument("--port", type=int, default=8000, help="api port")
+    parser.add_argument("--preload", type=str, nargs="*", default=None, metavar="REPO",
+                        help="load the indexes of these repos (all indexed repos if none is given) at startup")
 
     return parser.parse_args()
 
@@ -80,6 +424,7 @@ def main():
         raise ValueError(f".env file not found: {args.env_file}")
 
     load_dotenv(dotenv_path=args.env_file)
+    app.state.preload = args.preload
     uvicorn.run(app, host=args.host, port=args.port)
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+
+from loguru import logger
+
+# serializes swaps and recoveries in this process, so a loader never "recovers" a directory mid-swap
+_swap_lock = threading.Lock()
+
+
+def make_tmp_dir(path: Path) -> Path:
+    """
+    A new, uniquely named directory next to 'path' to write its next version into.
+    Unique per call: two threads of one process rewriting 'path' never share it.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return Path(tempfile.mkdtemp(prefix=f"{path.name}.tmp-", dir=path.parent))
+
+
+def replace_dir(tmp_path: Path, path: Path):
+    """
+    Replace the directory 'path' with 'tmp_path'.
+    A rename cannot replace a non-empty directory, so the current one is first moved aside to '{path}.old-*':
+    if the process dies between the two renames, recover_dir puts it back on the next load.
+    Readers that memory-mapped the old files keep them until they drop them.
+    """
+    with _swap_lock:
+        old_path = None
+        if path.exists():
+            old_path = path.with_name(f"{path.name}.old-{uuid.uuid4().hex}")
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+    if old_path is not None:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+def recover_dir(path: Path) -> bool:
+    """
+    Restore 'path' from the '.old-*' copy an interrupted replace_dir left behind, when 'path' itself is missing.
+    Returns True if 'path' exists afterwards.
+    """
+    with _swap_lock:
+        if path.exists():
+            return True
+        old_paths = sorted(path.parent.glob(f"{path.name}.old-*"), key=lambda p: p.stat().st_mtime, reverse=True)
+        if not old_paths:
+            return False
+        logger.warning(f"{path} is missing after an interrupted update, restoring it from {old_paths[0]}")
+        os.replace(old_paths[0], path)
+        return True
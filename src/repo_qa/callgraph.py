@@ -1,26 +1,119 @@
-
 import ast
-from collections import defaultdict
-from pathlib import Path
+from collections import defaultdict, deque
+from pathlib import PurePosixPath
 
-class CallGraphBuilder(ast.NodeVisitor):
+import numpy as np
+
+
+UNRESOLVED = "?"  # prefix of a call reference that could only be resolved to a bare name
+UNRESOLVED_ATTR = "?."  # same, for a method called on a receiver of unknown type
+# neither is linked by merge_call_graphs: a method name alone ('x.update()') or a name that is neither
+# defined nor imported by the module (a parameter, a local, a builtin) says nothing about which definition it is
+
+
+def module_name(rel_path: str) -> str:
+    """
+    Dotted module name of a repo relative path, e.g. 'pkg/sub/mod.py' -> 'pkg.sub.mod', 'pkg/__init__.py' -> 'pkg'.
     """
+    parts = list(PurePosixPath(rel_path).with_suffix("").parts)
+    if parts and parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
 
+
+def iter_statements(node: ast.AST):
+    """
+    Walk statements only. Definitions and imports are always statements, so expressions
+    (the bulk of any AST) never need to be visited to find them.
     """
-    def __init__(self):
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, (ast.stmt, ast.excepthandler, ast.match_case)):
+            yield child
+            yield from iter_statements(child)
+
+
+def qualified_names(tree: ast.AST, module: str) -> dict:
+    """
+    { function/class node -> qualified name (module.Class.method) } for every definition in 'tree'.
+    """
+    names = {}
+
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                qualname = f"{prefix}.{child.name}" if prefix else child.name
+                names[child] = qualname
+                visit(child, qualname)
+            elif isinstance(child, (ast.stmt, ast.excepthandler, ast.match_case)):
+                visit(child, prefix)
+
+    visit(tree, module)
+    return names
+
+
+class CallGraphBuilder(ast.NodeVisitor):
+    """
+    Collects, for a single module, the qualified names it defines and the calls made from each definition.
+    Callees are resolved as far as a single file allows: through imports, enclosing scopes and self./cls. receivers.
+    A bare name that is none of those may come from a 'from module import *', it is referenced as module.name
+    for every such module. Anything else is kept as UNRESOLVED(_ATTR) + bare name, which merge_call_graphs drops.
+    """
+    def __init__(self, module: str = "", is_package: bool = False):
+        self.module = module
+        # relative imports in a package's __init__ resolve against the package itself
+        self.package = module if is_package else module.rpartition(".")[0]
         self.current_func = None # keep track of last visited func
-        self.graph = defaultdict(set)  # e.g. {"functionA": {"functionB", "functionC"}}
-        self.defined_funcs = set()  # hold all function names we identify
+        self.scope = []  # (qualified name, is_class) of each enclosing definition
+        self.class_stack = []  # qualified names of enclosing classes, the target of self. / cls.
+        self.graph = defaultdict(set)  # e.g. {"mod.functionA": {"mod.functionB", "?get"}}
+        self.defined_funcs = set()  # hold all qualified names we identify
+        self.imports = {}  # local alias -> qualified name it refers to
+        self.star_imports = []  # modules of 'from module import *'
+
+    def visit_Module(self, node):
+        # imports and definitions are collected up front, calls may precede them in the file
+        self.defined_funcs.update(qualified_names(node, self.module).values())
+        for child in iter_statements(node):
+            if isinstance(child, ast.Import):
+                for alias in child.names:
+                    if alias.asname:
+                        self.imports[alias.asname] = alias.name
+                    else:
+                        root = alias.name.split(".")[0]
+                        self.imports[root] = root
+            elif isinstance(child, ast.ImportFrom):
+                base = self._import_base(child)
+                for alias in child.names:
+                    if alias.name == "*":
+                        self.star_imports.append(base)
+                    else:
+                        self.imports[alias.asname or alias.name] = f"{base}.{alias.name}" if base else alias.name
+        self.generic_visit(node)
+
+    def _import_base(self, node):
+        if not node.level:
+            return node.module or ""
+        package_parts = self.package.split(".") if self.package else []
+        if node.level > 1:
+            package_parts = package_parts[:len(package_parts) - (node.level - 1)]
+        if node.module:
+            package_parts.append(node.module)
+        return ".".join(package_parts)
+
+    def _qualify(self, name):
+        prefix = self.scope[-1][0] if self.scope else self.module
+        return f"{prefix}.{name}" if prefix else name
 
     def visit_FunctionDef(self, node):
         # Record that we have a function named node.name
         old_func = self.current_func
-        self.current_func = node.name
-        self.defined_funcs.add(node.name)
+        self.current_func = self._qualify(node.name)
+        self.scope.append((self.current_func, False))
 
         # Continue walking the function body
         self.generic_visit(node)
         # Restore
+        self.scope.pop()
         self.current_func = old_func
 
     def visit_AsyncFunctionDef(self, node):
@@ -30,42 +123,215 @@ class CallGraphBuilder(ast.NodeVisitor):
     def visit_ClassDef(self, node):
         # We can treat classes as well, if we want class-level calls or methods
         old_func = self.current_func
-        self.current_func = node.name
-        self.defined_funcs.add(node.name)
+        self.current_func = self._qualify(node.name)
+        self.scope.append((self.current_func, True))
+        self.class_stack.append(self.current_func)
 
         self.generic_visit(node)
+        self.class_stack.pop()
+        self.scope.pop()
         self.current_func = old_func
 
     def visit_Call(self, node):
-        # If the function name is directly a Name node
-        if isinstance(node.func, ast.Name):
-            called_name = node.func.id
-            if self.current_func and called_name:
-                self.graph[self.current_func].add(called_name)
-        # If it's an Attribute, e.g., self.some_method or module.function
-        elif isinstance(node.func, ast.Attribute):
-            # For simplicity, just store the final attribute name
-            called_name = node.func.attr
-            if self.current_func and called_name:
+        if self.current_func:
+            called_name = self._resolve(node.func)
+            if called_name and called_name.startswith(UNRESOLVED) and not called_name.startswith(UNRESOLVED_ATTR) \
+                    and self.star_imports:
+                name = called_name[len(UNRESOLVED):]
+                self.graph[self.current_func].update(f"{base}.{name}" for base in self.star_imports)
+            elif called_name:
                 self.graph[self.current_func].add(called_name)
         # Continue traversing
         self.generic_visit(node)
 
+    def _resolve(self, func):
+        # If the function name is directly a Name node
+        if isinstance(func, ast.Name):
+            return self._resolve_name(func.id)
+        # If it's an Attribute, e.g., self.some_method or module.function
+        if isinstance(func, ast.Attribute):
+            parts = [func.attr]
+            value = func.value
+            while isinstance(value, ast.Attribute):
+                parts.append(value.attr)
+                value = value.value
+            if isinstance(value, ast.Name):
+                root = value.id
+                parts.reverse()
+                if root in ("self", "cls") and self.class_stack and len(parts) == 1:
+                    return f"{self.class_stack[-1]}.{parts[0]}"
+                resolved_root = self._resolve_name(root)
+                if not resolved_root.startswith(UNRESOLVED):
+                    return ".".join([resolved_root, *parts])
+            return UNRESOLVED_ATTR + func.attr
+        return None
+
+    def _resolve_name(self, name):
+        # innermost enclosing scope first, then the module, then imports.
+        # as in python, a class body is only visible from the class body itself, not from its methods
+        prefixes = [self.module] + [
+            qualname for depth, (qualname, is_class) in enumerate(self.scope, start=1)
+            if not is_class or depth == len(self.scope)
+        ]
+        for prefix in reversed(prefixes):
+            candidate = f"{prefix}.{name}" if prefix else name
+            if candidate in self.defined_funcs:
+                return candidate
+        if name in self.imports:
+            return self.imports[name]
+        return UNRESOLVED + name
+
 
-def build_call_graph(repo_path: str):
+class CallGraph:
     """
-    Parse all .py files in repo_path, build a global call graph
-    { caller_name -> set of callee_names }
+    Call graph over interned integer symbol ids, stored as CSR adjacency arrays (forward: callees, reverse: callers).
+    symbols[i] is the qualified name of symbol i; the callees of i are
+    fwd_targets[fwd_offsets[i]:fwd_offsets[i + 1]], callers are found the same way in the rev_* arrays.
     """
-    builder = CallGraphBuilder()
-    repo_path = Path(repo_path)
-    for py_file in repo_path.rglob("*.py"):
-        try:
-            with open(py_file, "r", encoding="utf-8") as f:
-                source = f.read()
-            tree = ast.parse(source)
-            builder.visit(tree)
-        except Exception as e:
-            print(f"Failed on {py_file}: {e}")
-
-    return dict(builder.graph), builder.defined_funcs
+    def __init__(self, symbols: list, fwd_offsets: np.ndarray, fwd_targets: np.ndarray,
+                 rev_offsets: np.ndarray, rev_targets: np.ndarray):
+        self.symbols = symbols
+        self.symbol_ids = {name: i for i, name in enumerate(symbols)}
+        self.fwd_offsets = fwd_offsets
+        self.fwd_targets = fwd_targets
+        self.rev_offsets = rev_offsets
+        self.rev_targets = rev_targets
+
+    @classmethod
+    def from_edges(cls, symbols: list, sources: np.ndarray, targets: np.ndarray):
+        n = len(symbols)
+        sources = np.asarray(sources, dtype=np.int32)
+        targets = np.asarray(targets, dtype=np.int32)
+        fwd_offsets, fwd_targets = cls._csr(n, sources, targets)
+        rev_offsets, rev_targets = cls._csr(n, targets, sources)
+        return cls(symbols, fwd_offsets, fwd_targets, rev_offsets, rev_targets)
+
+    @staticmethod
+    def _csr(n, sources, targets):
+        order = np.lexsort((targets, sources))
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+        return offsets, targets[order].astype(np.int32)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, name):
+        return name in self.symbol_ids
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.fwd_targets)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.fwd_offsets, self.fwd_targets, self.rev_offsets, self.rev_targets))
+
+    def callees(self, name) -> list:
+        return self._adjacent(name, self.fwd_offsets, self.fwd_targets)
+
+    def callers(self, name) -> list:
+        return self._adjacent(name, self.rev_offsets, self.rev_targets)
+
+    def _adjacent(self, name, offsets, targets):
+        i = self.symbol_ids.get(name)
+        if i is None:
+            return []
+        return [self.symbols[j] for j in targets[offsets[i]:offsets[i + 1]]]
+
+    def neighbors(self, start_name, depth=1, reverse=False) -> list:
+        """
+        Qualified names reachable from 'start_name' within 'depth' steps, following calls, or callers when
+        'reverse' is set. In BFS order (nearest first, then by symbol order), starting with 'start_name' itself,
+        so callers that truncate the list drop the same names in every process.
+        """
+        start = self.symbol_ids.get(start_name)
+        if start is None:
+            return [start_name]
+        offsets, targets = (self.rev_offsets, self.rev_targets) if reverse else (self.fwd_offsets, self.fwd_targets)
+        visited = {start}
+        order = []
+        queue = deque([(start, 0)])
+        while queue:
+            node, dist = queue.popleft()
+            order.append(node)
+            if dist >= depth:
+                continue
+            for neigh in targets[offsets[node]:offsets[node + 1]].tolist():
+                if neigh not in visited:
+                    visited.add(neigh)
+                    queue.append((neigh, dist + 1))
+        return [self.symbols[i] for i in order]
+
+
+def build_file_call_graph(source: str, tree: ast.AST = None, rel_path: str = ""):
+    """
+    Build the call graph fragment of a single python source ('tree' is its already parsed AST, if available).
+    Returns ({ caller -> sorted list of callee references }, sorted list of defined qualified names),
+    both json serializable so fragments can be stored and merged later.
+    """
+    builder = CallGraphBuilder(module_name(rel_path), is_package=rel_path.endswith("__init__.py"))
+    builder.visit(tree if tree is not None else ast.parse(source))
+    graph = {caller: sorted(callees) for caller, callees in builder.graph.items()}
+    return graph, sorted(builder.defined_funcs)
+
+
+def merge_call_graphs(fragments) -> CallGraph:
+    """
+    Link (graph, defined_funcs) fragments into a single CallGraph.
+    Callee references are resolved against every defined symbol: exact match first, then a unique dotted suffix of
+    at least two components (absolute imports vs. repo relative module names, re-exports).
+    A name alone is never enough: UNRESOLVED(_ATTR) references, dotted references none of whose suffixes is
+    defined (e.g. a method inherited from a base class), calls that stay ambiguous and calls outside the repo
+    are dropped, so 'path.resolve()' or 'x.save()' never link to the one 'resolve' / 'save' of the repo.
+    """
+    fragments = list(fragments)
+    symbols = sorted({name for _, defined in fragments for name in defined})
+    symbol_ids = {name: i for i, name in enumerate(symbols)}
+
+    by_suffix = defaultdict(list)
+    namespaces = set()  # every module / class name component, tells repo references from external ones
+    for name in symbols:
+        parts = name.split(".")
+        namespaces.update(parts[:-1])
+        for k in range(1, len(parts)):
+            by_suffix[".".join(parts[k:])].append(name)
+
+    resolved_cache = {}
+
+    def resolve(ref):
+        if ref in resolved_cache:
+            return resolved_cache[ref]
+        if ref.startswith(UNRESOLVED):
+            candidates = []
+        elif ref in symbol_ids:
+            candidates = [ref]
+        elif ref.split(".")[0] not in namespaces:
+            # e.g. 'requests.post', a call into a third party package
+            candidates = []
+        else:
+            parts = ref.split(".")
+            candidates = by_suffix.get(ref, [])
+            while len(parts) > 2 and not candidates:
+                parts = parts[1:]
+                candidates = by_suffix.get(".".join(parts), [])
+        target = symbol_ids[candidates[0]] if len(candidates) == 1 else None
+        resolved_cache[ref] = target
+        return target
+
+    edges = set()
+    for graph, _ in fragments:
+        for caller, callees in graph.items():
+            source = symbol_ids.get(caller)
+            if source is None:
+                continue
+            for ref in callees:
+                target = resolve(ref)
+                if target is not None and target != source:
+                    edges.add((source, target))
+
+    if edges:
+        sources, targets = zip(*edges)
+    else:
+        sources, targets = (), ()
+    return CallGraph.from_edges(symbols, np.array(sources, dtype=np.int32), np.array(targets, dtype=np.int32))
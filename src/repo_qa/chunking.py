@@ -1,61 +1,153 @@
-import os
 import ast
 from pathlib import Path
 
+from .callgraph import module_name, qualified_names
 from .config import SystemConfig
+from .notebooks import cell_spans
 
-def extract_code_blocks(repo_path: str):
+def extract_file_blocks(file: Path, source: str, tree: ast.AST = None, lines: list = None, module: str = None):
     """
-    Walks through all files in repo_path (that also has an interesting suffix) and yields (chunk_text, metadata).
-    - For Python files: splits by function/class definitions
-    - For non-Python files: no split, entire file is taken as a single chunk
+    Yields (chunk_text, metadata) for a single file whose content is 'source'.
+    'tree' and 'lines' may be passed in when the caller already parsed / split the source (see parsing.parse_file).
+    'module' is the dotted module name used for the qualified names of python blocks, defaults to the file stem.
+    Python blocks are hierarchical, so no line of code is stored twice:
+    - a class yields its skeleton (class body with method bodies elided, see class_skeleton)
+    - each method / function yields its full text, nested functions stay inside their parent
+    - 'parent' metadata holds the qualified name of the enclosing class, if any
+    A notebook's 'source' is its notebooks.notebook_script: its definitions are chunked like a python file's,
+    and its cells are grouped into "cells" chunks in which those definitions are elided (see notebook_cell_blocks).
+    Line numbers of notebook blocks refer to the script.
     """
-    repo_path = Path(repo_path)
-    for file in repo_path.rglob("*"):
-        if not file.is_file() or os.stat(file).st_size == 0:
-            continue
-        elif file.suffix in SystemConfig.file_suffixes:
-            try:
-                with open(file, "r") as f:
-                    source = f.read()
-                if file.suffix == ".py":
-                    tree = ast.parse(source)
-                    for node in ast.walk(tree):
-                        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
-                            start_line = node.lineno
-                            end_line = getattr(node, 'end_lineno', None)
-                            if end_line is None:
-                                end_line = find_end_line(node)
+    if lines is None:
+        lines = source.split("\n")
+    if file.suffix in (".py", ".ipynb"):
+        if tree is None:
+            tree = ast.parse(source)
+        if file.suffix == ".ipynb":
+            yield from notebook_cell_blocks(file, tree, lines)
+        qualnames = qualified_names(tree, module if module is not None else module_name(file.name))
+        for node, parent in _iter_definitions(tree):
+            start_line = node.lineno
+            end_line = getattr(node, 'end_lineno', None)
+            if end_line is None:
+                end_line = find_end_line(node)
+
+            if isinstance(node, ast.ClassDef):
+                code_block = class_skeleton(node, lines, end_line)
+            else:
+                code_block = "\n".join(lines[start_line-1:end_line])
+
+            metadata = {
+                "file_path": str(file),
+                "name": node.name,
+                "qualname": qualnames[node],
+                "parent": qualnames[parent] if parent is not None else "",
+                "block_type": (
+                    "class" if isinstance(node, ast.ClassDef) else "function"
+                ),
+                "start_line": start_line,
+                "end_line": end_line
+            }
+            yield code_block, metadata
+    else:
+        # Handle non-Python files by splitting into fixed-size chunks
+        for i in range(0, len(lines), SystemConfig.max_chunk_size):
+            chunk_lines = lines[i:i + SystemConfig.max_chunk_size]
+            chunk = "\n".join(chunk_lines)
+            metadata = {
+                "file_path": str(file),
+                "name": f"chunk_{i//SystemConfig.max_chunk_size + 1}",
+                "block_type": "text",
+                "start_line": i + 1,
+                "end_line": min(i + SystemConfig.max_chunk_size, len(lines))
+            }
+            yield chunk, metadata
 
-                            code_lines = source.split("\n")[start_line-1:end_line]
-                            code_block = "\n".join(code_lines)
+def notebook_cell_blocks(file: Path, tree: ast.Module, lines: list):
+    """
+    Yields (chunk_text, metadata) for consecutive notebook cells, grouped up to SystemConfig.notebook_chunk_chars.
+    A markdown cell following code starts a new group, so explanations stay with the code they introduce.
+    Bodies of top level definitions are elided, they are chunks of their own.
+    """
+    definitions = [
+        node for node in tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+    ]
+    group, size, has_code = [], 0, False
+    for number, (cell_type, start_line, end_line) in enumerate(cell_spans(lines), start=1):
+        cell_size = sum(len(line) + 1 for line in lines[start_line-1:end_line])
+        if group and (size + cell_size > SystemConfig.notebook_chunk_chars or (cell_type == "markdown" and has_code)):
+            yield _cell_group_block(file, group, definitions, lines)
+            group, size, has_code = [], 0, False
+        group.append((number, start_line, end_line))
+        size += cell_size
+        has_code = has_code or cell_type == "code"
+    if group:
+        yield _cell_group_block(file, group, definitions, lines)
+
+def _cell_group_block(file: Path, group: list, definitions: list, lines: list):
+    first, start_line, _ = group[0]
+    last, _, end_line = group[-1]
+    inside = [node for node in definitions if start_line <= node.lineno <= end_line]
+    metadata = {
+        "file_path": str(file),
+        "name": f"cells_{first}" if first == last else f"cells_{first}-{last}",
+        "block_type": "cells",
+        "start_line": start_line,
+        "end_line": end_line
+    }
+    return _elide_bodies(inside, lines, start_line, end_line), metadata
+
+def _iter_definitions(node, parent=None):
+    """
+    Yields (definition node, enclosing class node or None) in source order.
+    Does not descend into functions: their nested definitions are part of the function's own chunk.
+    """
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, ast.ClassDef):
+            yield child, parent
+            yield from _iter_definitions(child, child)
+        elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            yield child, parent
+        elif isinstance(child, (ast.stmt, ast.excepthandler, ast.match_case)):
+            # definitions under if / try / with blocks
+            yield from _iter_definitions(child, parent)
+
+def class_skeleton(node: ast.ClassDef, lines: list, end_line: int) -> str:
+    """
+    Source of a class with the bodies of its direct methods / inner classes replaced by '...'
+    (their signature and docstring are kept). Those bodies are chunks of their own.
+    """
+    return _elide_bodies(node.body, lines, node.lineno, end_line)
+
+def _elide_bodies(nodes: list, lines: list, start_line: int, end_line: int) -> str:
+    """
+    lines[start_line..end_line] with the bodies of the definitions among 'nodes' replaced by '...'.
+    """
+    out = []
+    cursor = start_line
+    for child in nodes:
+        if not isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        body = child.body
+        keep_until = body[0].lineno - 1  # signature
+        if _is_docstring(body[0]):
+            keep_until = body[0].end_lineno
+            body = body[1:]
+        if not body or body[0].lineno <= child.lineno:
+            # nothing left to elide, or a one-liner
+            continue
+        out.extend(lines[cursor-1:keep_until])
+        out.append(" " * body[0].col_offset + "...")
+        cursor = (child.end_lineno or find_end_line(child)) + 1
+    out.extend(lines[cursor-1:end_line])
+    return "\n".join(out)
 
-                            metadata = {
-                                "file_path": str(file),
-                                "name": node.name,
-                                "block_type": (
-                                    "class" if isinstance(node, ast.ClassDef) else "function"
-                                ),
-                                "start_line": start_line,
-                                "end_line": end_line
-                            }
-                            yield code_block, metadata
-                else:
-                    # Handle non-Python files by splitting into fixed-size chunks
-                    lines = source.split("\n")
-                    for i in range(0, len(lines), SystemConfig.max_chunk_size):
-                        chunk_lines = lines[i:i + SystemConfig.max_chunk_size]
-                        chunk = "\n".join(chunk_lines)
-                        metadata = {
-                            "file_path": str(file),
-                            "name": f"chunk_{i//SystemConfig.max_chunk_size + 1}",
-                            "block_type": "text",
-                            "start_line": i + 1,
-                            "end_line": min(i + SystemConfig.max_chunk_size, len(lines))
-                        }
-                        yield chunk, metadata
-            except Exception as e:
-                print(f"Skipping file {file}")
+def _is_docstring(statement) -> bool:
+    return (
+        isinstance(statement, ast.Expr)
+        and isinstance(statement.value, ast.Constant)
+        and isinstance(statement.value.value, str)
+    )
 
 def find_end_line(node):
     """
@@ -5,15 +5,75 @@ class SystemConfig:
     """
     # generation
     max_generation_tokens = 800
+    max_context_tokens = 6000  # budget for the code context packed into the prompt
     generation_temperature = 0.3
+    llm_max_connections = 100  # pooled connections to the LLM endpoint, per server process
+    llm_request_timeout = 120  # seconds
 
     # indexing
-    embedding_function = "OpenAIEmbeddingFunction"
+    embedding_function = "OpenAIEmbeddingFunction"  # a key of embeddings.EMBEDDING_PROVIDERS
+    local_embedding_dim = 1024  # HashingEmbeddingFunction, runs offline
+    local_embedding_ngrams = (3, 4, 5)
+    embedding_batch_size = 256  # documents per embedding request
+    embedding_max_tokens = 8191  # model input limit, CoherentChunkOpenAIEmbeddingFunction splits longer documents
+    embedding_overlap_tokens = 128  # shared by consecutive windows of a split document
+    embedding_request_max_inputs = 2048  # API limits of one embedding request
+    embedding_request_max_tokens = 300_000
+    embedding_workers = 4  # concurrent embedding requests
+    db_write_batch_size = 1024  # documents per collection.add call
+    vector_store = "chroma"  # or "numpy": exact search over a memory-mapped matrix (vector_store.NumpyVectorStore)
+    vector_dtype = "float32"  # numpy store only: float32, float16 or int8 (1/2 and 1/4 of the memory)
+    ingestion_queue_size = 8  # max in-flight batches between pipeline stages
+    embedding_cache_path = "~/.cache/repo_qa/embedding_cache.sqlite"  # shared by all indexes, None disables it
+    embedding_cache_max_entries = 1_000_000
+    parse_cache_path = "~/.cache/repo_qa/parse_cache.sqlite"  # parsed git blobs, shared by all revisions, None disables it
+    parse_cache_max_entries = 200_000
 
     # retrieval
     top_k_entities = 10
     max_callgraph_depth = 2
+    expand_callers = False  # also pull in the direct callers of each top-k entity
+    hybrid_retrieval = True  # fuse BM25 over identifiers with the vector search (reciprocal rank fusion)
+    exact_identifier_fast_path = True  # questions naming a defined entity skip the question embedding
+    fusion_candidates = 20  # results taken from each ranking before fusion
+    rrf_k = 60
+    bm25_k1 = 1.2
+    bm25_b = 0.75
+    retrieval_workers = 32  # threads running blocking retrieval (embedding + vector query) off the event loop
+    max_batch_questions = 32  # questions per /query_repo_batch request
+    diff_context_max_chunks = 50  # chunks returned by /diff_context, touched ones first
+
+    # background indexing
+    index_jobs_history = 100  # finished index jobs kept for status queries
+
+    # multi repo serving
+    db_root = "./db_dir"  # every indexed repo gets its own persist directory under it
+    max_loaded_indexes = 8  # indexes kept in memory, least recently queried ones are unloaded first
+    max_loaded_index_bytes = 4 * 2**30  # estimated memory of all loaded indexes
+    index_bytes_per_chunk = 16_384  # rough in-memory cost of one stored chunk (vector, hnsw links, text, metadata)
+
+    # answer cache
+    answer_cache_enabled = True
+    answer_cache_threshold = 0.95  # min cosine similarity between questions to reuse an answer
+    answer_cache_max_entries = 1000
+    answer_cache_ttl = 3600  # seconds, None keeps entries until evicted
+
+    # repository walk (see walker.iter_source_files)
+    respect_gitignore = True
+    include_globs = []  # gitignore style patterns, when set only matching files are indexed
+    exclude_globs = []  # gitignore style patterns, applied on top of .gitignore
+    excluded_dirs = [
+        ".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv", ".tox", ".nox", ".eggs",
+        ".mypy_cache", ".pytest_cache", ".ruff_cache", "site-packages", "build", "dist",
+    ]  # pruned by name at any depth, virtualenvs (a pyvenv.cfg) are pruned too
+    max_file_bytes = 1_000_000  # larger files are generated or data, not code worth embedding
+    max_notebook_bytes = 100_000_000  # notebooks are mostly output payload, dropped before chunking
 
     # chunking
-    file_suffixes = [".py", ".ipynb", ".toml", ".ini", ".md", ".yml", "yaml", ""]
+    file_suffixes = [".py", ".ipynb", ".toml", ".ini", ".md", ".yml", ".yaml", ""]  # "": extensionless text files
     max_chunk_size = 8000
+    notebook_chunk_chars = 4000  # consecutive cells are grouped into chunks up to this size
+    notebook_output_chars = 1000  # text kept from the outputs of a code cell, 0 drops them
+    parse_workers = None  # processes used to parse files, None means os.cpu_count()
+    parse_min_files_per_worker = 16
+    parse_blob_batch_files = 256  # git blobs read and parsed at a time when indexing a revision
@@ -0,0 +1,67 @@
+import hashlib
+from typing import Callable, List, Optional
+
+import numpy as np
+from chromadb.api.types import Documents, Embeddings
+
+from .config import SystemConfig
+from .sqlite_cache import SqliteLRUCache
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", errors="surrogatepass")).hexdigest()
+
+
+class EmbeddingCache(SqliteLRUCache):
+    """
+    Disk backed, content addressed embedding cache keyed by (embedding model name, sha256 of the text).
+    Entries are float32 blobs, see SqliteLRUCache for sharing and eviction.
+    """
+    table = "embeddings"
+    columns = "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL"
+    key_columns = ("model", "text_hash")
+    value_column = "vector"
+
+    def __init__(self, path: str, max_entries: int = SystemConfig.embedding_cache_max_entries):
+        super().__init__(path, max_entries)
+
+    def get_many(self, model_name: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Cached embedding for every text, None where it is missing.
+        """
+        blobs = self._get_values([(model_name, text_hash(t)) for t in texts])
+        return [np.frombuffer(blob, dtype=np.float32).tolist() if blob is not None else None for blob in blobs]
+
+    def put_many(self, model_name: str, texts: List[str], embeddings: Embeddings):
+        self._put_rows([
+            (model_name, text_hash(t), np.asarray(e, dtype=np.float32).tobytes())
+            for t, e in zip(texts, embeddings)
+        ])
+
+
+class CachedEmbeddingFunction:
+    """
+    Wraps a chroma embedding function, only texts missing from the cache are sent to 'embedder'.
+    Meant for code blocks: questions rarely repeat (and repeated ones hit the answer cache), they are embedded with
+    'embedder' directly rather than costing a cache write each.
+    """
+    def __init__(self, embedder: Callable, cache: EmbeddingCache, model_name: str):
+        self.embedder = embedder
+        self.cache = cache
+        self.model_name = model_name
+
+    def __call__(self, texts: Documents) -> Embeddings:
+        embeddings = self.cache.get_many(self.model_name, texts)
+        # identical texts inside one batch are embedded once
+        missing = {}
+        for i, e in enumerate(embeddings):
+            if e is None:
+                missing.setdefault(texts[i], []).append(i)
+        if missing:
+            missing_texts = list(missing)
+            computed = self.embedder(missing_texts)
+            self.cache.put_many(self.model_name, missing_texts, computed)
+            for text, e in zip(missing_texts, computed):
+                for i in missing[text]:
+                    embeddings[i] = e
+        return embeddings
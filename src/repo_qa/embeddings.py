@@ -0,0 +1,202 @@
+import zlib
+from collections import Counter
+from typing import Callable, Optional
+
+import numpy as np
+from chromadb.utils import embedding_functions
+from chromadb.api.types import Documents, Embeddings
+
+from .config import SystemConfig
+from .tokens import identifiers, identifier_tokens, split_tokens
+
+class CoherentChunkOpenAIEmbeddingFunction(embedding_functions.OpenAIEmbeddingFunction):
+    """
+    OpenAI embeddings for documents of any length: a document over 'max_tokens' is split on token boundaries into
+    windows overlapping by 'overlap' tokens, and its vector is the mean of its windows' vectors weighted by their
+    token counts, L2 normalized.
+    Windows are sent in as few requests as the API limits allow ('max_inputs' inputs and 'max_request_tokens' tokens
+    per request), merging is done over one contiguous matrix.
+    """
+    def __init__(self, api_key: Optional[str] = None, model_name: str = "text-embedding-ada-002", organization_id: Optional[str] = None, api_base: Optional[str] = None, api_type: Optional[str] = None,
+                 max_tokens: int = SystemConfig.embedding_max_tokens,
+                 overlap: int = SystemConfig.embedding_overlap_tokens,
+                 max_inputs: int = SystemConfig.embedding_request_max_inputs,
+                 max_request_tokens: int = SystemConfig.embedding_request_max_tokens):
+        super().__init__(api_key, model_name, organization_id, api_base, api_type)
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.max_inputs = max_inputs
+        self.max_request_tokens = max_request_tokens
+
+    def __call__(self, texts: Documents) -> Embeddings:
+        if not texts:
+            return []
+        # 1. Split every document into windows, doc_starts[i] is the index of document i's first window
+        windows, weights, doc_starts = [], [], []
+        for text in texts:
+            # Replace newlines to avoid negative performance impact
+            doc_starts.append(len(windows))
+            for window, n_tokens in split_tokens(text.replace("\n", " "), self.max_tokens, self.overlap,
+                                                 self._model_name):
+                windows.append(window)
+                weights.append(max(n_tokens, 1))
+
+        # 2. Embed the windows in requests under the API's input and token limits
+        vectors = None
+        for batch_start, batch_end in self._batches(weights):
+            response = self._client.create(input=windows[batch_start:batch_end], engine=self._model_name)
+            for item in response["data"]:
+                if vectors is None:
+                    vectors = np.empty((len(windows), len(item["embedding"])), dtype=np.float32)
+                vectors[batch_start + item["index"]] = item["embedding"]
+
+        # 3. Length weighted mean per document
+        weights = np.asarray(weights, dtype=np.float32)
+        starts = np.asarray(doc_starts)
+        merged = np.add.reduceat(vectors * weights[:, None], starts, axis=0)
+        merged /= np.add.reduceat(weights, starts)[:, None]
+        norms = np.linalg.norm(merged, axis=1, keepdims=True)
+        merged /= np.where(norms > 0, norms, 1.0)
+        return merged.tolist()
+
+    def _batches(self, weights: list):
+        """
+        (start, end) window ranges, each one request.
+        """
+        start, tokens = 0, 0
+        for i, n_tokens in enumerate(weights):
+            if i > start and (i - start >= self.max_inputs or tokens + n_tokens > self.max_request_tokens):
+                yield start, i
+                start, tokens = i, 0
+            tokens += n_tokens
+        yield start, len(weights)
+
+
+class HashingEmbeddingFunction:
+    """
+    Local, dependency free embedding: hashed character n-grams plus identifier tokens (see tokens.identifier_tokens),
+    sublinear term frequencies, L2 normalized. Runs in-process with NumPy, no network and no model download.
+    Deterministic across processes and vocabulary free, so vectors of unchanged chunks never need recomputing.
+    Much weaker than a learned model for paraphrased questions, strong when questions reuse names from the code.
+    """
+    _FNV_OFFSET = np.uint32(0x811c9dc5)
+    _FNV_PRIME = np.uint32(0x01000193)
+    _MAX_MEMO_IDENTIFIERS = 1_000_000
+
+    def __init__(self,
+                 dim: int = SystemConfig.local_embedding_dim,
+                 ngram_sizes: tuple = SystemConfig.local_embedding_ngrams,
+                 identifier_weight: float = 2.0):
+        self.dim = dim
+        self.ngram_sizes = tuple(ngram_sizes)
+        self.identifier_weight = identifier_weight
+        self._identifier_buckets = {}  # identifiers repeat a lot across chunks, tokenize and hash each one once
+
+    def __call__(self, texts: Documents) -> Embeddings:
+        n_texts = len(texts)
+        if not n_texts:
+            return []
+        counts = self._ngram_counts(texts) + self.identifier_weight * self._identifier_counts(texts)
+        matrix = np.log1p(counts).reshape(n_texts, self.dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1.0)
+        return matrix.astype(np.float32).tolist()
+
+    def _ngram_counts(self, texts: Documents) -> np.ndarray:
+        """
+        Byte n-grams of all texts hashed at once (FNV-1a over sliding windows of one concatenated buffer),
+        windows crossing a text boundary are dropped. Returns flat (n_texts * dim) counts.
+        """
+        # whitespace runs (mostly indentation) carry no meaning and would dominate the n-grams
+        encoded = [" ".join(t.lower().split()).encode("utf-8", errors="surrogatepass") for t in texts]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint32)
+        text_of = np.repeat(np.arange(len(encoded)), lengths)
+        ends = np.cumsum(lengths)[text_of]  # end offset of the text each byte belongs to
+
+        counts = np.zeros(len(encoded) * self.dim)
+        for size in self.ngram_sizes:
+            n_windows = len(buffer) - size + 1
+            if n_windows <= 0:
+                continue
+            hashes = np.full(n_windows, self._FNV_OFFSET, dtype=np.uint32)
+            for k in range(size):
+                # uint32 arithmetic wraps around, as FNV expects
+                hashes ^= buffer[k:k + n_windows]
+                hashes *= self._FNV_PRIME
+            valid = np.arange(n_windows) + size <= ends[:n_windows]
+            buckets = ((hashes[valid] >> np.uint32(16)) ^ hashes[valid]) % np.uint32(self.dim)
+            counts += np.bincount(text_of[:n_windows][valid] * self.dim + buckets.astype(np.int64),
+                                  minlength=counts.size)
+        return counts
+
+    def _identifier_counts(self, texts: Documents) -> np.ndarray:
+        """
+        Identifier tokens (see tokens.identifier_tokens) of all texts, returns flat (n_texts * dim) counts.
+        """
+        flat, weights = [], []
+        memo = self._identifier_buckets
+        for i, text in enumerate(texts):
+            offset = i * self.dim
+            for identifier, count in Counter(identifiers(text)).items():
+                buckets = memo.get(identifier)
+                if buckets is None:
+                    if len(memo) >= self._MAX_MEMO_IDENTIFIERS:
+                        memo.clear()
+                    buckets = memo[identifier] = [
+                        zlib.crc32(token.encode("utf-8")) % self.dim for token in identifier_tokens(identifier)
+                    ]
+                flat.extend(offset + bucket for bucket in buckets)
+                weights.extend([count] * len(buckets))
+        return np.bincount(np.asarray(flat, dtype=np.int64), weights=np.asarray(weights, dtype=np.float64),
+                           minlength=len(texts) * self.dim)
+
+
+class EmbeddingProvider:
+    """
+    One kind of embedding function.
+    'factory(api_key, model_name)' returns a chroma compatible callable (texts -> vectors),
+    'model_id(model_name)' names the vector space it produces: an index or a cached vector is only reused
+    with the same id. Remote providers are put behind the embedding cache, local ones are cheaper than a lookup.
+    """
+    def __init__(self, factory: Callable, model_id: Callable[[Optional[str]], str], remote: bool = True):
+        self.factory = factory
+        self.model_id = model_id
+        self.remote = remote
+
+
+EMBEDDING_PROVIDERS = {
+    "OpenAIEmbeddingFunction": EmbeddingProvider(
+        factory=lambda api_key, model_name: embedding_functions.OpenAIEmbeddingFunction(
+            api_key=api_key, model_name=model_name
+        ),
+        model_id=lambda model_name: model_name,
+    ),
+    # splits entities longer than the model's input limit instead of failing on them
+    "CoherentChunkOpenAIEmbeddingFunction": EmbeddingProvider(
+        factory=lambda api_key, model_name: CoherentChunkOpenAIEmbeddingFunction(
+            api_key=api_key, model_name=model_name
+        ),
+        model_id=lambda model_name: (
+            f"{model_name}/coherent-{SystemConfig.embedding_max_tokens}-{SystemConfig.embedding_overlap_tokens}"
+        ),
+    ),
+    "HashingEmbeddingFunction": EmbeddingProvider(
+        factory=lambda api_key, model_name: HashingEmbeddingFunction(),
+        model_id=lambda model_name: (
+            f"hashing-{SystemConfig.local_embedding_dim}-{'.'.join(map(str, SystemConfig.local_embedding_ngrams))}"
+        ),
+        remote=False,
+    ),
+}
+
+
+def register_embedding_provider(name: str, provider: EmbeddingProvider):
+    EMBEDDING_PROVIDERS[name] = provider
+
+
+def get_embedding_provider(name: str = None) -> EmbeddingProvider:
+    name = name or SystemConfig.embedding_function
+    if name not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"unknown embedding provider {name}, expected one of {sorted(EMBEDDING_PROVIDERS)}")
+    return EMBEDDING_PROVIDERS[name]
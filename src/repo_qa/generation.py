@@ -1,23 +1,51 @@
-
-
 import openai
+from loguru import logger
 
 from .config import SystemConfig
+from .metrics import CONTEXT_TOKENS, LLM_TOKENS, timed
+from .tokens import count_tokens
 
-def generate_answer(question: str, retrieved_chunks: list, openai_api_key: str, chat_model_name: str):
+def pack_context(retrieved_chunks: list, max_tokens: int = SystemConfig.max_context_tokens,
+                 model_name: str = "gpt-4o"):
     """
-    'retrieved_chunks' is a list of (chunk_id, chunk_text, metadata).
-    We'll build a prompt with the chunk texts, plus the question.
+    Returns the context pieces for the prompt: the retrieved chunks in rank order, without duplicates,
+    as long as they fit in 'max_tokens'. A chunk that does not fit is skipped so smaller, lower ranked chunks
+    can still use the remaining budget. If even the best chunk is larger than the budget, it is truncated.
     """
-    openai.api_key = openai_api_key
-    # build context string
-    context_pieces = []
+    pieces = []
+    used = 0
+    seen_ids, seen_spans = set(), set()
     for chunk_id, chunk_text, meta in retrieved_chunks:
+        span = (meta.get("file_path", ""), meta.get("start_line"), meta.get("end_line"))
+        if chunk_id in seen_ids or span in seen_spans:
+            continue
+        seen_ids.add(chunk_id)
+        seen_spans.add(span)
         file_path = meta.get("file_path", "")
         name = meta.get("name", "")
-        context_pieces.append(
-            f"\n\n--- Chunk from {file_path} ({name}):\n{chunk_text}\n"
-        )
+        piece = f"\n\n--- Chunk from {file_path} ({name}):\n{chunk_text}\n"
+        tokens = count_tokens(piece, model_name)
+        if used + tokens > max_tokens:
+            if pieces:
+                continue
+            # keep a prefix of the top chunk rather than an empty context
+            piece = piece[:max(0, max_tokens) * len(piece) // max(tokens, 1)]
+            tokens = max_tokens
+        pieces.append(piece)
+        used += tokens
+    if len(pieces) < len(seen_ids):
+        logger.info(f"packed {len(pieces)} of {len(seen_ids)} unique chunks into a {max_tokens} token context")
+    CONTEXT_TOKENS.observe(used)
+    return pieces
+
+def build_messages(question: str, retrieved_chunks: list, chat_model_name: str = "gpt-4o"):
+    """
+    'retrieved_chunks' is a list of (chunk_id, chunk_text, metadata).
+    We'll build a prompt with the chunk texts (deduplicated and packed under
+    SystemConfig.max_context_tokens, see pack_context), plus the question.
+    """
+    # build context string
+    context_pieces = pack_context(retrieved_chunks, model_name=chat_model_name)
 
     context_string = "".join(context_pieces)
 
@@ -28,13 +56,93 @@ def generate_answer(question: str, retrieved_chunks: list, openai_api_key: str,
     )
     user_prompt = f"QUESTION:\n{question}\nCODE CONTEXT:\n{context_string}\n\nANSWER:"
 
-    response = openai.ChatCompletion.create(
-        model=chat_model_name,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        max_tokens=SystemConfig.max_generation_tokens,
-        temperature=SystemConfig.generation_temperature
-    )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def generate_answer(question: str, retrieved_chunks: list, openai_api_key: str, chat_model_name: str):
+    """
+    Blocking chat completion over the retrieved context, see build_messages.
+    """
+    openai.api_key = openai_api_key
+    messages = build_messages(question, retrieved_chunks, chat_model_name)
+    with timed("generation"):
+        response = openai.ChatCompletion.create(
+            model=chat_model_name,
+            messages=messages,
+            max_tokens=SystemConfig.max_generation_tokens,
+            temperature=SystemConfig.generation_temperature
+        )
+    _record_usage(response, messages, chat_model_name)
+    return response["choices"][0]["message"]["content"]
+
+async def agenerate_answer(question: str, retrieved_chunks: list, openai_api_key: str, chat_model_name: str,
+                           session=None):
+    """
+    Non-blocking variant of generate_answer.
+    'session' is a shared aiohttp.ClientSession, so concurrent requests reuse pooled connections
+    to the LLM endpoint instead of opening one per completion.
+    """
+    if session is not None:
+        # context variable, only affects the current task
+        openai.aiosession.set(session)
+    messages = build_messages(question, retrieved_chunks, chat_model_name)
+    with timed("generation"):
+        response = await openai.ChatCompletion.acreate(
+            model=chat_model_name,
+            messages=messages,
+            max_tokens=SystemConfig.max_generation_tokens,
+            temperature=SystemConfig.generation_temperature,
+            api_key=openai_api_key
+        )
+    _record_usage(response, messages, chat_model_name)
     return response["choices"][0]["message"]["content"]
+
+async def astream_answer(question: str, retrieved_chunks: list, openai_api_key: str, chat_model_name: str,
+                         session=None):
+    """
+    Streaming variant of agenerate_answer, yields the answer's text deltas as the model produces them.
+    """
+    if session is not None:
+        openai.aiosession.set(session)
+    messages = build_messages(question, retrieved_chunks, chat_model_name)
+    # streamed responses carry no usage, tokens are counted locally
+    LLM_TOKENS.inc(_prompt_tokens(messages, chat_model_name), direction="sent")
+    with timed("generation"):
+        stream = await openai.ChatCompletion.acreate(
+            model=chat_model_name,
+            messages=messages,
+            max_tokens=SystemConfig.max_generation_tokens,
+            temperature=SystemConfig.generation_temperature,
+            api_key=openai_api_key,
+            stream=True
+        )
+        answer = []
+        try:
+            async for chunk in stream:
+                if not chunk["choices"]:
+                    continue
+                delta = chunk["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    answer.append(delta)
+                    yield delta
+        finally:
+            LLM_TOKENS.inc(count_tokens("".join(answer), chat_model_name), direction="received")
+
+def _prompt_tokens(messages: list, model_name: str) -> int:
+    return sum(count_tokens(message["content"], model_name) for message in messages)
+
+def _record_usage(response, messages: list, model_name: str):
+    """
+    Counts the tokens of a completion, as reported by the API or counted locally when it reports no usage.
+    """
+    usage = response.get("usage") or {}
+    sent = usage.get("prompt_tokens")
+    received = usage.get("completion_tokens")
+    if sent is None:
+        sent = _prompt_tokens(messages, model_name)
+    if received is None:
+        received = count_tokens(response["choices"][0]["message"]["content"] or "", model_name)
+    LLM_TOKENS.inc(sent, direction="sent")
+    LLM_TOKENS.inc(received, direction="received")
@@ -1,118 +1,321 @@
-from typing import Optional
+import atexit
+import contextlib
+import itertools
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Optional
 
 import chromadb
-import numpy as np
-from chromadb.utils import embedding_functions
-from chromadb.api.types import Documents, Embeddings
 from loguru import logger
-from tqdm import tqdm
-
-from .chunking import extract_code_blocks
-from .callgraph import build_call_graph
-
-class CoherentChunkOpenAIEmbeddingFunction(embedding_functions.OpenAIEmbeddingFunction):
-    def __init__(self, api_key: Optional[str] = None, model_name: str = "text-embedding-ada-002", organization_id: Optional[str] = None, api_base: Optional[str] = None, api_type: Optional[str] = None, max_chunk_size: int = 8192):
-        super().__init__(api_key, model_name, organization_id, api_base, api_type)
-        self.max_chunk_size = max_chunk_size
-
-    def __call__(self, texts: Documents) -> Embeddings:
-        # Replace newlines to avoid negative performance impact
-        texts = [t.replace("\n", " ") for t in texts]
-
-        # Define the maximum allowed chunk size.
-        # Adjust this value based on your embedding model’s token/character limit.
-
-        # Prepare a list for all text chunks and a mapping of each chunk to its document index.
-        chunk_texts = []
-        doc_chunk_map = []
-        for doc_index, text in enumerate(texts):
-            # If the document is longer than the allowed chunk size, split it;
-            # otherwise, use the whole text.
-            if len(text) > self.max_chunk_size:
-                chunks = [text[i:i + self.max_chunk_size] for i in range(0, len(text), self.max_chunk_size)]
-            else:
-                chunks = [text]
-            chunk_texts.extend(chunks)
-            doc_chunk_map.extend([doc_index] * len(chunks))
-
-        # Call the embedding API on the list of chunks.
-        response = self._client.create(input=chunk_texts, engine=self._model_name)
-        embeddings_data = response["data"]
-
-        # Sort the embeddings by the provided index to ensure order consistency.
-        sorted_embeddings = sorted(embeddings_data, key=lambda e: e["index"])
-
-        # Group chunk embeddings by the original document.
-        doc_embeddings = {}
-        for embedding_info, doc_idx in zip(sorted_embeddings, doc_chunk_map):
-            vector = np.array(embedding_info["embedding"])
-            doc_embeddings.setdefault(doc_idx, []).append(vector)
-
-        # Merge embeddings for each document by averaging.
-        final_embeddings = []
-        for i in range(len(texts)):
-            vectors = doc_embeddings.get(i, [])
-            if vectors:
-                merged_vector = np.mean(vectors, axis=0)
-                final_embeddings.append(merged_vector.tolist())
-            else:
-                # In case no embeddings were computed for a document, append an empty list.
-                final_embeddings.append([])
 
-        return final_embeddings
+from .config import SystemConfig
+from .embedding_cache import EmbeddingCache, CachedEmbeddingFunction
+from .embeddings import CoherentChunkOpenAIEmbeddingFunction, get_embedding_provider
+from .ingestion import IngestionPipeline
+from .manifest import IndexManifest, chunk_id
+from .metrics import observe_stage, timed
+from .parse_cache import ParseCache
+from .parsing import parse_blobs, parse_files
+from .snapshot import IndexSnapshot
+from .vector_store import NumpyVectorStoreClient
+from .walker import iter_revision_blobs, iter_source_files, resolve_revision
+
+class RepoData:
+    """
+    Everything a query needs about one indexed repo.
+    'db_lock' serializes access to the collection: chroma's duckdb connection must not be used by two threads
+    at once, so blocking work that does not touch the db (e.g. embedding the question) stays outside of it.
+    """
+    _uids = itertools.count()
+
+    def __init__(self, collections=None, call_graph=None, name_index=None, embedder=None, client=None,
+                 lexical_index=None, line_index=None):
+        # unlike id(), never reused by a later index (answer cache entries are keyed by it)
+        self.uid = next(RepoData._uids)
+        self.collection = collections
+        self.call_graph = call_graph
+        self.name_index = name_index
+        self.embedder = embedder
+        self.client = client
+        self.lexical_index = lexical_index
+        self.line_index = line_index  # chunk spans by file, maps diff hunks to chunks
+        # stores whose reads are thread safe (NumpyVectorStore) are queried without serializing
+        self.db_lock = contextlib.nullcontext() if getattr(collections, "thread_safe", False) else threading.Lock()
 
+    def estimated_bytes(self) -> int:
+        """
+        Rough resident size of the index: stored chunks (vectors, hnsw links, text), the call graph and BM25 postings.
+        """
+        n_chunks = sum(len(ids) for ids in self.name_index.values()) if self.name_index else 0
+        store_bytes = getattr(self.collection, "nbytes", None)
+        if store_bytes is None:
+            store_bytes = n_chunks * SystemConfig.index_bytes_per_chunk
+        graph_bytes = self.call_graph.nbytes if self.call_graph is not None else 0
+        lexical_bytes = self.lexical_index.nbytes if self.lexical_index is not None else 0
+        line_bytes = self.line_index.nbytes if self.line_index is not None else 0
+        return store_bytes + graph_bytes + lexical_bytes + line_bytes
+
+    def retire(self):
+        """
+        Called once a newer build of the same collection was swapped in, or the index is unloaded.
+        Every duckdb+parquet client persists its in-memory state at interpreter exit, a superseded client
+        would overwrite the newer index on disk (and an unloaded one would stay referenced by the hook).
+        """
+        db = getattr(self.client, "_db", None)
+        if db is not None:
+            # chroma 0.3 has no public api for this, the hook is registered on the client's db
+            atexit.unregister(db.persist)
 
 
 def build_index(repo_path: str,
                 db_dir: str = "./db_dir",
                 collection_name: str = "code_chunks",
                 openai_api_key: str = "None",
-                embedding_model_name: str = "text-embedding-ada-002"
+                embedding_model_name: str = "text-embedding-ada-002",
+                embedding_batch_size: int = SystemConfig.embedding_batch_size,
+                embedding_workers: int = SystemConfig.embedding_workers,
+                db_write_batch_size: int = SystemConfig.db_write_batch_size,
+                embedding_cache_path: Optional[str] = SystemConfig.embedding_cache_path,
+                progress_callback: Optional[Callable[[str, int, int], None]] = None,
+                revision: Optional[str] = None,
+                parse_cache_path: Optional[str] = SystemConfig.parse_cache_path
                 ):
     """
-    1) Build call graph
-    2) Extract code blocks
-    3) Embed code blocks into a vector DB
-    4) Return (collection, call_graph)
+    Incremental: only files whose content changed since the last build (see IndexManifest) are re-processed.
+    With a 'revision' (branch, tag or commit) the files are read from the git object store instead of the working
+    tree, nothing is checked out. Their blob sha is the content hash: moving an index to another revision only
+    re-processes the files that differ, and blobs parsed for any other revision are taken from the ParseCache.
+    1) Diff the repo against the index manifest, patch call graph fragments of touched files
+    2) Embed new code blocks into a vector DB as the diff finds them (batched, see IngestionPipeline)
+    3) Delete rows of removed code blocks
+    4) Return a RepoData (collection, call_graph, name_index, embedder)
+    'progress_callback' is called with (stage, done, total) as the build advances.
+    The build uses its own chroma client, a RepoData serving queries is not affected until it is replaced.
     """
-    # 1. Build call graph
-    logger.info(f"building a call-graph for {repo_path}")
-    call_graph, defined_funcs = build_call_graph(repo_path)
+    progress = progress_callback or (lambda stage, done=0, total=0: None)
+    # 1. Initialize Chroma
+    client = _create_client(db_dir)
+
+    # 2. Embedding function
+    embedder, cache, model_id = _create_embedder(openai_api_key, embedding_model_name, embedding_cache_path)
 
-    # 2. Initialize Chroma
+    collection = client.get_or_create_collection(
+        name=collection_name,
+        embedding_function=embedder
+    )
+
+    # 3. Diff against the manifest of the previous build
+    repo_key = str(Path(repo_path).resolve())
+    if revision is not None:
+        # a branch may move while we read it, pin the commit
+        commit = resolve_revision(repo_path, revision)
+        logger.info(f"indexing revision {revision} ({commit}) of {repo_path}")
+        revision = commit
+    manifest = IndexManifest.load(db_dir, collection_name)
+    if (manifest.repo_path != repo_key or manifest.embedding_model != model_id
+            or collection.count() != len(manifest.all_chunk_ids())):
+        # the collection does not match the manifest
+        # (another repo, another embedding model, an older id scheme or an interrupted build)
+        logger.info(f"collection {collection_name} is not in sync with its manifest, rebuilding it from scratch")
+        if collection.count():
+            client.delete_collection(collection_name)
+            collection = client.create_collection(name=collection_name, embedding_function=embedder)
+        manifest = IndexManifest(manifest.path, repo_path=repo_key, embedding_model=model_id)
+
+    # 4. Parse, embed and store new code blocks, parsing, embedding requests and db writes overlap
+    logger.info(f"diffing {repo_path} against the index manifest, storing new code chunks")
+    progress("parsing")
+    diff = RepoDiff()
+    pipeline = IngestionPipeline(
+        collection=collection,
+        embedder=embedder,
+        embedding_batch_size=embedding_batch_size,
+        db_write_batch_size=db_write_batch_size,
+        embedding_workers=embedding_workers,
+        on_progress=lambda done: progress("writing", done, diff.n_new),
+    )
+    parse_cache = ParseCache(parse_cache_path) if revision is not None and parse_cache_path else None
+    try:
+        with contextlib.closing(_diff_repo(repo_path, manifest, diff, db_dir, revision, parse_cache)) as new_blocks:
+            pipeline.run(new_blocks)
+    finally:
+        if parse_cache is not None:
+            logger.info(f"parse cache stats: {parse_cache.stats()}")
+            parse_cache.close()
+    logger.info(f"{diff.n_new} new code blocks, {len(diff.kept_ids)} kept in touched files, "
+                f"{len(diff.removed_ids)} removed")
+
+    # 5. Apply the rest of the diff
+    for start in range(0, len(diff.removed_ids), db_write_batch_size):
+        collection.delete(ids=diff.removed_ids[start:start + db_write_batch_size])
+    # unchanged blocks of a touched file may have moved, refresh their line numbers without re-embedding
+    for start in range(0, len(diff.kept_ids), db_write_batch_size):
+        collection.update(
+            ids=diff.kept_ids[start:start + db_write_batch_size],
+            metadatas=diff.kept_metadatas[start:start + db_write_batch_size]
+        )
+    progress("finalizing", diff.n_new, diff.n_new)
+    # only persist the manifest once the collection holds everything it describes
+    client.persist()
+    manifest.save()
+
+    if cache is not None:
+        logger.info(f"embedding cache stats: {cache.stats()}")
+
+    with timed("callgraph_merge"):
+        call_graph = manifest.call_graph()
+    name_index = manifest.name_index()
+    with timed("lexical_index"):
+        lexical_index = manifest.lexical_index()
+    line_index = manifest.line_index(lexical_index.doc_ids)
+    # the next process serving this index starts from the snapshot instead of the json manifest
+    IndexSnapshot(repo_key, model_id, call_graph, lexical_index, line_index).save(
+        db_dir, collection_name, manifest.path
+    )
+    logger.info(f"call graph: {len(call_graph)} symbols, {call_graph.n_edges} edges, {call_graph.nbytes} bytes of adjacency")
+    logger.info(f"index build complete. collection size = {collection.count()}")
+    # questions rarely repeat, they are embedded without a cache round trip (see CachedEmbeddingFunction)
+    query_embedder = embedder.embedder if cache is not None else embedder
+    return RepoData(collection, call_graph, name_index, query_embedder, client=client, lexical_index=lexical_index,
+                    line_index=line_index)
+
+
+def load_index(db_dir: str,
+               collection_name: str = "code_chunks",
+               openai_api_key: str = "None",
+               embedding_model_name: str = "text-embedding-ada-002"
+               ) -> RepoData:
+    """
+    Open an index built earlier by build_index without touching the repo: the collection is read from the
+    persist directory, the call graph, name index and lexical index are memory-mapped from the index snapshot
+    (see IndexSnapshot), or rebuilt from the manifest when the snapshot is missing or stale.
+    Raises FileNotFoundError if db_dir holds no complete build of collection_name,
+    ValueError if it was built with another embedding model than the configured one.
+    """
+    manifest_path = IndexManifest.manifest_path(db_dir, collection_name)
+    with timed("snapshot_load"):
+        snapshot = IndexSnapshot.load(db_dir, collection_name, manifest_path)
+    if snapshot is None:
+        manifest = IndexManifest.load(db_dir, collection_name)
+        if manifest.repo_path is None:
+            raise FileNotFoundError(f"no index of {collection_name} in {db_dir}")
+        with timed("callgraph_merge"):
+            call_graph = manifest.call_graph()
+        with timed("lexical_index"):
+            lexical_index = manifest.lexical_index()
+        snapshot = IndexSnapshot(manifest.repo_path, manifest.embedding_model, call_graph, lexical_index,
+                                 manifest.line_index(lexical_index.doc_ids))
+        snapshot.save(db_dir, collection_name, manifest_path)
+
+    # a loaded index only embeds questions, they go straight to the provider
+    embedder, _, model_id = _create_embedder(openai_api_key, embedding_model_name, embedding_cache_path=None)
+    if snapshot.embedding_model != model_id:
+        raise ValueError(
+            f"the index in {db_dir} was built with embedding model {snapshot.embedding_model}, "
+            f"{model_id} is configured, re-index the repo"
+        )
+    client = _create_client(db_dir)
+    collection = client.get_collection(name=collection_name, embedding_function=embedder)
+    logger.info(f"loaded index of {snapshot.repo_path} from {db_dir}, collection size = {collection.count()}")
+    return RepoData(collection, snapshot.call_graph, snapshot.name_index(), embedder, client=client,
+                    lexical_index=snapshot.lexical_index, line_index=snapshot.line_index)
+
+
+def _create_client(db_dir: str):
+    if SystemConfig.vector_store == "numpy":
+        logger.info(f"opening a numpy vector store ({SystemConfig.vector_dtype}), persist dir: {db_dir}")
+        return NumpyVectorStoreClient(db_dir, dtype=SystemConfig.vector_dtype)
     logger.info(f"starting a ChromaDB, persist dir: {db_dir}")
-    client = chromadb.Client(
+    return chromadb.Client(
         settings=chromadb.Settings(
             chroma_db_impl="duckdb+parquet",
             persist_directory=db_dir
         )
     )
 
-    # 3. Embedding function
-    logger.info(f"creating an embedding function using {embedding_model_name} model")
 
-    # alternatively, CoherentChunkOpenAIEmbeddingFunction may be used to handle very large code entities
-    embedder = embedding_functions.OpenAIEmbeddingFunction(
-        api_key=openai_api_key,
-        model_name=embedding_model_name,
-    )
+def _create_embedder(openai_api_key: str, embedding_model_name: str, embedding_cache_path: Optional[str]):
+    """
+    Embedding function of the configured provider (SystemConfig.embedding_function).
+    Returns (embedding function, EmbeddingCache or None, model id of its vector space).
+    """
+    provider = get_embedding_provider()
+    model_id = provider.model_id(embedding_model_name)
+    logger.info(f"creating a {SystemConfig.embedding_function} embedding function, model: {model_id}")
+    embedder = provider.factory(openai_api_key, embedding_model_name)
+    cache = None
+    if embedding_cache_path and provider.remote:
+        # byte-identical code blocks (forks, branches, re-indexes) are embedded once per model
+        cache = EmbeddingCache(embedding_cache_path)
+        embedder = CachedEmbeddingFunction(embedder, cache, model_id)
+    return embedder, cache, model_id
 
-    collection = client.get_or_create_collection(
-        name=collection_name,
-        embedding_function=embedder
-    )
 
-    # 4. Extract code blocks & embed them
-    logger.info("storing code chunks in db with call-graph info")
-    i = 0
-    for code_block, metadata in tqdm(extract_code_blocks(repo_path)):
-        doc_id = f"chunk_{i}"
-        collection.add(
-            documents=[code_block],
-            metadatas=[metadata],
-            ids=[doc_id]
-        )
-        i += 1
+class RepoDiff:
+    """
+    What _diff_repo found besides the blocks it yields, complete once they are exhausted:
+    ids (and refreshed metadata) of the unchanged blocks of touched files, and ids of removed blocks.
+    """
+    def __init__(self):
+        self.n_new = 0
+        self.kept_ids = []
+        self.kept_metadatas = []
+        self.removed_ids = []
+
+
+def _diff_repo(repo_path: str, manifest: IndexManifest, diff: RepoDiff, db_dir: Optional[str] = None,
+               revision: Optional[str] = None, parse_cache: Optional[ParseCache] = None):
+    """
+    Compare the files in repo_path with the manifest, updating the manifest entries in place.
+    Changed files are read and parsed once, in parallel (see parsing.parse_files).
+    'db_dir' is never walked, even when the index is stored inside the repo.
+    With a 'revision' the files are the blobs of that commit instead (see parsing.parse_blobs).
+    Yields the (doc_id, chunk_text, metadata) triples that still need to be embedded as files are parsed,
+    the rest of the diff is collected in 'diff'.
+    """
+    repo_root = Path(repo_path)
+    seen_files = set()
+    previous_shas = {rel_path: entry["sha"] for rel_path, entry in manifest.files.items()}
+    if revision is not None:
+        parsed_files = parse_blobs(iter_revision_blobs(repo_path, revision), repo_root, previous_shas, parse_cache)
+    else:
+        parsed_files = parse_files(iter_source_files(repo_path, skip_paths=[db_dir]), repo_root, previous_shas)
+    for parsed in parsed_files:
+        if parsed.error:
+            logger.warning(f"failed to parse {parsed.rel_path}: {parsed.error}")
+            if parsed.sha is None:
+                # unreadable, treated as removed
+                continue
+        for stage, seconds in parsed.timings.items():
+            observe_stage(stage, seconds)
+        rel_path = parsed.rel_path
+        seen_files.add(rel_path)
+        if not parsed.changed:
+            continue
+
+        previous = manifest.files.get(rel_path)
+        previous_ids = {doc_id for doc_id, _ in previous["chunks"]} if previous is not None else set()
+        occurrences = Counter()
+        chunks = []
+        for chunk_text, metadata in parsed.blocks:
+            key = (metadata["block_type"], metadata["name"], chunk_text)
+            doc_id = chunk_id(rel_path, chunk_text, metadata, occurrences[key])
+            occurrences[key] += 1
+            chunks.append([doc_id, metadata])
+            if doc_id in previous_ids:
+                diff.kept_ids.append(doc_id)
+                diff.kept_metadatas.append(metadata)
+            else:
+                diff.n_new += 1
+                yield doc_id, chunk_text, metadata
+        diff.removed_ids.extend(previous_ids.difference(doc_id for doc_id, _ in chunks))
+
+        manifest.files[rel_path] = {
+            "sha": parsed.sha, "chunks": chunks, "calls": parsed.calls, "defined": parsed.defined,
+            "terms": parsed.terms
+        }
 
-    print("Index build complete. Collection size =", collection.count())
-    return collection, call_graph
+    for rel_path in list(manifest.files):
+        if rel_path not in seen_files:
+            diff.removed_ids.extend(doc_id for doc_id, _ in manifest.files.pop(rel_path)["chunks"])
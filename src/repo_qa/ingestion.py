@@ -0,0 +1,206 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from loguru import logger
+from tqdm import tqdm
+
+from .config import SystemConfig
+from .metrics import observe_stage
+
+_DONE = object()  # sentinel passed down the queues when a stage has no more work
+
+
+class StageStats:
+    """
+    Items processed and busy time of a single pipeline stage.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, items: int, seconds: float):
+        with self._lock:
+            self.items += items
+            self.seconds += seconds
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.seconds if self.seconds > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {"items": self.items, "seconds": round(self.seconds, 3), "items_per_sec": round(self.throughput, 1)}
+
+
+class IngestionPipeline:
+    """
+    Moves (doc_id, chunk_text, metadata) triples into a chroma collection in three overlapping stages:
+    1) parse  - a producer thread drains the code block iterator and groups blocks into embedding batches
+    2) embed  - a pool of worker threads calls the embedding function, one request per batch
+    3) write  - the calling thread collects embedded batches and bulk-writes them with collection.add
+    Stages talk through bounded queues, so a slow stage applies back pressure instead of growing memory.
+    """
+    def __init__(self,
+                 collection,
+                 embedder: Callable,
+                 embedding_batch_size: int = SystemConfig.embedding_batch_size,
+                 db_write_batch_size: int = SystemConfig.db_write_batch_size,
+                 embedding_workers: int = SystemConfig.embedding_workers,
+                 queue_size: int = SystemConfig.ingestion_queue_size,
+                 on_progress: Optional[Callable[[int], None]] = None):
+        self.collection = collection
+        self.embedder = embedder
+        self.embedding_batch_size = max(1, embedding_batch_size)
+        self.db_write_batch_size = max(1, db_write_batch_size)
+        self.embedding_workers = max(1, embedding_workers)
+        self.queue_size = max(1, queue_size)
+        self.on_progress = on_progress  # called with the number of chunks written so far
+        self.stats = {name: StageStats(name) for name in ("parse", "embed", "write")}
+
+        self._stop = threading.Event()
+        self._errors = []
+
+    def run(self, blocks: Iterable) -> dict:
+        """
+        Ingest all (doc_id, chunk_text, metadata) blocks and return per-stage statistics.
+        """
+        embed_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+
+        producer = threading.Thread(target=self._parse_stage, args=(blocks, embed_queue), daemon=True)
+        workers = [
+            threading.Thread(target=self._embed_stage, args=(embed_queue, write_queue), daemon=True)
+            for _ in range(self.embedding_workers)
+        ]
+
+        started = time.perf_counter()
+        producer.start()
+        for worker in workers:
+            worker.start()
+
+        try:
+            self._write_stage(write_queue, n_producers=len(workers))
+        finally:
+            self._stop.set()
+            producer.join()
+            for worker in workers:
+                worker.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        elapsed = time.perf_counter() - started
+        summary = {name: stage.as_dict() for name, stage in self.stats.items()}
+        summary["total"] = {
+            "items": self.stats["write"].items,
+            "seconds": round(elapsed, 3),
+            "items_per_sec": round(self.stats["write"].items / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+        for name, stage_summary in summary.items():
+            logger.info(f"ingestion stage '{name}': {stage_summary}")
+        return summary
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        # blocking put that gives up once another stage has failed
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fail(self, error: Exception):
+        logger.error(f"ingestion pipeline failed: {error}")
+        self._errors.append(error)
+        self._stop.set()
+
+    def _parse_stage(self, blocks: Iterable, embed_queue: queue.Queue):
+        try:
+            batch = ([], [], [])
+            started = time.perf_counter()
+            for doc_id, text, meta in blocks:
+                batch[0].append(doc_id)
+                batch[1].append(text)
+                batch[2].append(meta)
+                if len(batch[0]) >= self.embedding_batch_size:
+                    self.stats["parse"].record(len(batch[0]), time.perf_counter() - started)
+                    if not self._put(embed_queue, batch):
+                        return
+                    batch = ([], [], [])
+                    started = time.perf_counter()
+            if batch[0]:
+                self.stats["parse"].record(len(batch[0]), time.perf_counter() - started)
+                self._put(embed_queue, batch)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            # one sentinel per embedding worker
+            for _ in range(self.embedding_workers):
+                if not self._put(embed_queue, _DONE):
+                    break
+
+    def _embed_stage(self, embed_queue: queue.Queue, write_queue: queue.Queue):
+        try:
+            while True:
+                batch = self._get(embed_queue)
+                if batch is _DONE:
+                    break
+                ids, documents, metadatas = batch
+                started = time.perf_counter()
+                embeddings = self.embedder(documents)
+                elapsed = time.perf_counter() - started
+                self.stats["embed"].record(len(ids), elapsed)
+                observe_stage("embedding", elapsed)
+                if not self._put(write_queue, (ids, documents, metadatas, embeddings)):
+                    return
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(write_queue, _DONE)
+
+    def _write_stage(self, write_queue: queue.Queue, n_producers: int):
+        pending = ([], [], [], [])
+        finished = 0
+        progress = tqdm(desc="indexed chunks", unit="chunk")
+        try:
+            while finished < n_producers:
+                item = self._get(write_queue)
+                if item is _DONE:
+                    if self._stop.is_set():
+                        return
+                    finished += 1
+                    continue
+                for acc, values in zip(pending, item):
+                    acc.extend(values)
+                if len(pending[0]) >= self.db_write_batch_size:
+                    self._flush(pending, progress)
+                    pending = ([], [], [], [])
+            if pending[0]:
+                self._flush(pending, progress)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            progress.close()
+
+    def _flush(self, pending: tuple, progress: tqdm):
+        ids, documents, metadatas, embeddings = pending
+        started = time.perf_counter()
+        self.collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        elapsed = time.perf_counter() - started
+        self.stats["write"].record(len(ids), elapsed)
+        observe_stage("db_write", elapsed)
+        progress.update(len(ids))
+        if self.on_progress is not None:
+            self.on_progress(self.stats["write"].items)
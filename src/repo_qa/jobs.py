@@ -0,0 +1,93 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from loguru import logger
+
+from .config import SystemConfig
+
+
+class IndexJob:
+    """
+    State of one background index build: queued -> running -> succeeded | failed.
+    """
+    def __init__(self, repo_path: str):
+        self.id = uuid.uuid4().hex
+        self.repo_path = repo_path
+        self.status = "queued"
+        self.stage = None
+        self.done = 0
+        self.total = 0
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def update_progress(self, stage: str, done: int = 0, total: int = 0):
+        self.stage, self.done, self.total = stage, done, total
+
+    def as_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "repo_path": self.repo_path,
+            "status": self.status,
+            "progress": {"stage": self.stage, "done": self.done, "total": self.total},
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class IndexJobManager:
+    """
+    Runs index builds in a background thread, one at a time (builds share the persist directory).
+    'on_success' receives the built index, it is where the caller swaps it in.
+    The last 'max_history' jobs are kept for status queries.
+    """
+    def __init__(self, max_history: int = SystemConfig.index_jobs_history):
+        self.max_history = max_history
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, repo_path: str, build: Callable[[IndexJob], object], on_success: Callable[[object], None]) -> IndexJob:
+        job = IndexJob(repo_path)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_history:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if oldest.status in ("queued", "running"):
+                    break
+                del self._jobs[oldest_id]
+        self._executor.submit(self._run, job, build, on_success)
+        return job
+
+    def _run(self, job: IndexJob, build: Callable, on_success: Callable):
+        job.status = "running"
+        job.started = time.time()
+        try:
+            result = build(job)
+            on_success(result)
+            job.status = "succeeded"
+            logger.info(f"index job {job.id} for {job.repo_path} succeeded")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.exception(f"index job {job.id} for {job.repo_path} failed")
+        finally:
+            job.finished = time.time()
+
+    def get(self, job_id: str) -> Optional[IndexJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> list:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
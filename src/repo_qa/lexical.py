@@ -0,0 +1,153 @@
+import math
+import re
+from collections import Counter
+from typing import Iterable
+
+import numpy as np
+
+from .config import SystemConfig
+from .tokens import code_tokens
+
+# question words that would otherwise match docstrings and comments, code identifiers never need them
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it its me my not of on or should so that the "
+    "their them then there this to use used uses using was we what when where which who why will with you".split()
+)
+
+_CODE_REFERENCE_RE = re.compile(r"`([^`]+)`|([A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)(\()?")
+
+
+def term_counts(text: str) -> dict:
+    """
+    BM25 terms of a chunk: identifier aware tokens (see tokens.code_tokens) with their counts.
+    """
+    return dict(Counter(code_tokens(text)))
+
+
+def _looks_like_code(reference: str) -> bool:
+    # snake_case, dotted, or camelCase/PascalCase with an inner capital: unlikely to be an english word
+    return "_" in reference or "." in reference or any(c.isupper() for c in reference[1:])
+
+
+def reciprocal_rank_fusion(rankings: Iterable[list], k: int = SystemConfig.rrf_k) -> list:
+    """
+    Fuse ranked lists of ids: score(id) = sum over lists of 1 / (k + rank). Returns ids by decreasing score.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 index over the chunks of a collection, plus a lookup of the entities they define.
+    Postings are CSR arrays: the documents containing term t are postings[indptr[t]:indptr[t + 1]],
+    with their term frequencies in tfs. Built from the term counts stored in the index manifest.
+    """
+    def __init__(self, doc_ids: list, doc_names: list, vocabulary: dict, indptr: np.ndarray, postings: np.ndarray,
+                 tfs: np.ndarray, doc_lengths: np.ndarray,
+                 k1: float = SystemConfig.bm25_k1, b: float = SystemConfig.bm25_b):
+        self.doc_ids = doc_ids
+        self.doc_names = doc_names
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.postings = postings
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+
+        self._doc_index = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        # per document part of the BM25 denominator, fixed at build time
+        self._length_norm = (
+            k1 * (1 - b + b * doc_lengths / avg_length) if avg_length else np.full(len(doc_ids), k1)
+        ).astype(np.float32)
+        # qualified name and every dotted suffix of it ("mod.Class.method", "Class.method", "method") -> docs
+        self._definitions = {}
+        for i, name in enumerate(doc_names):
+            parts = name.split(".") if name else []
+            for start in range(len(parts)):
+                self._definitions.setdefault(".".join(parts[start:]), []).append(i)
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[tuple]):
+        """
+        chunks are (doc_id, qualified name, {term: count}) triples.
+        """
+        doc_ids, doc_names, vocabulary = [], [], {}
+        term_ids, docs, tfs, doc_lengths = [], [], [], []
+        for i, (doc_id, name, terms) in enumerate(chunks):
+            doc_ids.append(doc_id)
+            doc_names.append(name)
+            for term, count in terms.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                docs.append(i)
+                tfs.append(count)
+            doc_lengths.append(sum(terms.values()))
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=indptr[1:])
+        return cls(
+            doc_ids, doc_names, vocabulary, indptr,
+            postings=np.asarray(docs, dtype=np.int32)[order],
+            tfs=np.asarray(tfs, dtype=np.float32)[order],
+            doc_lengths=np.asarray(doc_lengths, dtype=np.float32),
+        )
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.postings.nbytes + self.tfs.nbytes + self.doc_lengths.nbytes
+
+    def name_of(self, doc_id: str):
+        i = self._doc_index.get(doc_id)
+        return self.doc_names[i] if i is not None else None
+
+    def search(self, query: str, n_results: int = SystemConfig.fusion_candidates) -> list:
+        """
+        Ids of the 'n_results' best BM25 matches of 'query', best first. Only documents sharing a term count.
+        """
+        term_ids = {self.vocabulary[t] for t in code_tokens(query) if t not in STOPWORDS and t in self.vocabulary}
+        if not term_ids or not len(self.doc_ids):
+            return []
+        n_docs = len(self.doc_ids)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for t in term_ids:
+            docs = self.postings[self.indptr[t]:self.indptr[t + 1]]
+            tf = self.tfs[self.indptr[t]:self.indptr[t + 1]]
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            # a term occurs once per document in the postings, so fancy-index accumulation is safe
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self._length_norm[docs])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > n_results:
+            matched = matched[np.argpartition(-scores[matched], n_results - 1)[:n_results]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [self.doc_ids[i] for i in matched]
+
+    def exact_matches(self, question: str, max_matches: int = SystemConfig.top_k_entities) -> list:
+        """
+        Ids of the chunks defining an entity the question names exactly: `anything in backticks`, a call like
+        name(), or an identifier that cannot be an english word (snake_case, dotted, camelCase).
+        A reference matching more than 'max_matches' chunks (e.g. __init__) is too ambiguous and ignored.
+        """
+        matches, seen = [], set()
+        for backticked, identifier, call in _CODE_REFERENCE_RE.findall(question):
+            reference = backticked.strip().rstrip("()") or identifier
+            if not backticked and not call and not _looks_like_code(reference):
+                continue
+            docs = self._definitions.get(reference, ())
+            if len(docs) > max_matches:
+                continue
+            for i in docs:
+                if i not in seen:
+                    seen.add(i)
+                    matches.append(self.doc_ids[i])
+        return matches[:max_matches]
@@ -0,0 +1,119 @@
+import re
+from typing import Iterable
+
+import numpy as np
+
+_DIFF_FILE_RE = re.compile(r"^\+\+\+ (?:b/)?(.+?)\t?$")
+_HUNK_RE = re.compile(r"^@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def changed_line_ranges(diff_text: str) -> list:
+    """
+    (repo relative path, first line, last line) of every run of changed lines of a unified diff, on the new side of
+    the diff. Context lines are not part of any range: added lines map to their own lines, a run of deleted lines that
+    adds nothing back to the line before the point they were deleted at. Deleted files are skipped.
+    """
+    ranges, path = [], None
+    old_left = new_left = 0  # lines of the current hunk not read yet, on each side
+    lineno = 0  # next line number on the new side
+    added, deleted_at = None, None  # (first, last) added lines and deletion point of the current run of changes
+
+    def close_run():
+        nonlocal added, deleted_at
+        if path is not None and (added or deleted_at):
+            ranges.append((path, *(added or (deleted_at, deleted_at))))
+        added, deleted_at = None, None
+
+    for line in diff_text.splitlines():
+        if old_left > 0 or new_left > 0:
+            marker = line[:1]
+            if marker == "\\":  # "\ No newline at end of file"
+                continue
+            if marker == "+":
+                added = (added[0] if added else lineno, lineno)
+                lineno += 1
+                new_left -= 1
+            elif marker == "-":
+                deleted_at = deleted_at or max(lineno - 1, 1)
+                old_left -= 1
+            else:
+                close_run()
+                lineno += 1
+                old_left -= 1
+                new_left -= 1
+            if old_left <= 0 and new_left <= 0:
+                close_run()
+        elif line.startswith("+++ "):
+            match = _DIFF_FILE_RE.match(line)
+            path = None if match is None or match.group(1) == "/dev/null" else match.group(1)
+        elif line.startswith("@@"):
+            match = _HUNK_RE.match(line)
+            if match is None:
+                continue
+            old_left = int(match.group(1) if match.group(1) is not None else 1)
+            new_left = int(match.group(3) if match.group(3) is not None else 1)
+            lineno = int(match.group(2))
+    close_run()
+    return ranges
+
+
+class LineRangeIndex:
+    """
+    Interval index over the line spans of the chunks of every file: the chunks of file f are
+    rows offsets[f]:offsets[f + 1] of the starts / ends / doc_rows arrays, sorted by start line.
+    doc_rows are positions in 'doc_ids', the chunk ids of the collection.
+    """
+    def __init__(self, files: list, offsets: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+                 doc_rows: np.ndarray, doc_ids: list):
+        self.files = files
+        self.offsets = offsets
+        self.starts = starts
+        self.ends = ends
+        self.doc_rows = doc_rows
+        self.doc_ids = doc_ids
+        self._file_index = {path: i for i, path in enumerate(files)}
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[tuple], doc_ids: list):
+        """
+        chunks are (rel_path, doc_id, start_line, end_line), 'doc_ids' lists every doc_id once.
+        """
+        doc_rows = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        files, file_codes, starts, ends, rows = {}, [], [], [], []
+        for rel_path, doc_id, start_line, end_line in chunks:
+            if start_line is None or doc_id not in doc_rows:
+                continue
+            file_codes.append(files.setdefault(rel_path, len(files)))
+            starts.append(start_line)
+            ends.append(end_line if end_line is not None else start_line)
+            rows.append(doc_rows[doc_id])
+        file_codes = np.asarray(file_codes, dtype=np.int32)
+        starts = np.asarray(starts, dtype=np.int32)
+        order = np.lexsort((starts, file_codes))
+        offsets = np.zeros(len(files) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(file_codes, minlength=len(files)), out=offsets[1:])
+        return cls(
+            list(files), offsets, starts[order],
+            np.asarray(ends, dtype=np.int32)[order],
+            np.asarray(rows, dtype=np.int32)[order],
+            doc_ids,
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.starts.nbytes + self.ends.nbytes + self.doc_rows.nbytes
+
+    def overlapping(self, rel_path: str, first_line: int, last_line: int) -> list:
+        """
+        Ids of the chunks of 'rel_path' whose span overlaps [first_line, last_line], innermost span first
+        (a method before the skeleton of its class).
+        """
+        f = self._file_index.get(rel_path)
+        if f is None:
+            return []
+        lo, hi = self.offsets[f], self.offsets[f + 1]
+        # spans are sorted by start, those starting after last_line cannot overlap
+        hi = lo + np.searchsorted(self.starts[lo:hi], last_line, side="right")
+        rows = np.flatnonzero(self.ends[lo:hi] >= first_line) + lo
+        rows = rows[np.argsort(self.ends[rows] - self.starts[rows], kind="stable")]
+        return [self.doc_ids[i] for i in self.doc_rows[rows]]
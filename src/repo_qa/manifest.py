@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from loguru import logger
+
+from .callgraph import merge_call_graphs
+from .lexical import LexicalIndex
+from .line_index import LineRangeIndex
+
+MANIFEST_VERSION = 6
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", errors="surrogatepass")).hexdigest()
+
+
+def chunk_id(rel_path: str, chunk_text: str, metadata: dict, occurrence: int = 0) -> str:
+    """
+    Stable, content derived chunk id.
+    The same block in the same file keeps its id across re-indexes no matter the walk order,
+    'occurrence' disambiguates byte-identical blocks with the same name inside one file.
+    """
+    key = "\0".join([rel_path, metadata.get("block_type", ""), metadata.get("name", ""), str(occurrence), chunk_text])
+    return content_hash(key)
+
+
+class IndexManifest:
+    """
+    Per-file record of what is stored in a collection, saved next to the chroma data:
+    { rel_path -> {"sha": content hash, "chunks": [[chunk_id, metadata], ...], "calls": {caller: [callees]},
+                  "defined": [...], "terms": [{term: count} per chunk]} }
+    It lets a re-index skip unchanged files, delete rows of removed blocks and patch the call graph per file,
+    and it is the source of the in-memory lookups used at query time (see name_index).
+    """
+    def __init__(self, path: Path, repo_path: str = None, files: dict = None, embedding_model: str = None):
+        self.path = Path(path)
+        self.repo_path = repo_path
+        self.embedding_model = embedding_model
+        self.files = files or {}
+
+    @classmethod
+    def manifest_path(cls, db_dir: str, collection_name: str) -> Path:
+        return Path(db_dir) / f"{collection_name}_manifest.json"
+
+    @classmethod
+    def load(cls, db_dir: str, collection_name: str):
+        path = cls.manifest_path(db_dir, collection_name)
+        if not path.exists():
+            return cls(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"ignoring unreadable index manifest {path}: {e}")
+            return cls(path)
+        if data.get("version") != MANIFEST_VERSION:
+            logger.info(f"index manifest {path} has an old version, starting from scratch")
+            return cls(path)
+        return cls(path, repo_path=data.get("repo_path"), files=data.get("files", {}),
+                   embedding_model=data.get("embedding_model"))
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "repo_path": self.repo_path,
+                       "embedding_model": self.embedding_model, "files": self.files}, f)
+        # atomic replace, a crash mid-write never leaves a truncated manifest behind
+        os.replace(tmp_path, self.path)
+
+    def all_chunk_ids(self) -> list:
+        return [doc_id for entry in self.files.values() for doc_id, _ in entry["chunks"]]
+
+    def name_index(self) -> dict:
+        """
+        { qualified name (bare name for non python chunks) -> [chunk_id, ...] },
+        replaces a metadata filtered db query per call graph neighbour.
+        """
+        index = {}
+        for entry in self.files.values():
+            for doc_id, metadata in entry["chunks"]:
+                index.setdefault(metadata.get("qualname") or metadata["name"], []).append(doc_id)
+        return index
+
+    def lexical_index(self) -> LexicalIndex:
+        """
+        BM25 index over the stored term counts of every chunk.
+        """
+        return LexicalIndex.from_chunks(
+            (doc_id, metadata.get("qualname") or metadata["name"], terms)
+            for entry in self.files.values()
+            for (doc_id, metadata), terms in zip(entry["chunks"], entry["terms"])
+        )
+
+    def line_index(self, doc_ids: list) -> LineRangeIndex:
+        """
+        Line spans of every chunk by file, pointing into 'doc_ids' (the chunk id table of the lexical index).
+        """
+        return LineRangeIndex.from_chunks(
+            (
+                (rel_path, doc_id, metadata.get("start_line"), metadata.get("end_line"))
+                for rel_path, entry in self.files.items()
+                for doc_id, metadata in entry["chunks"]
+            ),
+            doc_ids,
+        )
+
+    def call_graph(self):
+        """
+        Link the stored per-file call graph fragments into a CallGraph.
+        """
+        return merge_call_graphs(
+            (entry["calls"], entry["defined"]) for entry in self.files.values()
+        )
@@ -0,0 +1,115 @@
+import ast
+import json
+import re
+
+from .config import SystemConfig
+
+CELL_MARKER = "# %%"
+_CELL_HEADER_RE = re.compile(r"^# %% (In\[[^\]]*\]|\[markdown\]|\[raw\])$")
+_MAGIC_RE = re.compile(r"^\s*([%!]|\?|[\w.]+\?{1,2}\s*$)")  # %magic, !shell, ?help, obj? / obj??
+
+
+def notebook_script(raw: str) -> str:
+    """
+    The indexable text of a .ipynb file: a valid python script in the "percent" format, one section per cell.
+    Every cell starts with a '# %% In[n]' / '# %% [markdown]' / '# %% [raw]' header line, markdown and raw cells
+    are commented out, and so are IPython magics and code cells that do not parse.
+    Outputs are reduced to their text, truncated to SystemConfig.notebook_output_chars per cell.
+    Images, html and other rich outputs are dropped: they are most of a notebook's bytes and useless to embed.
+    Raises ValueError if 'raw' is not a notebook.
+    """
+    notebook = json.loads(raw)
+    if not isinstance(notebook, dict) or not isinstance(notebook.get("cells"), list):
+        raise ValueError("not a jupyter notebook")
+
+    out = []
+    for cell in notebook["cells"]:
+        cell_type = cell.get("cell_type")
+        source = _text(cell.get("source", "")).rstrip("\n")
+        if cell_type == "code":
+            count = cell.get("execution_count")
+            out.append(f"{CELL_MARKER} In[{count if count is not None else ' '}]")
+            out.append(_code(source))
+            output = _outputs_text(cell.get("outputs", []))
+            if output:
+                out.append(_comment(output, "# Out: "))
+        else:
+            out.append(f"{CELL_MARKER} [{'markdown' if cell_type == 'markdown' else 'raw'}]")
+            if source:
+                out.append(_comment(source))
+    return "\n".join(out) + "\n"
+
+
+def cell_spans(lines: list) -> list:
+    """
+    (cell_type, start_line, end_line) of every cell of a notebook_script, 1-based inclusive, cell_type is
+    "code", "markdown" or "raw".
+    """
+    spans = []
+    for i, line in enumerate(lines, start=1):
+        header = _CELL_HEADER_RE.match(line) if line.startswith(CELL_MARKER) else None
+        if header is None:
+            continue
+        if spans:
+            spans[-1][2] = i - 1
+        kind = header.group(1)
+        spans.append([kind[1:-1] if kind.startswith("[") else "code", i, i])
+    if spans:
+        spans[-1][2] = len(lines) - (1 if lines and lines[-1] == "" else 0)
+    return [tuple(span) for span in spans]
+
+
+def _text(value) -> str:
+    # nbformat stores multiline strings as lists of lines
+    return "".join(value) if isinstance(value, list) else (value or "")
+
+
+def _comment(text: str, first_prefix: str = "# ") -> str:
+    lines = text.split("\n")
+    return "\n".join([first_prefix + lines[0]] + ["# " + line for line in lines[1:]])
+
+
+def _code(source: str) -> str:
+    if source.lstrip().startswith("%%"):
+        # cell magic (%%bash, %%sql, ...): the whole cell is not python
+        return _comment(source)
+    code = "\n".join("# " + line if _MAGIC_RE.match(line) else line for line in source.split("\n"))
+    try:
+        ast.parse(code)
+    except (SyntaxError, ValueError):
+        # keep the rest of the notebook parseable
+        return _comment(code)
+    return code
+
+
+def _outputs_text(outputs: list) -> str:
+    """
+    Text of a code cell's outputs, truncated to SystemConfig.notebook_output_chars.
+    """
+    limit = SystemConfig.notebook_output_chars
+    if not limit:
+        return ""
+    parts, size = [], 0
+    for output in outputs:
+        output_type = output.get("output_type")
+        if output_type == "stream":
+            text = _text(output.get("text"))
+        elif output_type in ("execute_result", "display_data"):
+            data = output.get("data", {})
+            text = _text(data.get("text/plain")) if "text/plain" in data else ""
+            omitted = [mime for mime in data if mime != "text/plain"]
+            if omitted and not text:
+                text = f"[{', '.join(omitted)} output omitted]"
+        elif output_type == "error":
+            # the traceback is mostly ansi escapes and library frames
+            text = f"{output.get('ename', 'Error')}: {output.get('evalue', '')}"
+        else:
+            continue
+        parts.append(text.rstrip("\n"))
+        size += len(parts[-1])
+        if size > limit:
+            break
+    text = "\n".join(part for part in parts if part)
+    if len(text) > limit:
+        text = text[:limit] + "\n... (output truncated)"
+    return text
@@ -0,0 +1,50 @@
+import json
+import zlib
+from typing import List, Optional
+
+from .config import SystemConfig
+from .manifest import MANIFEST_VERSION
+from .parsing import ParsedFile
+from .sqlite_cache import SqliteLRUCache
+
+
+class ParseCache(SqliteLRUCache):
+    """
+    Disk backed cache of parsed git blobs keyed by (blob sha, file path): a file that did not change between two
+    revisions has the same blob sha, so indexing another revision only parses the files that differ.
+    Entries are the zlib compressed ParsedFile fields (chunks with their text, terms, call graph fragment), see
+    SqliteLRUCache for sharing and eviction. Entries of another MANIFEST_VERSION are never read.
+    """
+    table = "parsed"
+    columns = "version INTEGER NOT NULL, blob_sha TEXT NOT NULL, file_path TEXT NOT NULL, data BLOB NOT NULL"
+    key_columns = ("version", "blob_sha", "file_path")
+    value_column = "data"
+
+    def __init__(self, path: str, max_entries: int = SystemConfig.parse_cache_max_entries):
+        super().__init__(path, max_entries)
+
+    def get_many(self, keys: List[tuple]) -> List[Optional[ParsedFile]]:
+        """
+        keys are (rel_path, blob_sha, file_path), returns the cached ParsedFile of each, None where it is missing.
+        """
+        blobs = self._get_values([(MANIFEST_VERSION, sha, file_path) for _, sha, file_path in keys])
+        results = []
+        for (rel_path, sha, _), data in zip(keys, blobs):
+            if data is None:
+                results.append(None)
+                continue
+            fields = json.loads(zlib.decompress(data))
+            results.append(ParsedFile(rel_path, sha=sha, blocks=[tuple(block) for block in fields["blocks"]],
+                                      calls=fields["calls"], defined=fields["defined"], terms=fields["terms"]))
+        return results
+
+    def put_many(self, entries: List[tuple]):
+        """
+        entries are (file_path, ParsedFile) of successfully parsed blobs, ParsedFile.sha being the blob sha.
+        """
+        self._put_rows([
+            (MANIFEST_VERSION, parsed.sha, file_path, zlib.compress(json.dumps({
+                "blocks": parsed.blocks, "calls": parsed.calls, "defined": parsed.defined, "terms": parsed.terms,
+            }).encode("utf-8", errors="surrogatepass")))
+            for file_path, parsed in entries
+        ])
@@ -0,0 +1,177 @@
+import ast
+import contextlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+
+from loguru import logger
+
+from .callgraph import build_file_call_graph, module_name
+from .chunking import extract_file_blocks
+from .config import SystemConfig
+from .lexical import term_counts
+from .manifest import content_hash
+from .notebooks import notebook_script
+from .walker import BINARY_SNIFF_BYTES
+
+
+class ParsedFile:
+    """
+    Everything the index needs from one file, computed from a single read and a single ast.parse:
+    code blocks for the vector DB, their BM25 term counts and the call graph fragment.
+    'changed' is False when the content hash matched the previous build, in that case nothing else is filled.
+    """
+    def __init__(self, rel_path: str, sha: Optional[str] = None, changed: bool = True,
+                 blocks: list = None, calls: dict = None, defined: list = None,
+                 terms: list = None, timings: dict = None, error: Optional[str] = None):
+        self.rel_path = rel_path
+        self.sha = sha
+        self.changed = changed
+        self.blocks = blocks or []
+        self.calls = calls or {}
+        self.defined = defined or []
+        self.terms = terms or []  # aligned with blocks
+        self.timings = timings or {}  # stage -> seconds spent on this file, measured in the worker
+        self.error = error
+
+
+def parse_file(task: tuple) -> ParsedFile:
+    """
+    task is (file_path, rel_path, previous_sha), runs inside a worker process.
+    """
+    file_path, rel_path, previous_sha = task
+    file = Path(file_path)
+    try:
+        with open(file, "r") as f:
+            source = f.read()
+    except Exception as e:
+        return ParsedFile(rel_path, error=f"{type(e).__name__}: {e}")
+
+    sha = content_hash(source)
+    if sha == previous_sha:
+        return ParsedFile(rel_path, sha=sha, changed=False)
+    return _parse_source(file, rel_path, sha, source)
+
+
+def parse_blob(task: tuple) -> ParsedFile:
+    """
+    task is (file_path, rel_path, blob_sha, data), the content of a git blob read by the parent process.
+    'sha' of the result is the blob sha.
+    """
+    file_path, rel_path, blob_sha, data = task
+    if b"\0" in data[:BINARY_SNIFF_BYTES]:
+        return ParsedFile(rel_path, error="binary content")
+    try:
+        source = data.decode("utf-8")
+    except UnicodeDecodeError as e:
+        return ParsedFile(rel_path, error=f"{type(e).__name__}: {e}")
+    return _parse_source(Path(file_path), rel_path, blob_sha, source)
+
+
+def _parse_source(file: Path, rel_path: str, sha: str, source: str) -> ParsedFile:
+    if file.suffix == ".ipynb":
+        # the outputs are dropped here, the rest of the pipeline only sees the notebook's code and markdown
+        try:
+            source = notebook_script(source)
+        except ValueError as e:
+            return ParsedFile(rel_path, sha=sha, error=f"not a notebook: {e}")
+
+    # the line table and the AST are computed once and shared by the chunker and the call graph builder
+    lines = source.split("\n")
+    tree = None
+    if file.suffix in (".py", ".ipynb"):
+        try:
+            tree = ast.parse(source)
+        except Exception as e:
+            return ParsedFile(rel_path, sha=sha, error=f"{type(e).__name__}: {e}")
+
+    started = time.perf_counter()
+    try:
+        blocks = list(extract_file_blocks(file, source, tree=tree, lines=lines, module=module_name(rel_path)))
+    except Exception as e:
+        return ParsedFile(rel_path, sha=sha, error=f"{type(e).__name__}: {e}")
+    terms = [term_counts(chunk_text) for chunk_text, _ in blocks]
+    chunked = time.perf_counter()
+    calls, defined = (
+        build_file_call_graph(source, tree=tree, rel_path=rel_path) if tree is not None else ({}, [])
+    )
+    timings = {"chunking": chunked - started, "callgraph": time.perf_counter() - chunked}
+    return ParsedFile(rel_path, sha=sha, blocks=blocks, calls=calls, defined=defined, terms=terms,
+                      timings=timings)
+
+
+def parse_files(files: Iterable[Path], repo_root: Path, previous_shas: dict,
+                workers: Optional[int] = SystemConfig.parse_workers) -> Iterable[ParsedFile]:
+    """
+    Parse files across a process pool, yields ParsedFile results in input order.
+    Files whose content hash equals previous_shas[rel_path] are not parsed.
+    """
+    tasks = []
+    for file in files:
+        rel_path = file.relative_to(repo_root).as_posix()
+        tasks.append((str(file), rel_path, previous_shas.get(rel_path)))
+
+    with _parallel_map(workers, len(tasks)) as parallel_map:
+        yield from parallel_map(parse_file, tasks)
+
+
+def parse_blobs(blobs: Iterable[tuple], repo_root: Path, previous_shas: dict, cache=None,
+                workers: Optional[int] = SystemConfig.parse_workers,
+                batch_files: int = SystemConfig.parse_blob_batch_files) -> Iterable[ParsedFile]:
+    """
+    parse_files for the (rel_path, blob) pairs of walker.iter_revision_blobs, the blob sha is the content hash.
+    Blobs whose sha equals previous_shas[rel_path] are not read, those found in 'cache' (a ParseCache)
+    are not parsed, and what gets parsed is added to the cache. Results are not in input order.
+    Changed blobs are looked up, read and parsed 'batch_files' at a time, so at most one batch of file contents
+    is held in memory.
+    """
+    pending = []
+    for rel_path, blob in blobs:
+        if blob.hexsha == previous_shas.get(rel_path):
+            yield ParsedFile(rel_path, sha=blob.hexsha, changed=False)
+        else:
+            pending.append((rel_path, blob))
+
+    n_cached = 0
+    with _parallel_map(workers, len(pending)) as parallel_map:
+        for start in range(0, len(pending), batch_files):
+            batch = pending[start:start + batch_files]
+            keys = [(rel_path, blob.hexsha, str(repo_root / rel_path)) for rel_path, blob in batch]
+            cached = cache.get_many(keys) if cache is not None else [None] * len(keys)
+            tasks = []
+            for (rel_path, blob_sha, file_path), (_, blob), parsed in zip(keys, batch, cached):
+                if parsed is not None:
+                    n_cached += 1
+                    yield parsed
+                else:
+                    # git objects are read here, the workers only get bytes
+                    tasks.append((file_path, rel_path, blob_sha, blob.data_stream.read()))
+
+            parsed_entries = []
+            for task, parsed in zip(tasks, parallel_map(parse_blob, tasks)):
+                if cache is not None and parsed.error is None:
+                    parsed_entries.append((task[0], parsed))
+                yield parsed
+            if parsed_entries:
+                cache.put_many(parsed_entries)
+    logger.info(f"{len(pending)} changed blobs, {n_cached} parsed from the cache, {len(pending) - n_cached} parsed")
+
+
+@contextlib.contextmanager
+def _parallel_map(workers: Optional[int], n_tasks: int):
+    """
+    A map(func, tasks) running across a process pool sized for 'n_tasks' (the pool is shared by every call),
+    the builtin map when a pool does not pay off for a handful of files.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or n_tasks < SystemConfig.parse_min_files_per_worker * 2:
+        yield map
+        return
+
+    workers = min(workers, n_tasks // SystemConfig.parse_min_files_per_worker)
+    # spawn, not fork: the api server calls this from a thread of a multi threaded process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        yield lambda func, tasks: pool.map(func, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
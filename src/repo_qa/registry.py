@@ -0,0 +1,185 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional
+
+from loguru import logger
+
+from .config import SystemConfig
+from .indexing import RepoData
+
+REGISTRY_FILE = "repos.json"
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,62}$")
+
+
+def repo_name(repo_path: str, revision: Optional[str] = None) -> str:
+    """
+    Default registry name of a repo: its directory name (followed by the revision when indexing one),
+    reduced to characters safe for a directory name.
+    """
+    name = Path(repo_path).resolve().name + (f"-{revision}" if revision else "")
+    name = re.sub(r"[^A-Za-z0-9._-]+", "-", name).strip("._-")
+    return name[:63] or "repo"
+
+
+def is_valid_repo_name(name: str) -> bool:
+    return bool(_NAME_RE.match(name))
+
+
+class RepoRegistry:
+    """
+    The indexed repos served by one process, by name.
+    Every repo is indexed into its own persist directory ({db_root}/{name}): a duckdb+parquet client loads
+    the whole directory, so sharing one would load every repo to serve any of them.
+    The known repos are listed in {db_root}/repos.json, their indexes are loaded lazily on first use with 'loader'
+    and kept in an LRU. The least recently used ones are unloaded once more than 'max_loaded' are in memory
+    or their estimated size exceeds 'max_bytes' (the most recent one is always kept).
+    'on_unload' is called with every RepoData that is replaced or unloaded.
+    """
+    def __init__(self,
+                 db_root: str = SystemConfig.db_root,
+                 loader: Callable[[str], RepoData] = None,
+                 max_loaded: int = SystemConfig.max_loaded_indexes,
+                 max_bytes: int = SystemConfig.max_loaded_index_bytes,
+                 on_unload: Optional[Callable[[RepoData], None]] = None):
+        self.db_root = Path(db_root)
+        self.loader = loader
+        self.max_loaded = max_loaded
+        self.max_bytes = max_bytes
+        self.on_unload = on_unload
+
+        self._lock = threading.Lock()
+        self._load_locks = {}  # name -> lock, a repo is loaded by one request while the others wait for it
+        self._loaded = OrderedDict()  # name -> RepoData, in LRU order
+        self._repos, self.default = self._read()
+
+    def repo_dir(self, name: str) -> str:
+        return str(self.db_root / name)
+
+    def names(self) -> list:
+        with self._lock:
+            return list(self._repos)
+
+    def describe(self) -> list:
+        with self._lock:
+            return [
+                {
+                    "repo": name,
+                    "repo_path": repo_path,
+                    "default": name == self.default,
+                    "loaded": name in self._loaded,
+                    "estimated_bytes": self._loaded[name].estimated_bytes() if name in self._loaded else None,
+                }
+                for name, repo_path in self._repos.items()
+            ]
+
+    def resolve(self, name: Optional[str]) -> str:
+        """
+        'name' or, when omitted, the default repo (see swap). Raises KeyError for an unknown repo.
+        """
+        with self._lock:
+            name = name or self.default
+            if name is None or name not in self._repos:
+                raise KeyError(name)
+            return name
+
+    def get(self, name: Optional[str] = None) -> RepoData:
+        """
+        The loaded index of repo 'name', loading it from disk if needed. Blocking, call it off the event loop.
+        """
+        name = self.resolve(name)
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return self._loaded[name]
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                if name in self._loaded:
+                    # loaded by a concurrent request
+                    self._loaded.move_to_end(name)
+                    return self._loaded[name]
+            logger.info(f"loading index of repo {name}")
+            repo_data = self.loader(self.repo_dir(name))
+            with self._lock:
+                if name in self._loaded:
+                    # a new build was swapped in while loading, it wins over what was read from disk
+                    unloaded = [(name, repo_data)]
+                    repo_data = self._loaded[name]
+                else:
+                    self._loaded[name] = repo_data
+                    unloaded = self._evict()
+        self._unload(unloaded)
+        return repo_data
+
+    def swap(self, name: str, repo_path: str, repo_data: RepoData, revision: Optional[str] = None):
+        """
+        Register a freshly built index of 'name' and atomically replace the served one:
+        handlers get a RepoData once per request, so a request sees either the old index or the new one.
+        The repo path is listed as "{repo_path}@{revision}" for an index of a git revision, 'revision' should be
+        the commit sha it was built from. The most recently indexed working tree becomes the default repo,
+        an index of a revision only does when there is no default yet.
+        """
+        with self._lock:
+            old = self._loaded.pop(name, None)
+            self._loaded[name] = repo_data
+            self._repos[name] = str(Path(repo_path).resolve()) + (f"@{revision}" if revision else "")
+            if revision is None or self.default not in self._repos:
+                self.default = name
+            self._write()
+            unloaded = self._evict()
+        if old is not None:
+            unloaded.append((name, old))
+        self._unload(unloaded)
+        logger.info(f"swapped in the new index of repo {name}")
+
+    def unload_all(self):
+        with self._lock:
+            unloaded = list(self._loaded.items())
+            self._loaded.clear()
+        self._unload(unloaded)
+
+    def _evict(self) -> list:
+        """
+        Pops least recently used indexes over the limits, returns them as (name, RepoData) pairs.
+        Called with the lock held.
+        """
+        evicted = []
+        total_bytes = sum(data.estimated_bytes() for data in self._loaded.values())
+        while len(self._loaded) > 1 and (len(self._loaded) > self.max_loaded or total_bytes > self.max_bytes):
+            name, data = self._loaded.popitem(last=False)
+            total_bytes -= data.estimated_bytes()
+            evicted.append((name, data))
+        return evicted
+
+    def _unload(self, unloaded: list):
+        for name, data in unloaded:
+            logger.info(f"unloading index of repo {name}")
+            # requests already holding it finish normally, memory is released once they drop it
+            data.retire()
+            if self.on_unload is not None:
+                self.on_unload(data)
+
+    def _read(self):
+        path = self.db_root / REGISTRY_FILE
+        if not path.exists():
+            return {}, None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"ignoring unreadable repo registry {path}: {e}")
+            return {}, None
+        return data.get("repos", {}), data.get("default")
+
+    def _write(self):
+        self.db_root.mkdir(parents=True, exist_ok=True)
+        path = self.db_root / REGISTRY_FILE
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"repos": self._repos, "default": self.default}, f, indent=2)
+        os.replace(tmp_path, path)
@@ -1,69 +1,171 @@
+import time
 
 from loguru import logger
 
 from .config import SystemConfig
+from .lexical import reciprocal_rank_fusion
+from .line_index import changed_line_ranges
+from .metrics import observe_stage, timed
 
-def retrieve_with_callgraph(question: str,
-                            collection,
-                            call_graph):
+def needs_query_embedding(question: str, repo_data) -> bool:
     """
-    1. Vector-based retrieval of top-k chunks
+    False when the question names a defined entity exactly: retrieval then skips the embedding round trip
+    and ranks those definitions first, see LexicalIndex.exact_matches.
+    """
+    lexical_index = repo_data.lexical_index
+    if lexical_index is None or not SystemConfig.exact_identifier_fast_path:
+        return True
+    return not lexical_index.exact_matches(question)
+
+def retrieve_with_callgraph(question: str, repo_data, query_embedding=None, top_k: int = None, depth: int = None):
+    """
+    1. Retrieval of top-k chunks: vector search fused with BM25 (reciprocal rank fusion), or, when the question
+       names an entity exactly, its definitions followed by the BM25 results without embedding the question
     2. For each chunk, collect call-graph neighbors up to 'expansion_depth'
     3. Merge & re-rank or limit them
+    'repo_data' is the RepoData returned by build_index. Its name_index maps entity names to chunk ids,
+    so expansion is in-memory and costs a single bulk fetch from the collection.
+    'query_embedding' may be passed in when the caller already embedded the question.
+    'top_k' and 'depth' override SystemConfig.top_k_entities and SystemConfig.max_callgraph_depth.
     """
-    logger.info(f"fetching top {SystemConfig.top_k_entities} results from index")
-    # 1. Vector-based retrieval
-    results = collection.query(query_texts=[question], n_results=SystemConfig.top_k_entities)
+    return retrieve_batch([question], repo_data, [query_embedding], top_k=top_k, depth=depth)[0]
 
-    top_docs = results["documents"][0]
-    top_metas = results["metadatas"][0]
-    top_ids   = results["ids"][0]
+def retrieve_batch(questions: list, repo_data, query_embeddings: list = None, top_k: int = None, depth: int = None):
+    """
+    retrieve_with_callgraph for several questions at once, returns their candidate lists in input order.
+    The questions that need an embedding are embedded in one call and searched in one vector query,
+    and the chunks missing from the query results (expansions shared by several questions included) are
+    read in one bulk fetch. 'query_embeddings', if given, is aligned with 'questions' (None where not computed).
+    """
+    collection, call_graph, name_index = repo_data.collection, repo_data.call_graph, repo_data.name_index
+    lexical_index = repo_data.lexical_index
+    top_k = SystemConfig.top_k_entities if top_k is None else top_k
+    depth = SystemConfig.max_callgraph_depth if depth is None else depth
+    hybrid = lexical_index is not None and SystemConfig.hybrid_retrieval
+    query_embeddings = list(query_embeddings) if query_embeddings is not None else [None] * len(questions)
 
-    logger.info(f"gathering neighboring entities from call graph with max depth of {SystemConfig.max_callgraph_depth}")
-    # 2. Gather neighbors from the call graph
-    # We'll store (chunk_text, meta) in a list. Then optionally re-rank.
-    all_candidates = []  # store chunk IDs
-    expansions = []
+    exact_ids = [[] for _ in questions]
+    if lexical_index is not None and SystemConfig.exact_identifier_fast_path:
+        exact_ids = [lexical_index.exact_matches(question, max_matches=top_k) for question in questions]
+    rankings = [[] for _ in questions]
+    fetched = {}  # doc_id -> (chunk_text, meta) of chunks already read from the collection
 
-    for doc_id, doc_text, meta in zip(top_ids, top_docs, top_metas):
-        all_candidates.append((doc_id, doc_text, meta))
-        name = meta.get("name")
-        if not name:
-            continue
-        # BFS or DFS to get neighbors up to 'expansion_depth'
-        neighbors = get_graph_neighbors(name, call_graph, SystemConfig.max_callgraph_depth)
-        expansions.extend(neighbors)
+    # 1. Retrieval
+    searched = [i for i in range(len(questions)) if not exact_ids[i]]
+    if len(searched) < len(questions):
+        logger.info(f"{len(questions) - len(searched)} of {len(questions)} questions name indexed entities, "
+                    f"skipping their vector search")
+    if searched:
+        to_embed = [i for i in searched if query_embeddings[i] is None]
+        if to_embed:
+            # network bound, done outside the db lock
+            with timed("embedding"):
+                embeddings = repo_data.embedder([questions[i] for i in to_embed])
+            for i, embedding in zip(to_embed, embeddings):
+                query_embeddings[i] = embedding
+        n_results = max(SystemConfig.fusion_candidates, top_k) if hybrid else top_k
+        logger.info(f"fetching top {n_results} results from index for {len(searched)} questions")
+        with timed("vector_query"), repo_data.db_lock:
+            results = collection.query(query_embeddings=[query_embeddings[i] for i in searched], n_results=n_results)
+        for row, i in enumerate(searched):
+            rankings[i].append(results["ids"][row])
+            for doc_id, doc_text, meta in zip(results["ids"][row], results["documents"][row],
+                                              results["metadatas"][row]):
+                fetched[doc_id] = (doc_text, meta)
+    if hybrid:
+        with timed("lexical_search"):
+            for i, question in enumerate(questions):
+                rankings[i].append(lexical_index.search(question, max(SystemConfig.fusion_candidates, top_k)))
 
-    # expansions might just be function names. We need to find chunk IDs that match.
-    # We'll do a quick filter in the collection by metadata name.
-    all_expanded_docs = {"ids": [], "documents": [], "metadatas": []}
-    for name in list(expansions):
-        result = collection.get(where={"name": {"$eq": name}})
-        all_expanded_docs["ids"].extend(result.get("ids", []))
-        all_expanded_docs["documents"].extend(result.get("documents", []))
-        all_expanded_docs["metadatas"].extend(result.get("metadatas", []))
+    top_ids = []
+    for i in range(len(questions)):
+        exact = set(exact_ids[i])
+        ranked = exact_ids[i] + [doc_id for doc_id in reciprocal_rank_fusion(rankings[i]) if doc_id not in exact]
+        top_ids.append(ranked[:top_k])
 
-    # This returns all matching docs. Add them to all_candidates
-    for doc_id, doc_text, meta in zip(all_expanded_docs["ids"],
-                                      all_expanded_docs["documents"],
-                                      all_expanded_docs["metadatas"]):
-        all_candidates.append((doc_id, doc_text, meta))
+    logger.info(f"gathering neighboring entities from call graph with max depth of {depth}")
+    # 2. Gather neighbors from the call graph
+    expansion_started = time.perf_counter()
+    expanded_ids = [_expand(ids, fetched, repo_data, depth) for ids in top_ids]
+    observe_stage("graph_expansion", time.perf_counter() - expansion_started)
 
+    # everything not returned by the vector query is fetched at once, chunks wanted by several questions once
+    missing_ids = list(dict.fromkeys(
+        doc_id for ids, expanded in zip(top_ids, expanded_ids) for doc_id in ids + expanded if doc_id not in fetched
+    ))
+    if missing_ids:
+        with timed("db_fetch"), repo_data.db_lock:
+            result = collection.get(ids=missing_ids)
+        for doc_id, doc_text, meta in zip(result["ids"], result["documents"], result["metadatas"]):
+            fetched[doc_id] = (doc_text, meta)
+
+    # keep rank order, then expansion order, chroma does not guarantee it
     # TODO: improvement suggestion: run embedding and compare to question again
-    return list(all_candidates)
+    return [
+        [(doc_id, *fetched[doc_id]) for doc_id in ids + expanded if doc_id in fetched]
+        for ids, expanded in zip(top_ids, expanded_ids)
+    ]
+
+def retrieve_for_diff(diff_text: str, repo_data, depth: int = None, max_chunks: int = None):
+    """
+    Context for reviewing a unified diff, without any embedding or vector search: the chunks the hunks touch
+    (found with the line range index of the build) followed by their call graph neighbors, at most 'max_chunks'
+    (SystemConfig.diff_context_max_chunks). Paths in the diff must be relative to the indexed repo's root.
+    Returns (touched, neighbors), both lists of (chunk_id, chunk_text, metadata).
+    """
+    depth = SystemConfig.max_callgraph_depth if depth is None else depth
+    max_chunks = SystemConfig.diff_context_max_chunks if max_chunks is None else max_chunks
+    if repo_data.line_index is None:
+        return [], []
+    touched_ids = list(dict.fromkeys(
+        doc_id
+        for rel_path, first_line, last_line in changed_line_ranges(diff_text)
+        for doc_id in repo_data.line_index.overlapping(rel_path, first_line, last_line)
+    ))[:max_chunks]
+    with timed("graph_expansion"):
+        expanded_ids = _expand(touched_ids, {}, repo_data, depth)[:max_chunks - len(touched_ids)]
+    logger.info(f"diff touches {len(touched_ids)} chunks, {len(expanded_ids)} call graph neighbors")
+    if not touched_ids:
+        return [], []
 
-def get_graph_neighbors(start_name, call_graph, depth=1):
+    with timed("db_fetch"), repo_data.db_lock:
+        result = repo_data.collection.get(ids=touched_ids + expanded_ids)
+    fetched = {
+        doc_id: (doc_text, meta) for doc_id, doc_text, meta in zip(result["ids"], result["documents"], result["metadatas"])
+    }
+    return (
+        [(doc_id, *fetched[doc_id]) for doc_id in touched_ids if doc_id in fetched],
+        [(doc_id, *fetched[doc_id]) for doc_id in expanded_ids if doc_id in fetched],
+    )
+
+def _expand(top_ids: list, fetched: dict, repo_data, depth: int) -> list:
     """
-    Return a set of node names reachable from 'start_name'
-    within 'depth' steps. (Simple BFS approach.)
+    Ids of the chunks defining the call graph neighbors of the 'top_ids' chunks, in expansion order,
+    without the top ids themselves.
     """
-    visited = set()
-    queue = [(start_name, 0)]
-    while queue:
-        node, dist = queue.pop(0)
-        if node not in visited:
-            visited.add(node)
-            if node in call_graph and dist < depth:
-                for neigh in call_graph[node]:
-                    queue.append((neigh, dist + 1))
-    return visited
+    call_graph, name_index, lexical_index = repo_data.call_graph, repo_data.name_index, repo_data.lexical_index
+    expansions = []
+    for doc_id in top_ids:
+        if doc_id in fetched:
+            meta = fetched[doc_id][1]
+            name = meta.get("qualname") or meta.get("name")
+        else:
+            name = lexical_index.name_of(doc_id)
+        if not name or name not in call_graph:
+            # not a python entity: text chunks are all named chunk_<n>, they would pull in their namesakes
+            continue
+        # BFS to get neighbors up to 'expansion_depth', nearest first
+        expansions.extend(call_graph.neighbors(name, depth))
+        if SystemConfig.expand_callers and depth > 0:
+            expansions.extend(call_graph.neighbors(name, 1, reverse=True))
+
+    # expansions are entity names, map them to chunk ids in memory.
+    # chunks already in the top-k (or reached through several paths) are only kept once
+    seen_ids = set(top_ids)
+    expanded_ids = []
+    for name in expansions:
+        for doc_id in name_index.get(name, ()):
+            if doc_id not in seen_ids:
+                seen_ids.add(doc_id)
+                expanded_ids.append(doc_id)
+    return expanded_ids
@@ -0,0 +1,152 @@
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+from .atomic_dir import make_tmp_dir, recover_dir, replace_dir
+from .callgraph import CallGraph
+from .lexical import LexicalIndex
+from .line_index import LineRangeIndex
+
+SNAPSHOT_VERSION = 2
+_ARRAYS = {
+    "call_graph": ("fwd_offsets", "fwd_targets", "rev_offsets", "rev_targets"),
+    "lexical_index": ("indptr", "postings", "tfs", "doc_lengths"),
+    "line_index": ("offsets", "starts", "ends", "doc_rows"),
+}
+_STRINGS = {
+    "call_graph": ("symbols",),
+    "lexical_index": ("doc_ids", "doc_names", "terms"),
+    "line_index": ("files",),
+}
+
+
+class IndexSnapshot:
+    """
+    The query time structures of a build (call graph, lexical index, line range index and the name index)
+    in a compact binary form, stored next to the vector data in {db_dir}/{collection}.snapshot/:
+    one .npy file per array, memory-mapped on load, and the string tables as NUL separated utf-8.
+    Loading it replaces parsing the json manifest and re-merging the call graph fragments.
+    A snapshot is only used while the manifest it was taken from is unchanged (see 'manifest_stat').
+    It is rewritten in a new directory that replaces the old one (see atomic_dir.replace_dir).
+    """
+    def __init__(self, repo_path: str, embedding_model: str, call_graph: CallGraph, lexical_index: LexicalIndex,
+                 line_index: LineRangeIndex):
+        self.repo_path = repo_path
+        self.embedding_model = embedding_model
+        self.call_graph = call_graph
+        self.lexical_index = lexical_index
+        self.line_index = line_index
+
+    @staticmethod
+    def snapshot_path(db_dir: str, collection_name: str) -> Path:
+        return Path(db_dir) / f"{collection_name}.snapshot"
+
+    @staticmethod
+    def manifest_stat(manifest_path: Path) -> Optional[list]:
+        try:
+            stat = os.stat(manifest_path)
+        except OSError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def name_index(self) -> dict:
+        """
+        Same as IndexManifest.name_index: the lexical index holds every chunk with its qualified name.
+        """
+        index = {}
+        for doc_id, name in zip(self.lexical_index.doc_ids, self.lexical_index.doc_names):
+            index.setdefault(name, []).append(doc_id)
+        return index
+
+    def save(self, db_dir: str, collection_name: str, manifest_path: Path):
+        path = self.snapshot_path(db_dir, collection_name)
+        tmp_path = make_tmp_dir(path)
+
+        vocabulary = self.lexical_index.vocabulary
+        terms = sorted(vocabulary, key=vocabulary.get)
+        sources = {
+            "call_graph": self.call_graph,
+            "lexical_index": self.lexical_index,
+            "line_index": self.line_index,
+        }
+        for part, names in _ARRAYS.items():
+            for name in names:
+                np.save(tmp_path / f"{part}.{name}.npy", np.ascontiguousarray(getattr(sources[part], name)))
+        for part, names in _STRINGS.items():
+            for name in names:
+                values = terms if name == "terms" else getattr(sources[part], name)
+                _save_strings(tmp_path / f"{part}.{name}.bin", values)
+        with open(tmp_path / "header.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "version": SNAPSHOT_VERSION,
+                "repo_path": self.repo_path,
+                "embedding_model": self.embedding_model,
+                "manifest_stat": self.manifest_stat(manifest_path),
+                "bm25": [self.lexical_index.k1, self.lexical_index.b],
+            }, f)
+
+        replace_dir(tmp_path, path)
+
+    @classmethod
+    def load(cls, db_dir: str, collection_name: str, manifest_path: Path):
+        """
+        The snapshot of collection_name, None when there is none or it does not match the current manifest.
+        """
+        path = cls.snapshot_path(db_dir, collection_name)
+        recover_dir(path)
+        try:
+            with open(path / "header.json", "r", encoding="utf-8") as f:
+                header = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if header.get("version") != SNAPSHOT_VERSION or header.get("manifest_stat") != cls.manifest_stat(manifest_path):
+            logger.info(f"index snapshot {path} is stale, ignoring it")
+            return None
+
+        try:
+            arrays = {
+                (part, name): np.load(path / f"{part}.{name}.npy", mmap_mode="r")
+                for part, names in _ARRAYS.items() for name in names
+            }
+            strings = {
+                (part, name): _load_strings(path / f"{part}.{name}.bin")
+                for part, names in _STRINGS.items() for name in names
+            }
+        except (OSError, ValueError) as e:
+            logger.warning(f"ignoring unreadable index snapshot {path}: {e}")
+            return None
+
+        call_graph = CallGraph(strings["call_graph", "symbols"],
+                               *(arrays["call_graph", name] for name in _ARRAYS["call_graph"]))
+        k1, b = header["bm25"]
+        lexical_index = LexicalIndex(
+            strings["lexical_index", "doc_ids"],
+            strings["lexical_index", "doc_names"],
+            {term: i for i, term in enumerate(strings["lexical_index", "terms"])},
+            *(arrays["lexical_index", name] for name in _ARRAYS["lexical_index"]),
+            k1=k1, b=b,
+        )
+        line_index = LineRangeIndex(
+            strings["line_index", "files"],
+            *(arrays["line_index", name] for name in _ARRAYS["line_index"]),
+            doc_ids=lexical_index.doc_ids,
+        )
+        return cls(header["repo_path"], header["embedding_model"], call_graph, lexical_index, line_index)
+
+
+def _save_strings(path: Path, values: list):
+    with open(path, "wb") as f:
+        f.write(b"%d\n" % len(values))
+        f.write("\0".join(values).encode("utf-8", errors="surrogatepass"))
+
+
+def _load_strings(path: Path) -> list:
+    with open(path, "rb") as f:
+        count = int(f.readline())
+        data = f.read().decode("utf-8", errors="surrogatepass")
+    # "".split("\0") is [""], the count tells an empty table from a single empty string
+    return data.split("\0") if count else []
@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from loguru import logger
+
+# sqlite builds older than 3.32 cap a statement at 999 bound parameters
+_MAX_PARAMS = 999
+
+
+class SqliteLRUCache:
+    """
+    Disk backed key -> value cache in one sqlite table, in WAL mode so every index (and process) on the host can
+    share the file. Subclasses name the 'table', its 'key_columns' and 'value_column' with their sql 'columns'
+    definition, and read / write through _get_values / _put_rows.
+    Size is bounded by 'max_entries', least recently used entries are evicted first. The number of rows is counted
+    once on open and kept up to date by this process, so writes never scan the table: rows added by other processes
+    sharing the file are only seen once an eviction recounts them.
+    """
+    table = None
+    columns = None  # sql definition of the key and value columns, 'last_used' is added
+    key_columns = ()
+    value_column = None
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ({self.columns}, last_used REAL NOT NULL, "
+            f"PRIMARY KEY ({', '.join(self.key_columns)}))"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_used ON {self.table} (last_used)")
+        self._conn.commit()
+        (self._count,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+
+    def _get_values(self, keys: List[tuple]) -> List[Optional[bytes]]:
+        """
+        Stored value of every key (a tuple of key_columns values), None where it is missing.
+        Found entries become the most recently used ones.
+        """
+        found = {}
+        key_list = ", ".join(self.key_columns)
+        placeholder = f"({', '.join('?' * len(self.key_columns))})"
+        window_size = _MAX_PARAMS // len(self.key_columns)
+        with self._lock:
+            for start in range(0, len(keys), window_size):
+                window = list(set(keys[start:start + window_size]))
+                rows = self._conn.execute(
+                    f"SELECT {key_list}, {self.value_column} FROM {self.table} WHERE ({key_list}) IN "
+                    f"(VALUES {', '.join([placeholder] * len(window))})",
+                    [value for key in window for value in key]
+                ).fetchall()
+                found.update((tuple(row[:-1]), row[-1]) for row in rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    f"UPDATE {self.table} SET last_used = ? WHERE "
+                    f"{' AND '.join(f'{column} = ?' for column in self.key_columns)}",
+                    [(now, *key) for key in found]
+                )
+                self._conn.commit()
+
+            values = [found.get(key) for key in keys]
+            n_found = sum(value is not None for value in values)
+            self.hits += n_found
+            self.misses += len(values) - n_found
+        return values
+
+    def _put_rows(self, rows: List[tuple]):
+        """
+        rows are (*key, value). A key stored meanwhile by another process keeps its value: values are derived
+        from their key, whoever computed it stored the same thing.
+        """
+        now = time.time()
+        placeholders = ", ".join("?" * (len(self.key_columns) + 2))
+        with self._lock:
+            changes = self._conn.total_changes
+            self._conn.executemany(f"INSERT OR IGNORE INTO {self.table} VALUES ({placeholders})",
+                                   [(*row, now) for row in rows])
+            self._count += self._conn.total_changes - changes
+            if self.max_entries and self._count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (self._count,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        overflow = self._count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN "
+                f"(SELECT rowid FROM {self.table} ORDER BY last_used LIMIT ?)",
+                (overflow,)
+            )
+            self._count -= overflow
+            logger.info(f"evicted {overflow} least recently used entries from {self.path.name}")
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hit_rate, 3), "entries": len(self)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,103 @@
+import math
+import re
+from functools import lru_cache
+
+from loguru import logger
+
+try:
+    import tiktoken
+except ImportError:  # a declared dependency, the character based estimates below are a last resort
+    tiktoken = None
+
+CHARS_PER_TOKEN = 4  # rough average for code with the OpenAI tokenizers
+# split_tokens must never exceed the model's input limit: dense code, minified js or json can take
+# less than 2 characters per token, so windows cut without a tokenizer assume the worst case
+SPLIT_CHARS_PER_TOKEN = 1.5
+
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_WORD_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+
+@lru_cache(maxsize=None)
+def _encoding(model_name: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model_name: str = "gpt-4o") -> int:
+    """
+    Number of tokens 'text' takes for 'model_name', exact when tiktoken is installed, estimated otherwise.
+    """
+    encoding = _encoding(model_name or "gpt-4o")
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_tokens(text: str, max_tokens: int, overlap: int = 0, model_name: str = "gpt-4o") -> list:
+    """
+    'text' as windows of at most 'max_tokens' tokens, consecutive windows sharing 'overlap' tokens.
+    Returns (window text, token count) pairs, a single pair when the text fits.
+    Windows are cut on token boundaries with tiktoken, otherwise on character positions assuming
+    SPLIT_CHARS_PER_TOKEN, which makes more, smaller windows than needed but none over the limit.
+    """
+    step = max(1, max_tokens - overlap)
+    encoding = _encoding(model_name or "gpt-4o")
+    if encoding is None:
+        _warn_estimated_split()
+        size, chars_step = int(max_tokens * SPLIT_CHARS_PER_TOKEN), max(1, int(step * SPLIT_CHARS_PER_TOKEN))
+        # the counts are upper bounds as well, they also cap the tokens of an embedding request
+        if len(text) <= size:
+            return [(text, math.ceil(len(text) / SPLIT_CHARS_PER_TOKEN))]
+        starts = range(0, max(len(text) - int(overlap * SPLIT_CHARS_PER_TOKEN), 1), chars_step)
+        return [(text[i:i + size], math.ceil(len(text[i:i + size]) / SPLIT_CHARS_PER_TOKEN)) for i in starts]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return [(text, len(tokens))]
+    starts = range(0, max(len(tokens) - overlap, 1), step)
+    return [(encoding.decode(tokens[i:i + max_tokens]), len(tokens[i:i + max_tokens])) for i in starts]
+
+
+@lru_cache(maxsize=1)
+def _warn_estimated_split():
+    logger.warning(
+        f"tiktoken is not installed, documents are split on an estimate of {SPLIT_CHARS_PER_TOKEN} characters "
+        "per token: more embedding requests than needed, install tiktoken for exact splits"
+    )
+
+
+@lru_cache(maxsize=2**16)
+def split_identifier(identifier: str) -> tuple:
+    """
+    camelCase / PascalCase / snake_case parts of an identifier, lowercased: "parseHTTPResponse_v2" ->
+    ("parse", "http", "response", "v", "2").
+    """
+    return tuple(word.lower() for word in _WORD_RE.findall(identifier))
+
+
+def identifiers(text: str) -> list:
+    return _IDENTIFIER_RE.findall(text)
+
+
+@lru_cache(maxsize=2**16)
+def identifier_tokens(identifier: str) -> tuple:
+    """
+    The identifier, lowercased, followed by its parts when it has more than one.
+    """
+    parts = split_identifier(identifier)
+    return (identifier.lower(), *parts) if len(parts) > 1 else (identifier.lower(),)
+
+
+def code_tokens(text: str) -> list:
+    """
+    Identifier aware tokenization of code or a question: every identifier, lowercased, followed by its
+    camelCase/snake_case parts when it has more than one, so "build_index" matches both "build_index" and "index".
+    """
+    tokens = []
+    for identifier in _IDENTIFIER_RE.findall(text):
+        tokens.extend(identifier_tokens(identifier))
+    return tokens
@@ -21,6 +21,42 @@ def wait_for_server(url, timeout=10):
     logger.info("API server did not start in time.")
     return False
 
+def wait_for_index_job(url, job_id, timeout=None, poll_interval=1.0):
+    """
+    Polls the api server at 'url' until index job 'job_id' (returned by /index_repo) finishes.
+    Returns True if it succeeded.
+    """
+    start_time = time.time()
+    while timeout is None or time.time() - start_time < timeout:
+        job = requests.get(f"{url}/index_jobs/{job_id}").json()
+        if job["status"] == "succeeded":
+            logger.info(f"indexing finished: {job['repo_path']}")
+            return True
+        if job["status"] == "failed":
+            logger.error(f"indexing failed: {job['error']}")
+            return False
+        time.sleep(poll_interval)
+    logger.info("indexing did not finish in time.")
+    return False
+
+def index_repo(url, repo_path, timeout=None, repo=None, revision=None):
+    """
+    Submit 'repo_path' for indexing to the api server at 'url' and block until the index is served.
+    'repo' names the index for queries, the server defaults to the directory name.
+    'revision' indexes a branch, tag or commit of the repo instead of its working tree.
+    """
+    response = requests.post(url=f"{url}/index_repo", json={"repo_path": repo_path, "repo": repo, "revision": revision})
+    response.raise_for_status()
+    return wait_for_index_job(url, response.json()["job_id"], timeout=timeout)
+
+def query_repo_batch(url, questions, repo=None, timeout=None):
+    """
+    Ask several questions in one request to the api server at 'url', returns their answers in the same order.
+    """
+    response = requests.post(url=f"{url}/query_repo_batch", json={"questions": questions, "repo": repo}, timeout=timeout)
+    response.raise_for_status()
+    return [result["answer"] for result in response.json()["answers"]]
+
 def run_api_server(host: str, port: int):
     uvicorn.run(app, host=host, port=port)
 
@@ -0,0 +1,332 @@
+import json
+import shutil
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+from .atomic_dir import make_tmp_dir, recover_dir, replace_dir
+from .config import SystemConfig
+
+VECTOR_DTYPES = ("float32", "float16", "int8")
+_MISSING_INT = np.iinfo(np.int64).min
+_SCORE_BLOCK_ROWS = 65536  # rows converted to float32 at a time when scoring float16 / int8 vectors
+
+
+class NumpyVectorStore:
+    """
+    Exact nearest neighbour search over one contiguous matrix of unit vectors, a stand-in for the subset of the
+    chroma Collection api the index uses (add / update / delete / get / query / count).
+    Stored in '{db_dir}/{name}.vectors/', every file is memory-mapped on load:
+      vectors.npy                        (n, dim) float32, float16 or int8 (int8 rows have a float32 scale each)
+      scales.npy                         (n,) int8 only
+      ids.npy                            (n,) fixed width bytes
+      documents.bin, document_offsets.npy  utf-8 texts, concatenated
+      meta_{i}.npy, metadata.json        one array per metadata key: int64 values or int32 codes of a string table
+    Changes are kept in memory and folded into new arrays on persist(), written to a new directory that then
+    replaces the stored one (see atomic_dir.replace_dir, a crash between its two renames is recovered on load).
+    Readers of the previous files keep working: their mappings outlive the unlinked files.
+    New and rewritten rows are stored as 'dtype', rows loaded from disk are served in the dtype they were written in.
+    """
+    # the base arrays are never modified in place, concurrent reads are safe (see RepoData.db_lock)
+    thread_safe = True
+
+    def __init__(self, path: str, dtype: str = SystemConfig.vector_dtype, embedding_function=None):
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"unknown vector dtype {dtype}, expected one of {VECTOR_DTYPES}")
+        self.path = Path(path)
+        self.dtype = dtype
+        self.embedding_function = embedding_function
+
+        self._vectors = None  # base arrays, memory-mapped when clean
+        self._scales = None
+        self._ids = []
+        self._row = None  # id -> row of the base arrays, built on first use
+        self._doc_bytes = np.zeros(0, dtype=np.uint8)
+        self._doc_offsets = np.zeros(1, dtype=np.int64)
+        self._meta_columns = {}  # key -> (kind, array, string table)
+
+        # pending changes, see _compact
+        self._deleted = set()
+        self._updates = {}
+        self._added = ([], [], [], [])  # ids, vectors, documents, metadatas
+        if recover_dir(self.path):
+            self._load()
+
+    @property
+    def nbytes(self) -> int:
+        size = self._doc_bytes.nbytes + self._doc_offsets.nbytes
+        if self._vectors is not None:
+            size += self._vectors.nbytes + (self._scales.nbytes if self._scales is not None else 0)
+        return size + sum(array.nbytes for _, array, _ in self._meta_columns.values())
+
+    def count(self) -> int:
+        return len(self._ids) - len(self._deleted) + len(self._added[0])
+
+    def add(self, ids: list, embeddings: Optional[list] = None, documents: Optional[list] = None,
+            metadatas: Optional[list] = None):
+        if embeddings is None:
+            embeddings = self.embedding_function(documents)
+        pending_ids, vectors, pending_documents, pending_metadatas = self._added
+        pending_ids.extend(ids)
+        vectors.append(_unit_rows(np.asarray(embeddings, dtype=np.float32)))
+        pending_documents.extend(documents if documents is not None else [""] * len(ids))
+        pending_metadatas.extend(metadatas if metadatas is not None else [{}] * len(ids))
+
+    def update(self, ids: list, metadatas: list):
+        self._require_clean_or_base(ids)
+        for doc_id, metadata in zip(ids, metadatas):
+            self._updates[doc_id] = metadata
+
+    def delete(self, ids: list):
+        self._require_clean_or_base(ids)
+        self._deleted.update(ids)
+
+    def get(self, ids: list) -> dict:
+        """
+        Rows of 'ids' (unknown ids are skipped), as {"ids", "documents", "metadatas"} like chroma.
+        """
+        self._compact()
+        row = self._row_index()
+        rows = [row[doc_id] for doc_id in ids if doc_id in row]
+        return {
+            "ids": [self._ids[i] for i in rows],
+            "documents": [self._document(i) for i in rows],
+            "metadatas": [self._metadata(i) for i in rows],
+        }
+
+    def query(self, query_embeddings: list, n_results: int = 10) -> dict:
+        """
+        Top 'n_results' rows by cosine similarity for every query, nested lists like chroma.
+        'distances' are squared L2 distances between unit vectors (2 - 2 * cosine), chroma's default metric.
+        """
+        self._compact()
+        queries = _unit_rows(np.asarray(query_embeddings, dtype=np.float32))
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        n_rows = len(self._ids)
+        scores = self._scores(queries) if n_rows else np.zeros((len(queries), 0), dtype=np.float32)
+        k = min(n_results, n_rows)
+        for query_scores in scores:
+            top = np.argpartition(-query_scores, k - 1)[:k] if 0 < k < n_rows else np.arange(k)
+            top = top[np.argsort(-query_scores[top], kind="stable")]
+            results["ids"].append([self._ids[i] for i in top])
+            results["documents"].append([self._document(i) for i in top])
+            results["metadatas"].append([self._metadata(i) for i in top])
+            results["distances"].append((2 - 2 * query_scores[top]).tolist())
+        return results
+
+    def persist(self):
+        """
+        Fold pending changes into the base arrays, write them to a new directory and swap it in.
+        """
+        if not self._dirty() and self.path.exists():
+            return
+        self._compact()
+        tmp_path = make_tmp_dir(self.path)
+
+        vectors = self._vectors if self._vectors is not None else np.zeros((0, 0), dtype=self.dtype)
+        np.save(tmp_path / "vectors.npy", vectors)
+        if self._scales is not None:
+            np.save(tmp_path / "scales.npy", self._scales)
+        np.save(tmp_path / "ids.npy", np.array([doc_id.encode("utf-8") for doc_id in self._ids], dtype=bytes))
+        self._doc_bytes.tofile(tmp_path / "documents.bin")
+        np.save(tmp_path / "document_offsets.npy", self._doc_offsets)
+        columns = {}
+        for i, (key, (kind, array, strings)) in enumerate(self._meta_columns.items()):
+            np.save(tmp_path / f"meta_{i}.npy", array)
+            columns[key] = {"file": f"meta_{i}.npy", "kind": kind, "strings": strings}
+        with open(tmp_path / "metadata.json", "w", encoding="utf-8") as f:
+            json.dump({"dtype": self.dtype, "columns": columns}, f)
+
+        replace_dir(tmp_path, self.path)
+        # serve from the new files, the arrays built in memory are dropped
+        self._load()
+
+    def _load(self):
+        with open(self.path / "metadata.json", "r", encoding="utf-8") as f:
+            info = json.load(f)
+        vectors = np.load(self.path / "vectors.npy", mmap_mode="r")
+        self._vectors = vectors if vectors.size else None
+        scales_path = self.path / "scales.npy"
+        self._scales = np.load(scales_path, mmap_mode="r") if scales_path.exists() else None
+        self._ids = [doc_id.decode("utf-8") for doc_id in np.load(self.path / "ids.npy")]
+        self._row = None
+        self._doc_offsets = np.load(self.path / "document_offsets.npy", mmap_mode="r")
+        self._doc_bytes = (
+            np.memmap(self.path / "documents.bin", dtype=np.uint8, mode="r") if self._doc_offsets[-1]
+            else np.zeros(0, dtype=np.uint8)
+        )
+        self._meta_columns = {
+            key: (column["kind"], np.load(self.path / column["file"], mmap_mode="r"), column["strings"])
+            for key, column in info["columns"].items()
+        }
+        self._deleted, self._updates, self._added = set(), {}, ([], [], [], [])
+        logger.info(f"loaded {len(self._ids)} {self.dtype} vectors from {self.path}")
+
+    def _dirty(self) -> bool:
+        return bool(self._deleted or self._updates or self._added[0])
+
+    def _require_clean_or_base(self, ids: list):
+        # deletes and updates refer to stored rows, fold pending adds in first so they can be addressed too
+        if self._added[0]:
+            pending = set(self._added[0])
+            if any(doc_id in pending for doc_id in ids):
+                self._compact()
+
+    def _row_index(self) -> dict:
+        if self._row is None:
+            self._row = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        return self._row
+
+    def _document(self, i: int) -> str:
+        return self._doc_bytes[self._doc_offsets[i]:self._doc_offsets[i + 1]].tobytes().decode("utf-8")
+
+    def _metadata(self, i: int) -> dict:
+        metadata = {}
+        for key, (kind, array, strings) in self._meta_columns.items():
+            value = array[i]
+            if kind == "str":
+                if value >= 0:
+                    metadata[key] = strings[value]
+            elif kind == "int":
+                if value != _MISSING_INT:
+                    metadata[key] = int(value)
+            elif not np.isnan(value):
+                metadata[key] = float(value)
+        return metadata
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        """
+        (n_queries, n_rows) cosine similarities, dequantizing float16 / int8 rows block by block.
+        """
+        if self._vectors.dtype == np.float32:
+            return queries @ self._vectors.T
+        scores = np.empty((len(queries), len(self._ids)), dtype=np.float32)
+        for start in range(0, len(self._ids), _SCORE_BLOCK_ROWS):
+            block = self._vectors[start:start + _SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        if self._scales is not None:
+            scores *= self._scales
+        return scores
+
+    def _compact(self):
+        """
+        Apply pending deletes, updates and adds: rebuilds the base arrays in memory (written by persist).
+        """
+        if not self._dirty():
+            return
+        keep = [i for i, doc_id in enumerate(self._ids) if doc_id not in self._deleted]
+        added_ids, added_vectors, added_documents, added_metadatas = self._added
+
+        ids = [self._ids[i] for i in keep] + list(added_ids)
+        metadatas = [self._updates.get(self._ids[i]) or self._metadata(i) for i in keep] + list(added_metadatas)
+        documents = [self._document(i) for i in keep] + list(added_documents)
+        kept_vectors = self._stored_vectors(keep)
+        new_vectors = np.concatenate(added_vectors) if added_vectors else None
+        if kept_vectors is not None and new_vectors is not None:
+            vectors = np.concatenate([kept_vectors, new_vectors])
+        else:
+            vectors = kept_vectors if kept_vectors is not None else new_vectors
+        self._vectors, self._scales = _encode(vectors, self.dtype) if vectors is not None and len(vectors) else (None, None)
+
+        self._ids = ids
+        self._row = None
+        encoded = [document.encode("utf-8", errors="surrogatepass") for document in documents]
+        self._doc_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=self._doc_offsets[1:])
+        self._doc_bytes = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        self._meta_columns = _encode_metadata(metadatas)
+        self._deleted, self._updates, self._added = set(), {}, ([], [], [], [])
+
+    def _stored_vectors(self, rows: list) -> Optional[np.ndarray]:
+        # float32 unit vectors of stored rows
+        if self._vectors is None or not rows:
+            return None
+        vectors = np.asarray(self._vectors[rows], dtype=np.float32)
+        if self._scales is not None:
+            vectors *= np.asarray(self._scales[rows])[:, None]
+        return vectors
+
+
+class NumpyVectorStoreClient:
+    """
+    Stands in for a chroma client over NumpyVectorStore collections kept in 'db_dir'.
+    """
+    def __init__(self, db_dir: str, dtype: str = SystemConfig.vector_dtype):
+        self.db_dir = Path(db_dir)
+        self.dtype = dtype
+        self._collections = {}
+
+    def _path(self, name: str) -> Path:
+        return self.db_dir / f"{name}.vectors"
+
+    def get_collection(self, name: str, embedding_function=None) -> NumpyVectorStore:
+        if name not in self._collections:
+            if not recover_dir(self._path(name)):
+                raise ValueError(f"collection {name} does not exist in {self.db_dir}")
+            self._collections[name] = NumpyVectorStore(self._path(name), self.dtype, embedding_function)
+        return self._collections[name]
+
+    def get_or_create_collection(self, name: str, embedding_function=None) -> NumpyVectorStore:
+        if name not in self._collections:
+            self._collections[name] = NumpyVectorStore(self._path(name), self.dtype, embedding_function)
+        return self._collections[name]
+
+    def create_collection(self, name: str, embedding_function=None) -> NumpyVectorStore:
+        if self._path(name).exists() or name in self._collections:
+            raise ValueError(f"collection {name} already exists in {self.db_dir}")
+        return self.get_or_create_collection(name, embedding_function)
+
+    def delete_collection(self, name: str):
+        self._collections.pop(name, None)
+        shutil.rmtree(self._path(name), ignore_errors=True)
+
+    def persist(self):
+        self.db_dir.mkdir(parents=True, exist_ok=True)
+        for collection in self._collections.values():
+            collection.persist()
+
+
+def _unit_rows(matrix: np.ndarray) -> np.ndarray:
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+def _encode(vectors: np.ndarray, dtype: str):
+    """
+    Returns (stored vectors, per row scales or None) for float32 unit vectors.
+    int8 is symmetric per row: v ~= int8_row * scale, scale = max |v| / 127.
+    """
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(dtype), None
+
+
+def _encode_metadata(metadatas: list) -> dict:
+    """
+    Column arrays of a list of metadata dicts: strings become int32 codes of a per column string table (-1 if
+    missing), ints int64 (_MISSING_INT if missing), floats float64 (nan if missing).
+    """
+    keys = {}
+    for metadata in metadatas:
+        for key, value in metadata.items():
+            kinds = keys.setdefault(key, set())
+            kinds.add("str" if isinstance(value, str) else "int" if isinstance(value, int) else "float")
+    columns = {}
+    for key, kinds in keys.items():
+        values = [metadata.get(key) for metadata in metadatas]
+        if "str" in kinds:
+            strings, codes = {}, []
+            for value in values:
+                codes.append(-1 if value is None else strings.setdefault(str(value), len(strings)))
+            columns[key] = ("str", np.asarray(codes, dtype=np.int32), list(strings))
+        elif kinds == {"int"}:
+            columns[key] = ("int", np.asarray([_MISSING_INT if v is None else v for v in values], dtype=np.int64), None)
+        else:
+            columns[key] = ("float", np.asarray([np.nan if v is None else v for v in values], dtype=np.float64), None)
+    return columns
@@ -0,0 +1,245 @@
+import os
+import re
+import stat
+from pathlib import Path
+from typing import Iterable, Optional
+
+import git
+from loguru import logger
+
+from .config import SystemConfig
+
+BINARY_SNIFF_BYTES = 8192
+_REGULAR_FILE_MODES = (0o100644, 0o100755)  # not symlinks (whose blob is the link target)
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """
+    Regex body of a gitignore style glob: '*' and '?' stop at '/', '**' spans directories, [...] is a class.
+    """
+    out, i = [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif c == "*":
+            out.append("[^/]*")
+            i += 1
+        elif c == "?":
+            out.append("[^/]")
+            i += 1
+        elif c == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            body = pattern[i + 1:end]
+            out.append("[" + ("^" + body[1:] if body.startswith("!") else body).replace("\\", "\\\\") + "]")
+            i = end + 1
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return "".join(out)
+
+
+class IgnoreRules:
+    """
+    Paths matched by gitignore style patterns, relative to the repo root with '/' separators.
+    Patterns without an inner '/' match a name at any depth below the directory that declared them,
+    others are anchored to it. A trailing '/' only matches directories, a leading '!' re-includes,
+    and the last matching pattern wins (so the rules of nested .gitignore files override their parents).
+    """
+    def __init__(self, patterns: Iterable[str] = ()):
+        self._rules = []  # (compiled regex over the full relative path, negate, dir_only)
+        self.add_patterns(patterns)
+
+    def __bool__(self):
+        return bool(self._rules)
+
+    def add_patterns(self, patterns: Iterable[str], base: str = ""):
+        """
+        'base' is the relative directory the patterns were read from, "" for the repo root.
+        """
+        prefix = re.escape(base + "/") if base else ""
+        for line in patterns:
+            line = line.rstrip("\n").rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            if line.startswith("\\"):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.strip("/") if dir_only else line
+            if not line:
+                continue
+            anchored = "/" in line
+            line = line.lstrip("/")
+            regex = prefix + ("" if anchored else "(?:.*/)?") + _glob_to_regex(line) + "$"
+            self._rules.append((re.compile(regex), negate, dir_only))
+
+    def add_file(self, path: str, base: str = ""):
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                self.add_patterns(f.readlines(), base)
+        except OSError:
+            pass
+
+    def match(self, rel_path: str, is_dir: bool) -> Optional[bool]:
+        """
+        True when the last pattern matching 'rel_path' ignores it, False when it re-includes it, None if none matches.
+        """
+        for regex, negate, dir_only in reversed(self._rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                return not negate
+        return None
+
+    def matches_path_or_parent(self, rel_path: str) -> bool:
+        """
+        For include patterns: 'src/' or 'src/**' select every file below src.
+        """
+        if self.match(rel_path, False):
+            return True
+        parts = rel_path.split("/")[:-1]
+        return any(self.match("/".join(parts[:i]), True) for i in range(len(parts), 0, -1))
+
+
+def is_binary(path: str) -> bool:
+    """
+    A NUL byte in the first few KB, the heuristic git uses.
+    """
+    try:
+        with open(path, "rb") as f:
+            return b"\0" in f.read(BINARY_SNIFF_BYTES)
+    except OSError:
+        return True
+
+
+def iter_source_files(repo_path: str, suffixes: Optional[Iterable[str]] = None, skip_paths: Iterable[str] = ()):
+    """
+    Yields the files of repo_path worth indexing, in a stable order.
+    Directories are pruned before they are entered: SystemConfig.excluded_dirs, virtualenvs, the index
+    directories (SystemConfig.db_root and 'skip_paths'), .gitignore'd ones and SystemConfig.exclude_globs.
+    Files need one of 'suffixes' (default SystemConfig.file_suffixes), must match SystemConfig.include_globs
+    when set, and must be non-empty text files of at most SystemConfig.max_file_bytes (max_notebook_bytes for
+    notebooks, whose outputs are dropped before chunking).
+    """
+    root = Path(repo_path)
+    suffixes = frozenset(SystemConfig.file_suffixes if suffixes is None else suffixes)
+    excluded_dirs = frozenset(SystemConfig.excluded_dirs)
+    skip_real_paths = {os.path.realpath(p) for p in (SystemConfig.db_root, *skip_paths) if p}
+    include = IgnoreRules(SystemConfig.include_globs)
+    exclude = IgnoreRules(SystemConfig.exclude_globs)
+    gitignore = IgnoreRules()
+    if SystemConfig.respect_gitignore:
+        gitignore.add_file(os.path.join(root, ".git", "info", "exclude"))
+
+    def ignored(rel_path: str, is_dir: bool) -> bool:
+        return bool(exclude.match(rel_path, is_dir) or gitignore.match(rel_path, is_dir))
+
+    yielded = 0
+    skipped = {"ignored": 0, "binary": 0, "too large": 0}
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root)
+        rel_dir = "" if rel_dir == "." else rel_dir.replace(os.sep, "/")
+        if SystemConfig.respect_gitignore and ".gitignore" in filenames:
+            gitignore.add_file(os.path.join(dirpath, ".gitignore"), rel_dir)
+
+        # 1. Prune directories, os.walk only descends into what is left in dirnames
+        kept = []
+        for name in sorted(dirnames):
+            path = os.path.join(dirpath, name)
+            if (name in excluded_dirs or ignored(f"{rel_dir}/{name}" if rel_dir else name, True)
+                    or os.path.realpath(path) in skip_real_paths
+                    or os.path.exists(os.path.join(path, "pyvenv.cfg"))):
+                skipped["ignored"] += 1
+                continue
+            kept.append(name)
+        dirnames[:] = kept
+
+        # 2. Filter files, cheapest checks first
+        for name in sorted(filenames):
+            if os.path.splitext(name)[1] not in suffixes:
+                continue
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+            if ignored(rel_path, False) or (include and not include.matches_path_or_parent(rel_path)):
+                skipped["ignored"] += 1
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+                continue
+            max_bytes = SystemConfig.max_notebook_bytes if name.endswith(".ipynb") else SystemConfig.max_file_bytes
+            if st.st_size > max_bytes:
+                skipped["too large"] += 1
+                continue
+            if is_binary(path):
+                skipped["binary"] += 1
+                continue
+            yielded += 1
+            yield Path(path)
+
+    logger.info(f"walked {root}: {yielded} files to index, skipped " + ", ".join(f"{n} {k}" for k, n in skipped.items()))
+
+
+def resolve_revision(repo_path: str, revision: str) -> str:
+    """
+    Commit sha of 'revision' (a branch, tag, sha or any rev-parse expression) in the git repo at repo_path.
+    Raises ValueError when repo_path is not a git repo or the revision does not name a commit.
+    """
+    try:
+        return git.Repo(repo_path).commit(revision).hexsha
+    except (git.exc.GitError, git.exc.BadName, ValueError) as e:
+        raise ValueError(f"cannot resolve revision {revision!r} of {repo_path}: {e}") from e
+
+
+def iter_revision_blobs(repo_path: str, revision: str, suffixes: Optional[Iterable[str]] = None):
+    """
+    Like iter_source_files but over the tree of a commit, read from the git object store without a checkout.
+    Yields (rel_path, blob) in a stable order. The same filters apply except .gitignore (a committed file is
+    tracked) and the binary check, which needs the blob's content and is left to the reader.
+    """
+    tree = git.Repo(repo_path).commit(revision).tree
+    suffixes = frozenset(SystemConfig.file_suffixes if suffixes is None else suffixes)
+    excluded_dirs = frozenset(SystemConfig.excluded_dirs)
+    include = IgnoreRules(SystemConfig.include_globs)
+    exclude = IgnoreRules(SystemConfig.exclude_globs)
+
+    yielded = 0
+    skipped = {"ignored": 0, "too large": 0}
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        # 1. Prune directories, the same rules as on disk
+        for subtree in sorted(tree.trees, key=lambda t: t.path, reverse=True):
+            if (subtree.name in excluded_dirs or exclude.match(subtree.path, True)
+                    or any(blob.name == "pyvenv.cfg" for blob in subtree.blobs)):
+                skipped["ignored"] += 1
+                continue
+            stack.append(subtree)
+
+        # 2. Filter files, the size comes from the object header, the content is not read here
+        for blob in sorted(tree.blobs, key=lambda b: b.path):
+            if os.path.splitext(blob.name)[1] not in suffixes or blob.mode not in _REGULAR_FILE_MODES:
+                continue
+            if exclude.match(blob.path, False) or (include and not include.matches_path_or_parent(blob.path)):
+                skipped["ignored"] += 1
+                continue
+            max_bytes = SystemConfig.max_notebook_bytes if blob.name.endswith(".ipynb") else SystemConfig.max_file_bytes
+            if blob.size == 0:
+                continue
+            if blob.size > max_bytes:
+                skipped["too large"] += 1
+                continue
+            yielded += 1
+            yield blob.path, blob
+
+    logger.info(f"walked {repo_path}@{revision}: {yielded} files to index, skipped "
+                + ", ".join(f"{n} {k}" for k, n in skipped.items()))
@@ -0,0 +1,57 @@
+import numpy as np
+
+from repo_qa.answer_cache import SemanticAnswerCache
+
+
+def _vector(*values):
+    return np.asarray(values, dtype=np.float32)
+
+
+def test_same_question_is_cached_per_owner():
+    cache = SemanticAnswerCache(threshold=0.9, max_entries=10, ttl=None)
+    cache.store("What does build_index do?", _vector(1, 0), "answer for 1", [], owner=1)
+    cache.store("what does  build_index do?", _vector(1, 0), "answer for 2", [], owner=2)
+    assert cache.get_exact("What does build_index do?", owner=1).answer == "answer for 1"
+    assert cache.get_exact("What does build_index do?", owner=2).answer == "answer for 2"
+    assert cache.lookup(_vector(1, 0.1), owner=1).answer == "answer for 1"
+    assert cache.lookup(_vector(1, 0.1), owner=2).answer == "answer for 2"
+    assert cache.lookup(_vector(1, 0), owner=3) is None
+
+
+def test_lookup_sees_stores_and_evictions_since_the_last_lookup():
+    cache = SemanticAnswerCache(threshold=0.99, max_entries=3, ttl=None)
+    for i in range(40):
+        angle = i * 0.1
+        cache.store(f"question {i}", _vector(np.cos(angle), np.sin(angle)), f"answer {i}", [], owner=0)
+        assert cache.lookup(_vector(np.cos(angle), np.sin(angle)), owner=0).answer == f"answer {i}"
+    # evicted, least recently used first
+    assert cache.lookup(_vector(1, 0), owner=0) is None
+    assert cache.get_exact("question 36", owner=0) is None
+    assert len(cache._entries) == 3 and len(cache._rows) == 3
+    # rows of evicted entries are reused instead of growing the matrix
+    assert cache._n_rows <= 4
+
+
+def test_restoring_a_question_replaces_its_row():
+    cache = SemanticAnswerCache(threshold=0.99, max_entries=10, ttl=None)
+    cache.store("q", _vector(1, 0), "old", [], owner=0)
+    cache.store("q", _vector(0, 1), "new", [], owner=0)
+    assert cache.lookup(_vector(1, 0), owner=0) is None
+    assert cache.lookup(_vector(0, 1), owner=0).answer == "new"
+
+
+def test_drop_owner_forgets_its_entries():
+    cache = SemanticAnswerCache(threshold=0.9, max_entries=10, ttl=None)
+    cache.store("q", _vector(1, 0), "a", [], owner=1)
+    cache.store("q", _vector(1, 0), "b", [], owner=2)
+    cache.drop_owner(1)
+    assert cache.lookup(_vector(1, 0), owner=1) is None
+    assert cache.lookup(_vector(1, 0), owner=2).answer == "b"
+
+
+def test_expired_entries_do_not_match():
+    cache = SemanticAnswerCache(threshold=0.9, max_entries=10, ttl=0)
+    cache.store("q", _vector(1, 0), "a", [], owner=0)
+    assert cache.get_exact("q", owner=0) is None
+    cache.store("q", _vector(1, 0), "a", [], owner=0)
+    assert cache.lookup(_vector(1, 0), owner=0) is None
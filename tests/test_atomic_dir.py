@@ -0,0 +1,43 @@
+import numpy as np
+
+from repo_qa.atomic_dir import make_tmp_dir, recover_dir, replace_dir
+from repo_qa.vector_store import NumpyVectorStoreClient
+
+
+def test_tmp_dirs_are_unique(tmp_path):
+    target = tmp_path / "index"
+    assert make_tmp_dir(target) != make_tmp_dir(target)
+
+
+def test_replace_dir_swaps_contents(tmp_path):
+    target = tmp_path / "index"
+    for version in ("1", "2"):
+        tmp = make_tmp_dir(target)
+        (tmp / "version").write_text(version)
+        replace_dir(tmp, target)
+    assert (target / "version").read_text() == "2"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["index"]
+
+
+def test_interrupted_swap_is_recovered(tmp_path):
+    target = tmp_path / "index"
+    target.mkdir()
+    (target / "version").write_text("1")
+    # crash after moving the current directory aside, before the new one was renamed in
+    target.rename(tmp_path / "index.old-abc")
+    assert recover_dir(target)
+    assert (target / "version").read_text() == "1"
+    assert not recover_dir(tmp_path / "missing")
+
+
+def test_vector_store_reloads_after_interrupted_persist(tmp_path):
+    client = NumpyVectorStoreClient(str(tmp_path))
+    collection = client.get_or_create_collection("chunks")
+    collection.add(ids=["a", "b"], embeddings=np.eye(2).tolist(), documents=["x", "y"],
+                   metadatas=[{"name": "a"}, {"name": "b"}])
+    client.persist()
+    (tmp_path / "chunks.vectors").rename(tmp_path / "chunks.vectors.old-abc")
+
+    reloaded = NumpyVectorStoreClient(str(tmp_path)).get_collection("chunks")
+    assert reloaded.count() == 2
+    assert reloaded.query([[0.0, 1.0]], n_results=1)["ids"] == [["b"]]
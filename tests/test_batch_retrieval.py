@@ -0,0 +1,91 @@
+import pytest
+
+from repo_qa.config import SystemConfig
+from repo_qa.indexing import build_index
+from repo_qa.retrieval import retrieve_batch, retrieve_with_callgraph
+
+MODULES = {
+    "shop/cart.py": """\
+from shop.pricing import total_price
+
+
+def checkout(cart):
+    return total_price(cart.items)
+""",
+    "shop/pricing.py": """\
+def total_price(items):
+    return sum(unit_price(item) for item in items)
+
+
+def unit_price(item):
+    return item.price * (1 - item.discount)
+""",
+    "shop/users.py": """\
+def register(email):
+    return {"email": email.lower()}
+""",
+}
+
+QUESTIONS = [
+    "how is the price of a cart computed at checkout?",
+    "where are discounts applied?",
+    "what happens when someone signs up?",
+    "`total_price`",
+]
+
+
+class Counting:
+    def __init__(self, wrapped, calls: list):
+        self._wrapped = wrapped
+        self._calls = calls
+
+    def __call__(self, texts):
+        self._calls.append(("embed", len(texts)))
+        return self._wrapped(texts)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._wrapped, name)
+        if name not in ("query", "get"):
+            return attribute
+
+        def counted(*args, **kwargs):
+            self._calls.append((name, kwargs))
+            return attribute(*args, **kwargs)
+        return counted
+
+
+@pytest.fixture
+def repo_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(SystemConfig, "embedding_function", "HashingEmbeddingFunction")
+    monkeypatch.setattr(SystemConfig, "vector_store", "numpy")
+    repo = tmp_path / "repo"
+    for rel_path, source in MODULES.items():
+        (repo / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (repo / rel_path).write_text(source)
+    repo_data = build_index(str(repo), db_dir=str(tmp_path / "db"), embedding_cache_path=None)
+    yield repo_data
+    repo_data.retire()
+
+
+def test_batch_matches_one_question_at_a_time(repo_data):
+    batch = retrieve_batch(QUESTIONS, repo_data, top_k=2, depth=1)
+    assert batch == [retrieve_with_callgraph(question, repo_data, top_k=2, depth=1) for question in QUESTIONS]
+
+
+def test_batch_shares_embedding_query_and_fetch(repo_data):
+    calls = []
+    repo_data.embedder = Counting(repo_data.embedder, calls)
+    repo_data.collection = Counting(repo_data.collection, calls)
+    results = retrieve_batch(QUESTIONS, repo_data, top_k=2, depth=1)
+
+    # the question naming `total_price` skips the embedding and the vector search
+    assert calls[0] == ("embed", 3)
+    names = [name for name, _ in calls]
+    assert names[:2] == ["embed", "query"] and names[2:] in ([], ["get"])
+    assert len(calls[1][1]["query_embeddings"]) == 3
+    # chunks missing from the query results, wanted by several questions or not, are fetched once
+    for _, kwargs in calls[2:]:
+        assert len(kwargs["ids"]) == len(set(kwargs["ids"]))
+    assert [doc_id for doc_id, _, _ in results[3]][0] in repo_data.name_index["shop.pricing.total_price"]
+    # expansion follows the call graph from the definition
+    assert any(meta["name"] == "unit_price" for _, _, meta in results[3])
@@ -0,0 +1,150 @@
+import textwrap
+
+import numpy as np
+
+from repo_qa.callgraph import CallGraph, build_file_call_graph, merge_call_graphs
+
+
+def _graph(files: dict) -> CallGraph:
+    return merge_call_graphs(
+        build_file_call_graph(textwrap.dedent(source), rel_path=rel_path) for rel_path, source in files.items()
+    )
+
+
+REGISTRY = """
+    class RepoRegistry:
+        def resolve(self, name):
+            return name
+
+        def update(self, name):
+            return name
+"""
+
+
+def test_stdlib_method_named_like_a_repo_method_is_not_linked():
+    graph = _graph({
+        "pkg/registry.py": REGISTRY,
+        "pkg/indexing.py": """
+            from pathlib import Path
+
+            def build_index(repo_path, collection):
+                key = str(Path(repo_path).resolve())
+                collection.update(ids=[key])
+        """,
+    })
+    assert graph.callees("pkg.indexing.build_index") == []
+    assert graph.callers("pkg.registry.RepoRegistry.resolve") == []
+
+
+def test_third_party_call_is_not_linked():
+    graph = _graph({
+        "pkg/client.py": """
+            import requests
+
+            def post(url):
+                return url
+
+            def send(url):
+                return requests.post(url)
+        """,
+    })
+    assert graph.callees("pkg.client.send") == []
+
+
+def test_call_to_a_parameter_does_not_link_to_a_nested_function():
+    graph = _graph({
+        "pkg/api.py": """
+            def index_repo(payload):
+                def build(job):
+                    return job
+                return build(payload)
+        """,
+        "pkg/jobs.py": """
+            def run(job, build):
+                return build(job)
+        """,
+    })
+    assert graph.callees("pkg.jobs.run") == []
+    assert graph.callees("pkg.api.index_repo") == ["pkg.api.index_repo.build"]
+
+
+def test_imports_self_and_module_calls_are_resolved():
+    graph = _graph({
+        "pkg/__init__.py": "",
+        "pkg/util.py": """
+            def helper():
+                return 1
+        """,
+        "pkg/core.py": """
+            from .util import helper
+            from . import util
+
+            def local():
+                return 2
+
+            class Service:
+                def run(self):
+                    return self.step() + helper() + util.helper() + local()
+
+                def step(self):
+                    return 0
+        """,
+    })
+    assert set(graph.callees("pkg.core.Service.run")) == {
+        "pkg.core.Service.step", "pkg.util.helper", "pkg.core.local"
+    }
+
+
+def test_star_import_resolves_module_level_definitions():
+    graph = _graph({
+        "pkg/util.py": """
+            def helper():
+                return 1
+        """,
+        "pkg/core.py": """
+            from pkg.util import *
+
+            def run():
+                return helper() + undefined_name()
+        """,
+    })
+    assert graph.callees("pkg.core.run") == ["pkg.util.helper"]
+
+
+def test_csr_adjacency_and_neighbors():
+    symbols = ["a", "b", "c", "d"]
+    graph = CallGraph.from_edges(symbols, np.array([0, 0, 1, 2]), np.array([1, 2, 3, 3]))
+    assert graph.n_edges == 4
+    assert graph.callees("a") == ["b", "c"]
+    assert graph.callers("d") == ["b", "c"]
+    assert graph.callees("d") == []
+    assert graph.neighbors("a", depth=1) == ["a", "b", "c"]
+    assert graph.neighbors("a", depth=2) == ["a", "b", "c", "d"]
+    assert graph.neighbors("d", depth=1, reverse=True) == ["d", "b", "c"]
+    assert graph.neighbors("unknown") == ["unknown"]
+
+
+def test_neighbors_are_in_bfs_order():
+    symbols = ["a", "b", "c", "d", "e"]
+    # a -> e -> b, a -> c: depth 1 names come before depth 2 ones whatever their symbol order
+    graph = CallGraph.from_edges(symbols, np.array([0, 4, 0]), np.array([4, 1, 2]))
+    assert graph.neighbors("a", depth=2) == ["a", "c", "e", "b"]
+
+
+def test_inherited_method_is_not_linked_by_bare_name():
+    graph = _graph({
+        "pkg/store.py": """
+            class Store:
+                def save(self):
+                    return 1
+        """,
+        "pkg/model.py": """
+            from external import Base
+
+            class Model(Base):
+                def persist(self):
+                    return self.save()
+        """,
+    })
+    assert graph.callees("pkg.model.Model.persist") == []
+    assert graph.callers("pkg.store.Store.save") == []
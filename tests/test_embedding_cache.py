@@ -0,0 +1,42 @@
+from repo_qa.embedding_cache import CachedEmbeddingFunction, EmbeddingCache
+
+
+def _vectors(texts):
+    return [[float(len(text)), 1.0] for text in texts]
+
+
+def test_writes_under_the_limit_do_not_count_rows(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=10)
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    cache.put_many("model", ["a", "b", "c"], _vectors(["a", "b", "c"]))
+    cache.put_many("model", ["a", "d"], _vectors(["a", "d"]))
+    assert not any("COUNT" in statement for statement in statements)
+    assert len(cache) == 4
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=3)
+    cache.put_many("model", ["a", "b", "c"], _vectors(["a", "b", "c"]))
+    cache.get_many("model", ["a"])
+    cache.put_many("model", ["d"], _vectors(["d"]))
+    assert len(cache) == 3
+    assert cache.get_many("model", ["a", "b", "c", "d"]) == [[1.0, 1.0], None, [1.0, 1.0], [1.0, 1.0]]
+    cache.close()
+    # the count survives reopening
+    assert len(EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=3)) == 3
+
+
+def test_only_missing_texts_are_embedded_once(tmp_path):
+    calls = []
+
+    def embedder(texts):
+        calls.append(list(texts))
+        return _vectors(texts)
+
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    embed = CachedEmbeddingFunction(embedder, cache, "model")
+    assert embed(["aa", "b", "aa"]) == [[2.0, 1.0], [1.0, 1.0], [2.0, 1.0]]
+    assert embed(["b", "ccc"]) == [[1.0, 1.0], [3.0, 1.0]]
+    assert calls == [["aa", "b"], ["ccc"]]
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,74 @@
+import numpy as np
+
+from repo_qa.embeddings import CoherentChunkOpenAIEmbeddingFunction
+from repo_qa.tokens import count_tokens, split_tokens
+
+MODEL = "text-embedding-ada-002"
+
+
+class FakeEmbeddingClient:
+    """
+    Stands in for openai.Embedding: the vector of a window is (length, number of 'a's, 1), never unit length.
+    """
+    def __init__(self):
+        self.requests = []
+
+    def create(self, input, engine):
+        self.requests.append(list(input))
+        return {"data": [
+            {"index": i, "embedding": [float(len(text)), float(text.count("a")), 1.0]}
+            for i, text in enumerate(input)
+        ]}
+
+
+def _embedder(**limits) -> CoherentChunkOpenAIEmbeddingFunction:
+    embedder = CoherentChunkOpenAIEmbeddingFunction(api_key="test", model_name=MODEL, **limits)
+    embedder._client = FakeEmbeddingClient()
+    return embedder
+
+
+def test_texts_over_the_limit_are_split():
+    embedder = _embedder(max_tokens=20, overlap=4, max_inputs=100, max_request_tokens=10_000)
+    long_text = " ".join(f"name_{i}" for i in range(200))
+    embedder(["short text", long_text])
+    windows = embedder._client.requests[0]
+    assert windows[0] == "short text"
+    assert len(windows) > 2
+    assert all(count_tokens(window, MODEL) <= 20 for window in windows)
+
+
+def test_requests_respect_the_input_and_token_limits():
+    embedder = _embedder(max_tokens=30, overlap=0, max_inputs=4, max_request_tokens=50)
+    texts = [" ".join(f"word{i}_{j}" for j in range(n)) for i, n in enumerate([3, 40, 1, 12, 25, 2, 2, 2, 2, 60])]
+    vectors = embedder(texts)
+    assert len(vectors) == len(texts)
+    windows = [pair for text in texts for pair in split_tokens(text, 30, 0, MODEL)]
+    requests = embedder._client.requests
+    # every window is sent exactly once, in order
+    assert [window for request in requests for window in request] == [window for window, _ in windows]
+    start = 0
+    for request in requests:
+        assert len(request) <= 4
+        assert sum(n_tokens for _, n_tokens in windows[start:start + len(request)]) <= 50
+        start += len(request)
+
+
+def test_batches_split_on_inputs_and_tokens():
+    embedder = _embedder(max_inputs=3, max_request_tokens=10)
+    assert list(embedder._batches([4, 4, 4, 1, 1, 1, 1, 20, 2])) == [(0, 2), (2, 5), (5, 7), (7, 8), (8, 9)]
+
+
+def test_merged_vectors_are_unit_length_weighted_means():
+    embedder = _embedder(max_tokens=10, overlap=0, max_inputs=100, max_request_tokens=10_000)
+    long_text = "a " * 60 + "b " * 60
+    vectors = np.asarray(embedder(["aaa", long_text, ""]))
+    assert np.allclose(np.linalg.norm(vectors[:2], axis=1), 1.0)
+    assert np.allclose(vectors[0], np.array([3.0, 3.0, 1.0]) / np.linalg.norm([3.0, 3.0, 1.0]))
+    # windows of the long text are merged, weighted by their token counts
+    windows = split_tokens(long_text, 10, 0, MODEL)
+    assert embedder._client.requests[0][1:-1] == [window for window, _ in windows]
+    weights = np.array([n_tokens for _, n_tokens in windows], dtype=np.float32)
+    raw = np.array([[len(w), w.count("a"), 1.0] for w, _ in windows], dtype=np.float32)
+    expected = (raw * weights[:, None]).sum(axis=0)
+    assert len(windows) > 1
+    assert np.allclose(vectors[1], expected / np.linalg.norm(expected), atol=1e-3)
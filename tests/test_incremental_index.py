@@ -0,0 +1,144 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from repo_qa.config import SystemConfig
+from repo_qa.indexing import RepoDiff, _diff_repo, build_index
+from repo_qa.manifest import IndexManifest
+
+A = """\
+def load(path):
+    return parse(path)
+
+
+def parse(path):
+    return path
+"""
+
+B = """\
+class Store:
+    def save(self, item):
+        return item
+
+    def load(self, key):
+        return key
+"""
+
+
+def _write(repo: Path, files: dict):
+    for rel_path, source in files.items():
+        (repo / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (repo / rel_path).write_text(source)
+
+
+@pytest.fixture
+def repo(tmp_path) -> Path:
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    _write(repo, {"pkg/a.py": A, "pkg/b.py": B})
+    git = ["git", "-C", str(repo), "-c", "user.name=t", "-c", "user.email=t@t"]
+    subprocess.run(git + ["init", "-q"], check=True)
+    subprocess.run(git + ["add", "-A"], check=True)
+    subprocess.run(git + ["commit", "-qm", "first"], check=True)
+    return repo
+
+
+def _diff(repo: Path, manifest: IndexManifest):
+    diff = RepoDiff()
+    new_ids = [doc_id for doc_id, _, _ in _diff_repo(str(repo), manifest, diff)]
+    return new_ids, diff
+
+
+def _chunk_ids(manifest: IndexManifest, rel_path: str) -> dict:
+    chunks = manifest.files[rel_path]["chunks"]
+    return {metadata.get("qualname") or metadata["name"]: doc_id for doc_id, metadata in chunks}
+
+
+def test_unchanged_repo_yields_nothing(repo, tmp_path):
+    manifest = IndexManifest(IndexManifest.manifest_path(str(tmp_path), "code_chunks"))
+    new_ids, _ = _diff(repo, manifest)
+    assert sorted(new_ids) == sorted(manifest.all_chunk_ids())
+    manifest.save()
+
+    reloaded = IndexManifest.load(str(tmp_path), "code_chunks")
+    new_ids, diff = _diff(repo, reloaded)
+    assert new_ids == [] and diff.kept_ids == [] and diff.removed_ids == []
+    assert reloaded.files == manifest.files
+
+
+def test_modified_file_only_replaces_changed_blocks(repo, tmp_path):
+    manifest = IndexManifest(IndexManifest.manifest_path(str(tmp_path), "code_chunks"))
+    _diff(repo, manifest)
+    before = _chunk_ids(manifest, "pkg/a.py")
+
+    _write(repo, {"pkg/a.py": A.replace("return path", "return path.strip()")})
+    new_ids, diff = _diff(repo, manifest)
+    after = _chunk_ids(manifest, "pkg/a.py")
+    assert after["pkg.a.load"] == before["pkg.a.load"]
+    assert after["pkg.a.parse"] != before["pkg.a.parse"]
+    assert new_ids == [after["pkg.a.parse"]]
+    assert diff.kept_ids == [after["pkg.a.load"]]
+    assert diff.removed_ids == [before["pkg.a.parse"]]
+
+
+def test_reordered_blocks_keep_their_ids(repo, tmp_path):
+    manifest = IndexManifest(IndexManifest.manifest_path(str(tmp_path), "code_chunks"))
+    _diff(repo, manifest)
+    before = _chunk_ids(manifest, "pkg/a.py")
+
+    load, parse = A.split("\n\n\n")
+    _write(repo, {"pkg/a.py": parse + "\n\n" + load + "\n"})
+    new_ids, diff = _diff(repo, manifest)
+    assert new_ids == [] and diff.removed_ids == []
+    assert _chunk_ids(manifest, "pkg/a.py") == before
+    # kept blocks are re-stored with their new line numbers
+    lines = {metadata["name"]: metadata["start_line"] for metadata in diff.kept_metadatas}
+    assert lines == {"parse": 1, "load": 5}
+
+
+def test_deleted_and_renamed_files(repo, tmp_path):
+    manifest = IndexManifest(IndexManifest.manifest_path(str(tmp_path), "code_chunks"))
+    _diff(repo, manifest)
+    old_a, old_b = set(_chunk_ids(manifest, "pkg/a.py").values()), set(_chunk_ids(manifest, "pkg/b.py").values())
+
+    (repo / "pkg/a.py").unlink()
+    (repo / "pkg/b.py").rename(repo / "pkg/store.py")
+    new_ids, diff = _diff(repo, manifest)
+    assert sorted(manifest.files) == ["pkg/store.py"]
+    # ids are per path, a moved block is a new one
+    assert set(new_ids) == set(_chunk_ids(manifest, "pkg/store.py").values())
+    assert set(diff.removed_ids) == old_a | old_b
+    assert "pkg.store.Store.save" in manifest.call_graph()
+
+
+def test_call_graph_fragments_are_patched_per_file(repo, tmp_path):
+    manifest = IndexManifest(IndexManifest.manifest_path(str(tmp_path), "code_chunks"))
+    _diff(repo, manifest)
+    assert manifest.call_graph().callees("pkg.a.load") == ["pkg.a.parse"]
+
+    calls_store = "from pkg.b import Store\n    return Store.load(None, path)"
+    _write(repo, {"pkg/a.py": A.replace("return parse(path)", calls_store)})
+    _diff(repo, manifest)
+    graph = manifest.call_graph()
+    assert graph.callees("pkg.a.load") == ["pkg.b.Store.load"]
+    assert graph.callers("pkg.a.parse") == []
+
+
+def test_build_index_keeps_the_collection_in_sync(repo, tmp_path, monkeypatch):
+    monkeypatch.setattr(SystemConfig, "embedding_function", "HashingEmbeddingFunction")
+    monkeypatch.setattr(SystemConfig, "vector_store", "numpy")
+    db_dir = str(tmp_path / "db")
+
+    def build():
+        repo_data = build_index(str(repo), db_dir=db_dir, embedding_cache_path=None)
+        repo_data.retire()
+        return repo_data
+
+    build()
+    _write(repo, {"pkg/a.py": A.replace("return path", "return path.strip()")})
+    (repo / "pkg/b.py").rename(repo / "pkg/store.py")
+    repo_data = build()
+    manifest = IndexManifest.load(db_dir, "code_chunks")
+    assert sorted(manifest.files) == ["pkg/a.py", "pkg/store.py"]
+    assert repo_data.collection.count() == len(manifest.all_chunk_ids())
@@ -0,0 +1,116 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+from repo_qa.ingestion import IngestionPipeline
+
+
+class FakeCollection:
+    def __init__(self, fail_after: int = None):
+        self.ids = []
+        self.fail_after = fail_after
+
+    def add(self, ids, embeddings, documents, metadatas):
+        if self.fail_after is not None and len(self.ids) >= self.fail_after:
+            raise RuntimeError("disk full")
+        assert len(ids) == len(embeddings) == len(documents) == len(metadatas)
+        self.ids.extend(ids)
+
+
+def _blocks(n: int):
+    return ((f"id{i}", f"text {i}", {"i": i}) for i in range(n))
+
+
+def _embed(texts):
+    return [[float(len(text))] for text in texts]
+
+
+def _run_in_thread(pipeline, blocks, timeout=10):
+    outcome = {}
+
+    def target():
+        try:
+            outcome["summary"] = pipeline.run(blocks)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the pipeline deadlocked"
+    return outcome
+
+
+def test_single_worker_writes_blocks_in_order():
+    collection = FakeCollection()
+    pipeline = IngestionPipeline(collection, _embed, embedding_batch_size=3, db_write_batch_size=5,
+                                 embedding_workers=1)
+    summary = pipeline.run(_blocks(23))
+    assert collection.ids == [f"id{i}" for i in range(23)]
+    assert summary["total"]["items"] == 23
+
+
+def test_many_workers_write_every_block_once():
+    collection = FakeCollection()
+    pipeline = IngestionPipeline(collection, _embed, embedding_batch_size=2, db_write_batch_size=7,
+                                 embedding_workers=4)
+    pipeline.run(_blocks(101))
+    assert sorted(collection.ids) == sorted(f"id{i}" for i in range(101))
+
+
+def test_slow_embedder_applies_back_pressure():
+    release = threading.Event()
+    produced = itertools.count()
+    taken = []
+
+    def blocks():
+        for block in _blocks(1000):
+            taken.append(next(produced))
+            yield block
+
+    def slow_embed(texts):
+        release.wait()
+        return _embed(texts)
+
+    pipeline = IngestionPipeline(FakeCollection(), slow_embed, embedding_batch_size=2, embedding_workers=1,
+                                 queue_size=2)
+    outcome = {}
+    thread = threading.Thread(target=lambda: outcome.update(summary=pipeline.run(blocks())), daemon=True)
+    thread.start()
+    time.sleep(0.5)
+    # one batch in the worker, 'queue_size' queued, one waiting to be queued by the producer
+    assert len(taken) <= (1 + 2 + 1) * 2
+    release.set()
+    thread.join(10)
+    assert outcome["summary"]["total"]["items"] == 1000
+
+
+def test_embedding_error_stops_every_stage():
+    def failing_embed(texts):
+        if any(text == "text 10" for text in texts):
+            raise ValueError("rate limited")
+        return _embed(texts)
+
+    pipeline = IngestionPipeline(FakeCollection(), failing_embed, embedding_batch_size=5, embedding_workers=3,
+                                 queue_size=1)
+    # the producer would never finish on its own
+    outcome = _run_in_thread(pipeline, ((f"id{i}", f"text {i}", {}) for i in itertools.count()))
+    assert isinstance(outcome.get("error"), ValueError)
+
+
+def test_write_error_stops_every_stage():
+    pipeline = IngestionPipeline(FakeCollection(fail_after=4), _embed, embedding_batch_size=2,
+                                 db_write_batch_size=4, embedding_workers=2, queue_size=1)
+    outcome = _run_in_thread(pipeline, ((f"id{i}", f"text {i}", {}) for i in itertools.count()))
+    assert isinstance(outcome.get("error"), RuntimeError)
+
+
+def test_producer_error_is_raised():
+    def blocks():
+        yield from _blocks(3)
+        raise OSError("unreadable file")
+
+    with pytest.raises(OSError):
+        IngestionPipeline(FakeCollection(), _embed, embedding_batch_size=2).run(blocks())
@@ -0,0 +1,36 @@
+from repo_qa.lexical import LexicalIndex, reciprocal_rank_fusion, term_counts
+
+
+def _index() -> LexicalIndex:
+    chunks = {
+        "id_build": ("repo_qa.indexing.build_index", "def build_index(repo_path):\n    manifest = load_manifest()"),
+        "id_load": ("repo_qa.indexing.load_index", "def load_index(db_dir):\n    return open_collection(db_dir)"),
+        "id_cache": ("repo_qa.cache.EmbeddingCache", "class EmbeddingCache:\n    def get_many(self, texts): ..."),
+    }
+    return LexicalIndex.from_chunks(
+        (doc_id, name, term_counts(text)) for doc_id, (name, text) in chunks.items()
+    )
+
+
+def test_identifier_parts_are_searchable():
+    index = _index()
+    assert index.search("build index")[0] == "id_build"
+    assert index.search("embeddingCache")[0] == "id_cache"
+    assert set(index.search("index")) == {"id_build", "id_load"}
+    assert index.search("nothing matches this") == []
+
+
+def test_exact_identifier_references():
+    index = _index()
+    assert index.exact_matches("what does `build_index` return?") == ["id_build"]
+    assert index.exact_matches("where is EmbeddingCache used?") == ["id_cache"]
+    # plain english words are not treated as references
+    assert index.exact_matches("how does the cache work?") == []
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    # "b" is second in both lists, "a" and "c" are first in one
+    fused = reciprocal_rank_fusion([["a", "b"], ["c", "b", "d"]], k=60)
+    assert fused[0] == "b"
+    assert set(fused[1:3]) == {"a", "c"}
+    assert fused[-1] == "d"
@@ -0,0 +1,67 @@
+from repo_qa.line_index import LineRangeIndex, changed_line_ranges
+
+# git diff of a deleted file and of a file with a line modified, two lines inserted and a line deleted
+DIFF = """\
+diff --git a/gone.py b/gone.py
+deleted file mode 100644
+index 422c2b7..0000000
+--- a/gone.py
++++ /dev/null
+@@ -1,2 +0,0 @@
+-a
+-b
+diff --git a/mod.py b/mod.py
+index ac9837c..618f2a5 100644
+--- a/mod.py
++++ b/mod.py
+@@ -2,12 +2,14 @@ line 1
+ line 2
+ line 3
+ line 4
+-line 5
++line 5 changed
+ line 6
+ line 7
+ line 8
+ line 9
+ line 10
++inserted 1
++inserted 2
+ line 11
+ line 12
+ line 13
+@@ -21,7 +23,6 @@ line 20
+ line 21
+ line 22
+ line 23
+-line 24
+ line 25
+ line 26
+ line 27
+"""
+
+
+def test_ranges_cover_changed_lines_only():
+    assert changed_line_ranges(DIFF) == [("mod.py", 5, 5), ("mod.py", 11, 12), ("mod.py", 25, 25)]
+
+
+def test_added_line_starting_with_plus_plus_stays_in_its_hunk():
+    diff = """\
+--- a/notes.md
++++ b/notes.md
+@@ -1,2 +1,3 @@
+ title
++++ not a file header
+ end
+"""
+    assert changed_line_ranges(diff) == [("notes.md", 2, 2)]
+
+
+def test_context_lines_do_not_reach_neighbouring_chunks():
+    index = LineRangeIndex.from_chunks(
+        [("mod.py", "first", 1, 4), ("mod.py", "second", 5, 9), ("mod.py", "third", 10, 30)],
+        ["first", "second", "third"],
+    )
+    touched = [doc_id for rel_path, first, last in changed_line_ranges(DIFF)
+               for doc_id in index.overlapping(rel_path, first, last)]
+    assert touched == ["second", "third", "third"]
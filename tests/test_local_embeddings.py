@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from repo_qa.config import SystemConfig
+from repo_qa.embeddings import HashingEmbeddingFunction, get_embedding_provider
+from repo_qa.indexing import _create_embedder
+
+
+def test_vectors_are_deterministic_unit_length():
+    texts = ["def build_index(repo_path):\n    return walk(repo_path)", "", "class RepoRegistry: pass"]
+    first = np.asarray(HashingEmbeddingFunction(dim=256)(texts))
+    second = np.asarray(HashingEmbeddingFunction(dim=256)(texts))
+    assert first.shape == (3, 256)
+    assert np.array_equal(first, second)
+    assert np.allclose(np.linalg.norm(first[[0, 2]], axis=1), 1.0)
+    assert not first[1].any()
+
+
+def test_texts_sharing_identifiers_are_closer():
+    embed = HashingEmbeddingFunction()
+    question, related, unrelated = np.asarray(embed([
+        "how does buildIndex walk the repo?",
+        "def build_index(repo_path):\n    files = walk_repo(repo_path)",
+        "class AnswerCache:\n    def lookup(self, embedding): ...",
+    ]))
+    assert question @ related > question @ unrelated
+
+
+def test_batches_do_not_change_vectors():
+    embed = HashingEmbeddingFunction()
+    texts = [f"def function_{i}(argument_{i}): return {i}" for i in range(5)]
+    together = np.asarray(embed(texts))
+    alone = np.asarray([embed([text])[0] for text in texts])
+    assert np.allclose(together, alone)
+
+
+def test_local_provider_needs_no_key_and_no_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(SystemConfig, "embedding_function", "HashingEmbeddingFunction")
+    embedder, cache, model_id = _create_embedder(None, None, str(tmp_path / "cache.sqlite"))
+    assert isinstance(embedder, HashingEmbeddingFunction)
+    assert cache is None and not (tmp_path / "cache.sqlite").exists()
+    assert model_id.startswith("hashing-")
+    assert len(embedder(["x = 1"])[0]) == SystemConfig.local_embedding_dim
+
+
+def test_unknown_provider_is_rejected():
+    with pytest.raises(ValueError):
+        get_embedding_provider("NoSuchEmbeddingFunction")
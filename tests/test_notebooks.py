@@ -0,0 +1,70 @@
+import ast
+import json
+
+from repo_qa.notebooks import cell_spans, notebook_script
+from repo_qa.parsing import parse_file
+
+PNG = "iVBORw0KGgo" + "A" * 5000
+
+NOTEBOOK = {
+    "nbformat": 4,
+    "cells": [
+        {"cell_type": "markdown", "source": ["# Loading\n", "Reads the data."]},
+        {
+            "cell_type": "code", "execution_count": 1,
+            "source": ["%matplotlib inline\n", "def load(path):\n", "    return clean(path)\n"],
+            "outputs": [],
+        },
+        {
+            "cell_type": "code", "execution_count": 2,
+            "source": "def clean(path):\n    return path.strip()\n\nload(' data ')",
+            "outputs": [
+                {"output_type": "execute_result", "data": {"text/plain": ["'data'"]}},
+                {"output_type": "display_data", "data": {"image/png": PNG, "text/plain": "<Figure>"}},
+                {"output_type": "stream", "name": "stdout", "text": ["x" * 5000]},
+            ],
+        },
+        {"cell_type": "code", "execution_count": 3, "source": "for x in", "outputs": [
+            {"output_type": "error", "ename": "SyntaxError", "evalue": "invalid syntax",
+             "traceback": ["\u001b[0;31m" + "frame\n" * 100]},
+        ]},
+    ],
+}
+
+
+def test_script_is_python_without_heavy_outputs():
+    script = notebook_script(json.dumps(NOTEBOOK))
+    ast.parse(script)
+    assert "iVBORw0KGgo" not in script and "frame" not in script
+    assert "# %matplotlib inline" in script
+    assert "# for x in" in script
+    assert "# Out: 'data'" in script
+    assert "(output truncated)" in script
+    assert len(script) < 2000
+
+
+def test_cell_spans_cover_every_cell():
+    lines = notebook_script(json.dumps(NOTEBOOK)).split("\n")
+    spans = cell_spans(lines)
+    assert [kind for kind, _, _ in spans] == ["markdown", "code", "code", "code"]
+    assert all(end >= start for _, start, end in spans)
+    assert [start for _, start, _ in spans[1:]] == [end + 1 for _, _, end in spans[:-1]]
+
+
+def test_notebook_definitions_join_the_call_graph(tmp_path):
+    path = tmp_path / "analysis.ipynb"
+    path.write_text(json.dumps(NOTEBOOK))
+    parsed = parse_file((str(path), "analysis.ipynb", None))
+    assert parsed.error is None
+    assert parsed.defined == ["analysis.clean", "analysis.load"]
+    assert parsed.calls["analysis.load"] == ["analysis.clean"]
+    block_types = {metadata["name"]: metadata["block_type"] for _, metadata in parsed.blocks}
+    assert block_types["load"] == block_types["clean"] == "function"
+    assert any(block_type == "cells" for block_type in block_types.values())
+    assert not any("iVBORw0KGgo" in text for text, _ in parsed.blocks)
+
+
+def test_a_file_that_is_not_a_notebook_is_reported(tmp_path):
+    path = tmp_path / "broken.ipynb"
+    path.write_text("{\"cells\": 3}")
+    assert parse_file((str(path), "broken.ipynb", None)).error.startswith("not a notebook")
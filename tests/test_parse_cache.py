@@ -0,0 +1,55 @@
+import subprocess
+from pathlib import Path
+
+from repo_qa.parse_cache import ParseCache
+from repo_qa.parsing import parse_blobs
+from repo_qa.walker import iter_revision_blobs
+
+
+def _commit(repo: Path, files: dict, message: str):
+    git = ["git", "-C", str(repo), "-c", "user.name=t", "-c", "user.email=t@t"]
+    for rel_path, source in files.items():
+        (repo / rel_path).write_text(source)
+    subprocess.run(git + ["add", "-A"], check=True)
+    subprocess.run(git + ["commit", "-qm", message], check=True)
+
+
+def _parse(repo: Path, revision: str, cache: ParseCache) -> dict:
+    parsed = parse_blobs(iter_revision_blobs(str(repo), revision), repo, previous_shas={}, cache=cache, workers=1)
+    return {p.rel_path: p for p in parsed}
+
+
+def test_revisions_share_the_parse_of_unchanged_blobs(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    subprocess.run(["git", "init", "-q", str(repo)], check=True)
+    _commit(repo, {"a.py": "def f():\n    return g()\n\ndef g():\n    return 1\n", "b.py": "X = 1\n"}, "first")
+    _commit(repo, {"b.py": "X = 2\n"}, "second")
+
+    cache = ParseCache(str(tmp_path / "parse_cache.sqlite"))
+    first = _parse(repo, "HEAD~1", cache)
+    assert cache.stats() == {"hits": 0, "misses": 2, "hit_rate": 0.0, "entries": 2}
+
+    second = _parse(repo, "HEAD", cache)
+    assert cache.hits == 1 and len(cache) == 3
+    assert second["a.py"].blocks == first["a.py"].blocks
+    assert second["a.py"].calls == first["a.py"].calls == {"a.f": ["a.g"]}
+    assert second["b.py"].sha != first["b.py"].sha
+    cache.close()
+
+    # shared through the file
+    reopened = ParseCache(str(tmp_path / "parse_cache.sqlite"))
+    assert len(reopened) == 3
+    assert _parse(repo, "HEAD", reopened)["b.py"].blocks == second["b.py"].blocks
+    assert reopened.hits == 2
+
+
+def test_least_recently_used_blobs_are_evicted(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    subprocess.run(["git", "init", "-q", str(repo)], check=True)
+    _commit(repo, {f"m{i}.py": f"X = {i}\n" for i in range(5)}, "first")
+
+    cache = ParseCache(str(tmp_path / "parse_cache.sqlite"), max_entries=3)
+    _parse(repo, "HEAD", cache)
+    assert len(cache) == 3
@@ -0,0 +1,54 @@
+import subprocess
+
+from repo_qa.registry import RepoRegistry
+from repo_qa.walker import resolve_revision
+
+
+class FakeRepoData:
+    def __init__(self):
+        self.retired = False
+
+    def estimated_bytes(self) -> int:
+        return 1
+
+    def retire(self):
+        self.retired = True
+
+
+def _registry(tmp_path) -> RepoRegistry:
+    return RepoRegistry(db_root=str(tmp_path / "db"), loader=lambda repo_dir: FakeRepoData())
+
+
+def test_revision_index_does_not_replace_the_default(tmp_path):
+    registry = _registry(tmp_path)
+    registry.swap("app", str(tmp_path), FakeRepoData())
+    registry.swap("app-v1", str(tmp_path), FakeRepoData(), revision="0" * 40)
+    assert registry.resolve(None) == "app"
+    registry.swap("lib", str(tmp_path), FakeRepoData())
+    assert registry.resolve(None) == "lib"
+    # persisted
+    assert _registry(tmp_path).default == "lib"
+
+
+def test_revision_index_is_the_default_when_there_is_none(tmp_path):
+    registry = _registry(tmp_path)
+    registry.swap("app-v1", str(tmp_path), FakeRepoData(), revision="0" * 40)
+    assert registry.resolve(None) == "app-v1"
+
+
+def test_swap_lists_the_commit_and_unloads_the_old_index(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "a.py").write_text("x = 1\n")
+    git = ["git", "-C", str(repo), "-c", "user.name=t", "-c", "user.email=t@t"]
+    subprocess.run(git + ["init", "-q"], check=True)
+    subprocess.run(git + ["add", "a.py"], check=True)
+    subprocess.run(git + ["commit", "-qm", "first"], check=True)
+    commit = resolve_revision(str(repo), "HEAD")
+
+    registry = _registry(tmp_path)
+    old = FakeRepoData()
+    registry.swap("repo-HEAD", str(repo), old, revision=commit)
+    registry.swap("repo-HEAD", str(repo), FakeRepoData(), revision=commit)
+    assert registry.describe()[0]["repo_path"] == f"{repo.resolve()}@{commit}"
+    assert old.retired
@@ -0,0 +1,37 @@
+import numpy as np
+
+from repo_qa.callgraph import CallGraph
+from repo_qa.lexical import LexicalIndex
+from repo_qa.line_index import LineRangeIndex
+from repo_qa.snapshot import IndexSnapshot
+
+
+def _snapshot() -> IndexSnapshot:
+    call_graph = CallGraph.from_edges(["pkg.a", "pkg.b"], np.array([0]), np.array([1]))
+    lexical_index = LexicalIndex.from_chunks([("id_a", "pkg.a", {"build": 2}), ("id_b", "pkg.b", {"index": 1})])
+    line_index = LineRangeIndex.from_chunks([("pkg.py", "id_a", 1, 5), ("pkg.py", "id_b", 7, 9)],
+                                            lexical_index.doc_ids)
+    return IndexSnapshot("/repo", "model", call_graph, lexical_index, line_index)
+
+
+def test_round_trip(tmp_path):
+    manifest = tmp_path / "chunks_manifest.json"
+    manifest.write_text("{}")
+    _snapshot().save(str(tmp_path), "chunks", manifest)
+    _snapshot().save(str(tmp_path), "chunks", manifest)
+
+    loaded = IndexSnapshot.load(str(tmp_path), "chunks", manifest)
+    assert loaded.call_graph.callees("pkg.a") == ["pkg.b"]
+    assert loaded.name_index() == {"pkg.a": ["id_a"], "pkg.b": ["id_b"]}
+    assert loaded.line_index.overlapping("pkg.py", 8, 8) == ["id_b"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["chunks.snapshot", "chunks_manifest.json"]
+
+
+def test_interrupted_save_is_recovered(tmp_path):
+    manifest = tmp_path / "chunks_manifest.json"
+    manifest.write_text("{}")
+    _snapshot().save(str(tmp_path), "chunks", manifest)
+    (tmp_path / "chunks.snapshot").rename(tmp_path / "chunks.snapshot.old-abc")
+
+    loaded = IndexSnapshot.load(str(tmp_path), "chunks", manifest)
+    assert loaded is not None and loaded.call_graph.callers("pkg.b") == ["pkg.a"]
@@ -0,0 +1,73 @@
+from repo_qa.config import SystemConfig
+from repo_qa.walker import IgnoreRules, iter_source_files
+
+
+def test_unanchored_pattern_matches_at_any_depth():
+    rules = IgnoreRules(["*.log", "build"])
+    assert rules.match("app.log", False)
+    assert rules.match("src/deep/app.log", False)
+    assert rules.match("src/build", True)
+    assert rules.match("src/app.py", False) is None
+
+
+def test_anchored_pattern_only_matches_below_its_directory():
+    rules = IgnoreRules(["/dist", "docs/*.md"])
+    assert rules.match("dist", True)
+    assert rules.match("src/dist", True) is None
+    assert rules.match("docs/index.md", False)
+    assert rules.match("docs/api/index.md", False) is None
+    assert rules.match("src/docs/index.md", False) is None
+
+
+def test_nested_file_patterns_are_relative_to_their_directory():
+    rules = IgnoreRules()
+    rules.add_patterns(["/generated", "*.tmp"], base="pkg")
+    assert rules.match("pkg/generated", True)
+    assert rules.match("generated", True) is None
+    assert rules.match("pkg/sub/a.tmp", False)
+    assert rules.match("a.tmp", False) is None
+
+
+def test_negation_and_last_match_wins():
+    rules = IgnoreRules(["*.py", "!keep.py"])
+    assert rules.match("drop.py", False)
+    assert rules.match("src/keep.py", False) is False
+    rules.add_patterns(["keep.py"], base="src")
+    assert rules.match("src/keep.py", False)
+    assert rules.match("keep.py", False) is False
+
+
+def test_directory_only_pattern_does_not_match_files():
+    rules = IgnoreRules(["cache/"])
+    assert rules.match("cache", True)
+    assert rules.match("cache", False) is None
+
+
+def test_double_star_and_character_classes():
+    rules = IgnoreRules(["a/**/b.py", "v[0-9].txt", "x[!a].md"])
+    assert rules.match("a/b.py", False)
+    assert rules.match("a/x/y/b.py", False)
+    assert rules.match("v1.txt", False)
+    assert rules.match("vx.txt", False) is None
+    assert rules.match("xb.md", False)
+    assert rules.match("xa.md", False) is None
+
+
+def test_include_patterns_select_files_below_a_directory():
+    rules = IgnoreRules(["src/"])
+    assert rules.matches_path_or_parent("src/pkg/mod.py")
+    assert not rules.matches_path_or_parent("tests/test_mod.py")
+
+
+def test_walk_prunes_gitignored_and_excluded_directories(tmp_path, monkeypatch):
+    monkeypatch.setattr(SystemConfig, "db_root", str(tmp_path / "db_dir"))
+    (tmp_path / ".gitignore").write_text("generated/\n*.py\n!keep.py\n")
+    for rel_path in ("keep.py", "drop.py", "generated/keep.py", "node_modules/keep.py", "notes.md", "blob.md"):
+        path = tmp_path / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("x = 1\n")
+    (tmp_path / "blob.md").write_bytes(b"\0binary")
+
+    found = sorted(p.relative_to(tmp_path).as_posix() for p in iter_source_files(str(tmp_path)))
+    # ".gitignore" itself is an extensionless text file, those are indexed
+    assert found == [".gitignore", "keep.py", "notes.md"]